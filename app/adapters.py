@@ -0,0 +1,192 @@
+"""
+QLORAX Adapter Registry
+One base model in memory, many named LoRA adapters loaded on demand
+"""
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# PEFT's name for "no adapter" in a mixed-adapter batch
+BASE_ADAPTER = "__base__"
+
+
+def read_adapter_config(adapter_path: str) -> Optional[dict]:
+    """adapter_config.json of a PEFT checkpoint, or None if the path is not an adapter"""
+    config_path = Path(adapter_path) / "adapter_config.json"
+    if not config_path.exists():
+        return None
+    with open(config_path, "r") as f:
+        return json.load(f)
+
+
+class AdapterRegistry:
+    """Named LoRA adapters on top of a shared base model.
+
+    Registering an adapter only records its path; weights are loaded into
+    the model the first time a request needs them and evicted least
+    recently used once more than max_loaded are resident. Adapters pinned
+    by in-flight requests are never evicted, so a batch can always mix
+    any adapters it was admitted with.
+
+    Re-registering an adapter in use lets its in-flight requests finish on
+    the old weights; new requests for it wait until they have, then load the
+    new checkpoint.
+
+    on_change(name) is called whenever an adapter's weights are replaced or
+    removed, so state computed with the old weights (prefix and session KV
+    caches) can be dropped.
+    """
+
+    def __init__(self, base_model, base_model_name: str, max_loaded: int = 4,
+                 model_lock: Optional[threading.RLock] = None,
+                 on_change: Optional[Callable[[str], None]] = None):
+        self.model = base_model
+        self.base_model_name = base_model_name
+        self.max_loaded = max(1, max_loaded)
+        self.on_change = on_change
+
+        self.paths: Dict[str, str] = {}
+        self._loaded: "OrderedDict[str, None]" = OrderedDict()
+        self._pins: Dict[str, int] = {}
+        # Re-registered while pinned: unloaded once the requests using the old weights finish
+        self._stale: set = set()
+        # Shared with whoever runs forward passes: weights must not change mid-forward
+        self._lock = model_lock or threading.RLock()
+        self._drained = threading.Condition(self._lock)
+
+        self.loads = 0
+        self.evictions = 0
+
+    @property
+    def is_peft(self) -> bool:
+        return hasattr(self.model, "peft_config")
+
+    @property
+    def loaded(self) -> List[str]:
+        return list(self._loaded)
+
+    def register(self, name: str, adapter_path: str):
+        """Make an adapter available under a name without loading its weights yet"""
+        if name == BASE_ADAPTER:
+            raise ValueError(f"'{BASE_ADAPTER}' is reserved for the base model")
+        config = read_adapter_config(adapter_path)
+        if config is None:
+            raise ValueError(f"No adapter_config.json found in {adapter_path}")
+
+        base = config.get("base_model_name_or_path")
+        if base and self.base_model_name and base != self.base_model_name:
+            logger.warning(
+                f"Adapter {name} was trained on {base}, serving it on {self.base_model_name}"
+            )
+
+        with self._lock:
+            replaced = name in self.paths
+            if name in self._loaded:
+                # The checkpoint may have been retrained in place, so never keep the old weights
+                if self._pins.get(name):
+                    self._stale.add(name)
+                else:
+                    self._unload(name)
+            self.paths[name] = adapter_path
+            if replaced:
+                self._changed(name)
+        logger.info(f"Registered adapter {name} from {adapter_path}")
+
+    def unregister(self, name: str) -> bool:
+        with self._lock:
+            if name not in self.paths:
+                return False
+            if self._pins.get(name):
+                raise RuntimeError(f"Adapter {name} is in use")
+            if name in self._loaded:
+                self._unload(name)
+            del self.paths[name]
+            self._changed(name)
+            return True
+
+    def acquire(self, name: str) -> str:
+        """Make sure an adapter is loaded and pin it for the duration of a request"""
+        with self._lock:
+            if name == BASE_ADAPTER:
+                return name
+            if name not in self.paths:
+                raise KeyError(name)
+            # New requests queue until the old weights' last request is done, so a steady
+            # stream of pins cannot keep the retrained checkpoint from ever being served
+            while name in self._stale:
+                self._drained.wait()
+            if name not in self.paths:
+                raise KeyError(name)
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+            else:
+                self._load(name)
+            self._pins[name] = self._pins.get(name, 0) + 1
+            return name
+
+    def release(self, name: str):
+        with self._lock:
+            if name in self._pins:
+                self._pins[name] -= 1
+                if self._pins[name] <= 0:
+                    del self._pins[name]
+                    if name in self._stale:
+                        # Last request on the old weights is done; caches it filled are stale too
+                        self._unload(name)
+                        self._changed(name)
+                        self._drained.notify_all()
+                    # Catch up on evictions deferred while adapters were pinned
+                    self._evict(keep=None)
+
+    def _load(self, name: str):
+        from peft import PeftModel
+
+        path = self.paths[name]
+        if self.is_peft:
+            self.model.load_adapter(path, adapter_name=name)
+        else:
+            # First adapter wraps the base model; later ones are injected into the same modules
+            self.model = PeftModel.from_pretrained(self.model, path, adapter_name=name)
+        self.model.eval()
+        self._loaded[name] = None
+        self.loads += 1
+        # Evict after loading, so the model is never left without an adapter
+        self._evict(keep=name)
+        logger.info(f"Loaded adapter {name} ({len(self._loaded)}/{self.max_loaded} resident)")
+
+    def _unload(self, name: str):
+        self.model.delete_adapter(name)
+        self._loaded.pop(name, None)
+        self._stale.discard(name)
+
+    def _changed(self, name: str):
+        if self.on_change is not None:
+            self.on_change(name)
+
+    def _evict(self, keep: Optional[str]):
+        for name in list(self._loaded):
+            if len(self._loaded) <= self.max_loaded:
+                break
+            if name == keep or self._pins.get(name):
+                continue
+            self._unload(name)
+            self.evictions += 1
+            logger.info(f"Evicted adapter {name}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "base_model": self.base_model_name,
+                "registered": sorted(self.paths),
+                "loaded": self.loaded,
+                "max_loaded": self.max_loaded,
+                "pinned": dict(self._pins),
+                "loads": self.loads,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,163 @@
+"""
+QLORAX Admission Control
+Bounded generation worker pool, per-request deadlines and queue-depth load shedding
+"""
+
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# How often a waiting request checks whether its client is still connected
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+class ClientDisconnected(Exception):
+    """The client went away before its generation finished"""
+
+
+class AdmissionController:
+    """Decides whether a generation request may enter the queue and supervises it once admitted.
+
+    Requests are rejected with 429 once the number in flight reaches
+    max_queue_depth, and with 503 when the estimated queue wait already
+    exceeds the request's deadline, so overload shows up as fast failures
+    rather than piles of requests that will time out anyway.
+    """
+
+    def __init__(self, max_workers: int = 1, max_queue_depth: int = 32,
+                 default_timeout: float = 60.0):
+        self.max_workers = max(1, max_workers)
+        self.max_queue_depth = max(1, max_queue_depth)
+        self.default_timeout = default_timeout
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="qlorax-generate"
+        )
+
+        # Number of requests that can be served in parallel; the API raises
+        # this to the engine's batch size when continuous batching is on
+        self.service_slots = self.max_workers
+
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.cancelled = 0
+        self.avg_service_time: Optional[float] = None
+
+    def estimated_wait(self) -> float:
+        """Rough time a newly admitted request would spend queued"""
+        if self.avg_service_time is None:
+            return 0.0
+        queued = max(0, self.in_flight - self.service_slots + 1)
+        return queued * self.avg_service_time / self.service_slots
+
+    def acquire(self, timeout: Optional[float] = None) -> float:
+        """Admit a request or raise 429/503; returns the admission timestamp"""
+        timeout = timeout or self.default_timeout
+
+        if self.in_flight >= self.max_queue_depth:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail=f"Too many requests in flight ({self.in_flight}), retry later",
+                headers={"Retry-After": str(max(1, round(self.estimated_wait())))}
+            )
+
+        wait = self.estimated_wait()
+        if wait > timeout:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail=f"Estimated queue wait {wait:.1f}s exceeds request deadline {timeout:.1f}s",
+                headers={"Retry-After": str(max(1, round(wait)))}
+            )
+
+        self.in_flight += 1
+        self.admitted += 1
+        return time.time()
+
+    def release(self, admitted_at: float, completed: bool = True):
+        """Return a slot; completed requests update the service time estimate"""
+        self.in_flight = max(0, self.in_flight - 1)
+        if completed:
+            elapsed = time.time() - admitted_at
+            if self.avg_service_time is None:
+                self.avg_service_time = elapsed
+            else:
+                self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * elapsed
+
+    async def run(self, awaitable: Awaitable, timeout: Optional[float] = None,
+                  is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None):
+        """Await a generation with a deadline, cancelling it if the client disconnects"""
+        timeout = timeout or self.default_timeout
+        task = asyncio.ensure_future(awaitable)
+        deadline = time.time() + timeout
+
+        try:
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.timed_out += 1
+                    raise HTTPException(
+                        status_code=504, detail=f"Generation exceeded deadline of {timeout:.1f}s"
+                    )
+
+                done, _ = await asyncio.wait({task}, timeout=min(remaining, DISCONNECT_POLL_INTERVAL))
+                if task in done:
+                    return task.result()
+
+                if is_disconnected is not None and await is_disconnected():
+                    self.cancelled += 1
+                    raise ClientDisconnected()
+        finally:
+            if not task.done():
+                # Propagates to the engine / worker, which stop generating at the next token
+                task.cancel()
+
+    async def stream(self, chunks: AsyncIterator, timeout: Optional[float] = None) -> AsyncIterator:
+        """Relay a chunk stream until it ends or the deadline passes"""
+        timeout = timeout or self.default_timeout
+        deadline = time.time() + timeout
+        iterator = chunks.__aiter__()
+
+        try:
+            while True:
+                remaining = deadline - time.time()
+                try:
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    chunk = await asyncio.wait_for(iterator.__anext__(), remaining)
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    self.timed_out += 1
+                    raise HTTPException(
+                        status_code=504, detail=f"Generation exceeded deadline of {timeout:.1f}s"
+                    )
+                yield chunk
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client disconnected mid-stream
+            self.cancelled += 1
+            raise
+        finally:
+            await iterator.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_queue_depth": self.max_queue_depth,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "cancelled": self.cancelled,
+            "avg_service_time": self.avg_service_time
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
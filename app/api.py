@@ -4,11 +4,15 @@ Production-ready API for the QLORAX MLOps platform
 """
 
 import os
+import gc
 import sys
 import time
+import asyncio
+import contextlib
 import logging
+import threading
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
 import traceback
 
 # Add project root to Python path
@@ -16,21 +20,28 @@ project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
 try:
-    from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends
+    from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Request, WebSocket, WebSocketDisconnect
     from fastapi.middleware.cors import CORSMiddleware
-    from fastapi.responses import JSONResponse
+    from fastapi.responses import JSONResponse, Response, StreamingResponse
     from pydantic import BaseModel
     import uvicorn
 except ImportError as e:
     print(f"Error importing FastAPI dependencies: {e}")
     print("Installing required packages...")
     os.system("pip install fastapi uvicorn[standard] pydantic")
-    from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends
+    from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Request, WebSocket, WebSocketDisconnect
     from fastapi.middleware.cors import CORSMiddleware
-    from fastapi.responses import JSONResponse
+    from fastapi.responses import JSONResponse, Response, StreamingResponse
     from pydantic import BaseModel
     import uvicorn
 
+from app import metrics
+from app.adapters import AdapterRegistry, BASE_ADAPTER, read_adapter_config
+from app.admission import AdmissionController, ClientDisconnected
+from app.prefix_cache import PrefixCache
+from app.response_cache import InMemoryBackend, RedisBackend, ResponseCache, sentence_embedder
+from app.sessions import SessionStore
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -38,13 +49,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the model on a background thread at startup so probes answer immediately"""
+    if EAGER_LOAD:
+        threading.Thread(target=startup_load, name="qlorax-model-load", daemon=True).start()
+    yield
+    if model_manager is not None:
+        model_manager.stop_engine()
+
 # FastAPI app
 app = FastAPI(
     title="QLORAX MLOps Platform",
     description="Production-ready API for QLoRA fine-tuning and inference",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -55,10 +76,64 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Startup loading: model to serve (default: first trained model found) and
+# whether to load it when the server starts rather than on POST /load_model
+MODEL_PATH = os.getenv("QLORAX_MODEL_PATH") or None
+EAGER_LOAD = os.getenv("QLORAX_EAGER_LOAD", "true").lower() in ("1", "true", "yes")
+
+# Continuous batching settings
+BATCHING_ENABLED = os.getenv("QLORAX_BATCHING", "true").lower() in ("1", "true", "yes")
+MAX_BATCH_SIZE = int(os.getenv("QLORAX_MAX_BATCH_SIZE", "8"))
+MAX_QUEUE_WAIT_MS = float(os.getenv("QLORAX_MAX_QUEUE_WAIT_MS", "10"))
+
+# Admission control settings
+GENERATION_WORKERS = int(os.getenv("QLORAX_GENERATION_WORKERS", "1"))
+MAX_QUEUE_DEPTH = int(os.getenv("QLORAX_MAX_QUEUE_DEPTH", "32"))
+REQUEST_TIMEOUT = float(os.getenv("QLORAX_REQUEST_TIMEOUT", "60"))
+
+# Multi-turn session settings
+SESSION_CACHE_MB = float(os.getenv("QLORAX_SESSION_CACHE_MB", "512"))
+SESSION_TTL = float(os.getenv("QLORAX_SESSION_TTL", "1800"))
+
+# Prompt construction and shared-prefix KV cache
+SYSTEM_PROMPT = os.getenv("QLORAX_SYSTEM_PROMPT", "")
+PROMPT_TEMPLATE = os.getenv("QLORAX_PROMPT_TEMPLATE", "{message}{eos_token}")
+PREFIX_CACHE_MB = float(os.getenv("QLORAX_PREFIX_CACHE_MB", "256"))
+
+# Response cache for repeated questions: off, memory or redis
+RESPONSE_CACHE = os.getenv("QLORAX_RESPONSE_CACHE", "off").lower()
+RESPONSE_CACHE_SIZE = int(os.getenv("QLORAX_RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("QLORAX_RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.getenv("QLORAX_RESPONSE_CACHE_MAX_TEMPERATURE", "0.3"))
+SEMANTIC_CACHE_MODEL = os.getenv("QLORAX_SEMANTIC_CACHE_MODEL", "")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("QLORAX_SEMANTIC_CACHE_THRESHOLD", "0.95"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Multi-adapter serving: LoRA adapters resident at once, and extra adapters
+# to register at startup as "name=path,name=path"
+MAX_LOADED_ADAPTERS = int(os.getenv("QLORAX_MAX_LOADED_ADAPTERS", "4"))
+ADAPTERS = os.getenv("QLORAX_ADAPTERS", "")
+
+# Model reload: warm-up prompt lengths (tokens) and generated tokens per warm-up
+# request, and how long to wait for in-flight requests on the old model
+WARMUP_LENGTHS = [int(n) for n in os.getenv("QLORAX_WARMUP_LENGTHS", "16,128").split(",") if n.strip()]
+WARMUP_NEW_TOKENS = int(os.getenv("QLORAX_WARMUP_NEW_TOKENS", "8"))
+DRAIN_TIMEOUT = float(os.getenv("QLORAX_DRAIN_TIMEOUT", "60"))
 
 # Global variables for model management
 model_manager = None
+admission = AdmissionController(
+    max_workers=GENERATION_WORKERS,
+    max_queue_depth=MAX_QUEUE_DEPTH,
+    default_timeout=REQUEST_TIMEOUT
+)
 training_status = {"status": "idle", "message": "No training in progress"}
+reload_status = {"status": "idle", "message": "No model loaded yet", "progress": 0.0}
+metrics.register_collector(lambda: model_manager, admission)
+# Serializes reloads; swapping the global model_manager itself is a single assignment
+reload_lock = threading.Lock()
 
 # Pydantic models
 class HealthResponse(BaseModel):
@@ -74,11 +149,21 @@ class ChatRequest(BaseModel):
     max_length: Optional[int] = 100
     temperature: Optional[float] = 0.7
     top_p: Optional[float] = 0.9
+    timeout: Optional[float] = None  # seconds, defaults to QLORAX_REQUEST_TIMEOUT
+    session_id: Optional[str] = None  # continue a multi-turn conversation
+    adapter: Optional[str] = None  # registered LoRA adapter, defaults to the loaded one
 
 class ChatResponse(BaseModel):
     response: str
     processing_time: float
     model_name: str
+    session_id: Optional[str] = None
+    adapter: Optional[str] = None
+    cached: bool = False
+
+class AdapterRequest(BaseModel):
+    name: str
+    path: str
 
 class TrainingRequest(BaseModel):
     config_path: Optional[str] = "configs/production-config.yaml"
@@ -91,21 +176,65 @@ class TrainingStatus(BaseModel):
     progress: Optional[float] = None
     logs: Optional[List[str]] = None
 
+def build_response_cache() -> Optional[ResponseCache]:
+    """Response cache configured by QLORAX_RESPONSE_CACHE, or None when disabled"""
+    if RESPONSE_CACHE in ("", "off", "false", "0"):
+        return None
+    
+    if RESPONSE_CACHE == "redis":
+        backend = RedisBackend(url=REDIS_URL, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+    else:
+        backend = InMemoryBackend(max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+    
+    embed = None
+    if SEMANTIC_CACHE_MODEL:
+        try:
+            embed = sentence_embedder(SEMANTIC_CACHE_MODEL)
+        except Exception as e:
+            logger.warning(f"Semantic cache disabled, could not load {SEMANTIC_CACHE_MODEL}: {e}")
+    
+    logger.info(f"Response cache enabled ({type(backend).__name__}, semantic={embed is not None})")
+    return ResponseCache(
+        backend,
+        max_temperature=RESPONSE_CACHE_MAX_TEMPERATURE,
+        embed=embed,
+        similarity_threshold=SEMANTIC_CACHE_THRESHOLD
+    )
+
 # Model Manager Class
 class ModelManager:
     def __init__(self):
         self.model = None
         self.tokenizer = None
         self.model_name = None
+        self.model_version = None
         self.is_loaded = False
+        self.engine = None
+        # Base model plus named LoRA adapters; default_adapter serves requests that name none
+        self.adapters = None
+        self.default_adapter = None
+        # Serializes forward passes with adapter loading and PEFT's per-call hooks
+        self.model_lock = threading.RLock()
+        self.sessions = SessionStore(
+            max_bytes=int(SESSION_CACHE_MB * 1024 * 1024),
+            ttl=SESSION_TTL
+        )
+        self.prefix_cache = PrefixCache(max_bytes=int(PREFIX_CACHE_MB * 1024 * 1024))
+        self._prompt_parts = None
+        self.response_cache = build_response_cache()
+        # In-flight requests, and the manager that replaced this one after a reload
+        self.active_requests = 0
+        self.successor = None
+        self._idle = threading.Condition()
         
-    def load_model(self, model_path: str = None):
-        """Load the trained model for inference"""
+    def load_model(self, model_path: str = None, adapter_name: Optional[str] = None):
+        """Load a model for inference.
+        
+        For a PEFT adapter the base model named in its adapter_config.json is
+        loaded only if it is not already in memory; the adapter is registered
+        (as adapter_name, or its directory name) and becomes the default.
+        """
         try:
-            import torch
-            from transformers import AutoTokenizer, AutoModelForCausalLM
-            from peft import PeftModel
-            
             # Determine model path
             if model_path is None:
                 # Look for trained model
@@ -122,27 +251,27 @@ class ModelManager:
             
             logger.info(f"Loading model from: {model_path}")
             
-            # Load tokenizer
-            self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-            if self.tokenizer.pad_token is None:
-                self.tokenizer.pad_token = self.tokenizer.eos_token
+            adapter_config = read_adapter_config(model_path) if os.path.isdir(model_path) else None
+            if adapter_config is not None:
+                base_model_name = adapter_config.get("base_model_name_or_path")
+                if not base_model_name:
+                    raise ValueError("Cannot find base model name in adapter config")
+            else:
+                base_model_name = model_path
             
-            # Load model
-            if os.path.exists(model_path) and "adapter_config.json" in os.listdir(model_path):
-                # Load PEFT model
-                base_model = AutoModelForCausalLM.from_pretrained(
-                    "microsoft/DialoGPT-medium",
-                    torch_dtype=torch.float32,
-                    device_map="cpu"
-                )
-                self.model = PeftModel.from_pretrained(base_model, model_path)
+            if self.adapters is None or self.adapters.base_model_name != base_model_name:
+                self.load_base_model(base_model_name)
             else:
-                # Load regular model
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    model_path,
-                    torch_dtype=torch.float32,
-                    device_map="cpu"
-                )
+                logger.info(f"Base model {base_model_name} already loaded, reusing it")
+            
+            if adapter_config is not None:
+                adapter_name = adapter_name or Path(model_path).name
+                self.adapters.register(adapter_name, model_path)
+                self.acquire_adapter(adapter_name)
+                self.release_adapter(adapter_name)
+                self.default_adapter = adapter_name
+            else:
+                self.default_adapter = None
             
             self.model_name = model_path
             self.is_loaded = True
@@ -153,51 +282,617 @@ class ModelManager:
             self.is_loaded = False
             raise
     
+    def load_base_model(self, base_model_name: str):
+        """Load base weights and tokenizer, replacing everything derived from the old model"""
+        import torch
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+        
+        logger.info(f"Loading base model: {base_model_name}")
+        self.stop_engine()
+        self.is_loaded = False
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(base_model_name)
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        
+        self.model = AutoModelForCausalLM.from_pretrained(
+            base_model_name,
+            torch_dtype=torch.float32,
+            device_map="cpu"
+        )
+        self.model.eval()
+        self.model_version = self.describe_version(base_model_name)
+        self.attach_adapters(base_model_name)
+        
+        # Cached attention state and prompt ids belong to the old model
+        self.sessions.clear()
+        self.prefix_cache.clear()
+        self._prompt_parts = None
+        
+        self.warm_prefix_cache()
+        self.start_engine()
+    
+    def attach_adapters(self, base_model_name: str):
+        """Start a fresh adapter registry on the current base model"""
+        self.adapters = AdapterRegistry(
+            self.model, base_model_name,
+            max_loaded=MAX_LOADED_ADAPTERS,
+            model_lock=self.model_lock,
+            on_change=self.forget_adapter
+        )
+        self.default_adapter = None
+        for entry in filter(None, (e.strip() for e in ADAPTERS.split(","))):
+            name, _, path = entry.partition("=")
+            try:
+                self.adapters.register(name.strip(), path.strip())
+            except ValueError as e:
+                logger.warning(f"Skipping adapter {entry}: {e}")
+    
+    def forget_adapter(self, name: str):
+        """Drop prefix and session KV caches computed with an adapter's previous weights"""
+        self.prefix_cache.drop(name)
+        dropped = self.sessions.drop_caches(name)
+        logger.info(f"Adapter {name} changed: dropped its prefix cache and {dropped} session caches")
+    
+    def shares_base(self, model_path: Optional[str]) -> bool:
+        """Whether model_path is an adapter for the base model already loaded"""
+        if self.adapters is None or not model_path or not os.path.isdir(model_path):
+            return False
+        config = read_adapter_config(model_path)
+        return config is not None and config.get("base_model_name_or_path") == self.adapters.base_model_name
+    
+    def resolve_adapter(self, name: Optional[str]) -> Optional[str]:
+        """Adapter a request runs with (None for base weights); 404 for unknown names"""
+        if name is None:
+            return self.default_adapter
+        if name == BASE_ADAPTER:
+            return None
+        if self.adapters is None or name not in self.adapters.paths:
+            raise HTTPException(status_code=404, detail=f"Unknown adapter: {name}")
+        return name
+    
+    def acquire_adapter(self, name: Optional[str]):
+        """Load (if needed) and pin an adapter's weights for one request"""
+        if name is None:
+            return
+        self.adapters.acquire(name)
+        # The first adapter wraps the base model in a PeftModel
+        if self.model is not self.adapters.model:
+            self.model = self.adapters.model
+            if self.engine is not None:
+                self.engine.model = self.model
+    
+    def release_adapter(self, name: Optional[str]):
+        if name is not None:
+            self.adapters.release(name)
+    
+    async def pin_adapter(self, name: Optional[str]) -> Optional[str]:
+        """resolve_adapter + acquire_adapter, loading weights off the event loop"""
+        name = self.resolve_adapter(name)
+        if name is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.acquire_adapter, name)
+        return name
+    
+    def begin_request(self) -> "ModelManager":
+        """Count a request as in flight; returns the manager that should serve it.
+        
+        A request that resolved this manager just before a reload swapped it
+        out is handed to the successor instead of hitting a stopped engine.
+        """
+        with self._idle:
+            if self.successor is None:
+                self.active_requests += 1
+                return self
+            successor = self.successor
+        return successor.begin_request()
+    
+    def end_request(self):
+        with self._idle:
+            self.active_requests -= 1
+            if self.active_requests <= 0:
+                self._idle.notify_all()
+    
+    @contextlib.contextmanager
+    def serving(self):
+        """begin_request/end_request as a context manager"""
+        manager = self.begin_request()
+        try:
+            yield manager
+        finally:
+            manager.end_request()
+    
+    def warm_up(self, lengths: Optional[List[int]] = None, new_tokens: int = WARMUP_NEW_TOKENS):
+        """Run dummy generations at representative prompt lengths so lazy initialisation
+        (allocator growth, kernel selection, adapter loading) happens before real traffic"""
+        lengths = WARMUP_LENGTHS if lengths is None else lengths
+        limit = self.context_window() or max(lengths or [0]) + new_tokens
+        filler = self.tokenizer.encode(" warm up", add_special_tokens=False) or [self.tokenizer.eos_token_id]
+        
+        start_time = time.time()
+        self.acquire_adapter(self.default_adapter)
+        try:
+            for length in lengths:
+                length = max(1, min(length, limit - new_tokens))
+                prompt_ids = (filler * (length // len(filler) + 1))[:length]
+                if self.engine is not None:
+                    self.engine.generate(
+                        prompt_ids, max_new_tokens=new_tokens, temperature=0.0,
+                        ignore_eos=True, adapter=self.default_adapter
+                    )
+                else:
+                    self.generate_ids(prompt_ids, new_tokens, 0.0, 1.0, adapter=self.default_adapter)
+        finally:
+            self.release_adapter(self.default_adapter)
+        logger.info(f"Warm-up finished in {time.time() - start_time:.2f}s (prompt lengths {lengths})")
+    
+    def retire(self, successor: Optional["ModelManager"], timeout: float = DRAIN_TIMEOUT) -> bool:
+        """Hand new requests to successor, wait for in-flight ones, then free the model"""
+        with self._idle:
+            self.successor = successor
+            drained = self._idle.wait_for(lambda: self.active_requests <= 0, timeout)
+        if not drained:
+            logger.warning(f"{self.active_requests} requests still in flight after {timeout}s, stopping anyway")
+        
+        self.stop_engine()
+        self.is_loaded = False
+        self.model = None
+        self.adapters = None
+        self.sessions.clear()
+        self.prefix_cache.clear()
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+        logger.info(f"Retired model {self.model_name}")
+        return drained
+    
+    @staticmethod
+    def describe_version(model_path: str) -> str:
+        """Identify the loaded weights; local checkpoints include their modification time.
+        
+        For a directory that is the newest file in it, since overwriting a
+        weights file in place does not touch the directory's own mtime.
+        """
+        if os.path.isdir(model_path):
+            mtimes = [entry.stat().st_mtime for entry in os.scandir(model_path) if entry.is_file()]
+            return f"{model_path}@{int(max(mtimes, default=os.path.getmtime(model_path)))}"
+        if os.path.exists(model_path):
+            return f"{model_path}@{int(os.path.getmtime(model_path))}"
+        return model_path
+    
+    def start_engine(self):
+        """Start (or restart) the continuous batching engine for the loaded model"""
+        from app.engine import ContinuousBatchingEngine
+        
+        self.stop_engine()
+        admission.service_slots = GENERATION_WORKERS
+        if not BATCHING_ENABLED:
+            return
+        
+        self.engine = ContinuousBatchingEngine(
+            self.model,
+            self.tokenizer,
+            max_batch_size=MAX_BATCH_SIZE,
+            max_queue_wait=MAX_QUEUE_WAIT_MS / 1000,
+            model_lock=self.model_lock
+        )
+        self.engine.start()
+        admission.service_slots = MAX_BATCH_SIZE
+    
+    def stop_engine(self):
+        """Stop the batching engine, failing any requests still in flight"""
+        if self.engine is not None:
+            self.engine.stop()
+            self.engine = None
+    
+    def prompt_parts(self) -> Dict[str, Any]:
+        """Fixed text around the message in PROMPT_TEMPLATE, and the token ids of the first-turn head.
+        
+        Prompts are tokenized as whole strings, like the training data, so
+        the head's ids are only a prefix of a prompt when the head ends on a
+        token boundary (a trailing newline or closing tag usually does). Only
+        then does the prefix cache serve it. With the defaults (no system
+        prompt, "{message}{eos_token}") there is no head to share and only
+        session caches apply.
+        """
+        if self._prompt_parts is None:
+            head, _, tail = PROMPT_TEMPLATE.partition("{message}")
+            self._prompt_parts = {
+                # Later turns of a session continue an existing sequence
+                "turn_head": head,
+                "tail": tail.format(eos_token=self.tokenizer.eos_token),
+                # First turn: system prompt plus template header, with BOS if the tokenizer uses one
+                "head_ids": self.tokenizer.encode(SYSTEM_PROMPT + head)
+            }
+        return self._prompt_parts
+    
+    def encode_message(self, message: str, first_turn: bool = True) -> List[int]:
+        """Build the prompt token ids for a chat message"""
+        parts = self.prompt_parts()
+        text = parts["turn_head"] + message + parts["tail"]
+        if first_turn:
+            return self.tokenizer.encode(SYSTEM_PROMPT + text)
+        return self.tokenizer.encode(text, add_special_tokens=False)
+    
+    def shares_head(self, prompt_ids: List[int]) -> bool:
+        """Whether the prompt starts with the cacheable head's token ids"""
+        head_ids = self.prompt_parts()["head_ids"]
+        return len(head_ids) > 1 and prompt_ids[:len(head_ids)] == head_ids
+    
+    def warm_prefix_cache(self, adapter: Optional[str] = None) -> Optional[Any]:
+        """Precompute the KV state of the fixed prompt head (system prompt + template header)"""
+        head_ids = self.prompt_parts()["head_ids"]
+        if len(head_ids) <= 1:
+            logger.info("No system prompt or template header to share, prefix cache stays empty")
+            return None
+        with self.model_lock:
+            past = self.prefix_cache.warm(self.model, head_ids, adapter)
+        logger.info(f"Prefix cache warmed with {len(head_ids)} prompt-head tokens (adapter={adapter})")
+        return past
+    
+    def context_window(self) -> Optional[int]:
+        """Maximum sequence length the loaded model supports, if known"""
+        config = getattr(self.model, "config", None)
+        return getattr(config, "max_position_embeddings", None) or getattr(config, "n_positions", None)
+    
+    def prepare_prompt(self, message: str, max_length: int,
+                       session_id: Optional[str] = None,
+                       adapter: Optional[str] = None) -> Tuple[List[int], Optional[Any]]:
+        """Build prompt ids for a turn, reusing the session's or a shared prefix's KV cache"""
+        session = self.sessions.get(session_id) if session_id else None
+        if session is not None:
+            started = time.perf_counter()
+            conversation_ids = session.token_ids + self.encode_message(message, first_turn=False)
+            metrics.observe_stage("tokenize", time.perf_counter() - started)
+            limit = self.context_window()
+            if not limit or len(conversation_ids) + max_length <= limit:
+                # A cache computed under another adapter is useless; re-prefill the history
+                return conversation_ids, session.past if session.adapter == adapter else None
+            logger.info(f"Session {session_id} outgrew the context window, starting a fresh conversation")
+        
+        started = time.perf_counter()
+        prompt_ids = self.encode_message(message)
+        metrics.observe_stage("tokenize", time.perf_counter() - started)
+        matched, past = self.prefix_cache.match(prompt_ids, adapter)
+        if adapter is not None and matched < len(self.prompt_parts()["head_ids"]) and self.shares_head(prompt_ids):
+            # Adapters are loaded lazily, so their prompt head is warmed on first use
+            past = self.warm_prefix_cache(adapter) or past
+        return prompt_ids, past
+    
+    async def aprepare_prompt(self, message: str, max_length: int,
+                              session_id: Optional[str] = None,
+                              adapter: Optional[str] = None) -> Tuple[List[int], Optional[Any]]:
+        """prepare_prompt off the event loop: tokenizing and warming an adapter's prefix run the model"""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.prepare_prompt, message, max_length, session_id, adapter
+        )
+    
+    def cache_params(self, max_length: int, temperature: float, top_p: float,
+                     adapter: Optional[str] = None) -> dict:
+        """Everything besides the message that determines a response"""
+        return {
+            "model_version": self.model_version or self.model_name or "unknown",
+            "adapter": self.describe_version(self.adapters.paths[adapter]) if adapter else None,
+            "prompt": SYSTEM_PROMPT + PROMPT_TEMPLATE,
+            "max_length": max_length,
+            "temperature": temperature,
+            # top_p has no effect on greedy decoding
+            "top_p": top_p if temperature > 0 else None
+        }
+    
+    def cached_response(self, message: str, max_length: int = 100,
+                        temperature: float = 0.7, top_p: float = 0.9,
+                        adapter: Optional[str] = None) -> Optional[str]:
+        """Previously generated response for an equivalent request, if cached"""
+        if self.response_cache is None:
+            return None
+        return self.response_cache.get(
+            message, **self.cache_params(max_length, temperature, top_p, adapter)
+        )
+    
+    def store_response(self, message: str, response: str, max_length: int = 100,
+                       temperature: float = 0.7, top_p: float = 0.9,
+                       adapter: Optional[str] = None):
+        if self.response_cache is not None:
+            self.response_cache.put(
+                message, response, **self.cache_params(max_length, temperature, top_p, adapter)
+            )
+    
+    def update_session(self, session_id: str, prompt_ids: List[int],
+                       output_ids: List[int], past: Optional[Any],
+                       adapter: Optional[str] = None):
+        """Remember the conversation so far and the KV cache that covers it"""
+        conversation_ids = prompt_ids + output_ids
+        if not output_ids or output_ids[-1] != self.tokenizer.eos_token_id:
+            # Turns are eos-separated, even when generation hit max_length
+            conversation_ids.append(self.tokenizer.eos_token_id)
+        self.sessions.put(session_id, conversation_ids, past, adapter)
+    
+    async def run_generation(self, prompt_ids: List[int], max_length: int = 100,
+                             temperature: float = 0.7, top_p: float = 0.9,
+                             on_token: Optional[Callable[[int], None]] = None,
+                             past: Optional[Any] = None,
+                             keep_cache: bool = False,
+                             adapter: Optional[str] = None) -> Tuple[List[int], Optional[Any]]:
+        """Generate without blocking the event loop; returns (new token ids, KV cache)"""
+        if self.engine is not None:
+            engine_future = self.engine.submit(
+                prompt_ids,
+                max_new_tokens=max_length,
+                temperature=temperature,
+                top_p=top_p,
+                on_token=on_token,
+                past=past,
+                keep_cache=keep_cache,
+                adapter=adapter
+            )
+            output_ids = await asyncio.wrap_future(engine_future)
+            return output_ids, engine_future.past_key_values
+        
+        # Bounded worker pool keeps model.generate off the event loop
+        stop_event = threading.Event()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                admission.executor, self.generate_ids, prompt_ids,
+                max_length, temperature, top_p, on_token, stop_event, past, adapter
+            )
+        except asyncio.CancelledError:
+            stop_event.set()
+            raise
+    
+    async def agenerate_response(self, message: str, max_length: int = 100,
+                                 temperature: float = 0.7, top_p: float = 0.9,
+                                 session_id: Optional[str] = None,
+                                 adapter: Optional[str] = None) -> str:
+        """Generate a response without blocking the event loop"""
+        if not self.is_loaded:
+            raise HTTPException(status_code=503, detail="Model not loaded")
+        
+        adapter = await self.pin_adapter(adapter)
+        try:
+            prompt_ids, past = await self.aprepare_prompt(message, max_length, session_id, adapter)
+            output_ids, cache = await self.run_generation(
+                prompt_ids, max_length, temperature, top_p,
+                past=past, keep_cache=session_id is not None, adapter=adapter
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error generating response: {e}")
+            raise HTTPException(status_code=500, detail=f"Generation error: {str(e)}")
+        finally:
+            self.release_adapter(adapter)
+        
+        started = time.perf_counter()
+        response = self.tokenizer.decode(output_ids, skip_special_tokens=True).strip()
+        metrics.observe_stage("detokenize", time.perf_counter() - started)
+        if session_id is not None:
+            self.update_session(session_id, prompt_ids, output_ids, cache, adapter)
+        elif self.response_cache is not None:
+            # Semantic and Redis caches embed or make network calls; keep them off the event loop
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.store_response, message, response, max_length, temperature, top_p, adapter
+            )
+        return response
+    
+    def generate_ids(self, prompt_ids: List[int], max_length: int = 100,
+                     temperature: float = 0.7, top_p: float = 0.9,
+                     on_token: Optional[Callable[[int], None]] = None,
+                     stop_event: Optional[threading.Event] = None,
+                     past: Optional[Any] = None,
+                     adapter: Optional[str] = None) -> Tuple[List[int], Optional[Any]]:
+        """Run a single model.generate call; returns (new token ids, KV cache)"""
+        import torch
+        from transformers import StoppingCriteria, StoppingCriteriaList
+        from app.engine import fit_cache_to_prompt, from_legacy_cache, to_legacy_cache
+        from app.streaming import TokenCallbackStreamer
+        
+        class StopOnEvent(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return stop_event is not None and stop_event.is_set()
+        
+        kwargs = {}
+        lock = contextlib.nullcontext()
+        if hasattr(self.model, "peft_config"):
+            # PEFT routes adapter_names through temporary hooks, one call at a time
+            kwargs["adapter_names"] = [adapter or BASE_ADAPTER]
+            lock = self.model_lock
+        
+        # Split generate() into prefill and per-token decode time for the metrics
+        timings = {"start": time.perf_counter(), "tokens": 0}
+        
+        def on_generated(token_id: int):
+            now = time.perf_counter()
+            if timings["tokens"] == 0:
+                metrics.observe_first_token(now - timings["start"])
+                metrics.observe_stage("prefill", now - timings["start"])
+            else:
+                metrics.observe_stage("decode", now - timings["last"])
+            metrics.observe_batch(1)
+            timings["last"] = now
+            timings["tokens"] += 1
+            if on_token:
+                on_token(token_id)
+        
+        inputs = torch.tensor([prompt_ids])
+        with torch.no_grad(), lock:
+            outputs = self.model.generate(
+                inputs,
+                attention_mask=torch.ones_like(inputs),
+                past_key_values=from_legacy_cache(fit_cache_to_prompt(past, len(prompt_ids))),
+                max_length=inputs.shape[1] + max_length,
+                temperature=temperature if temperature > 0 else None,
+                top_p=top_p if temperature > 0 else None,
+                do_sample=temperature > 0,
+                pad_token_id=self.tokenizer.eos_token_id,
+                streamer=TokenCallbackStreamer(on_generated),
+                stopping_criteria=StoppingCriteriaList([StopOnEvent()]),
+                return_dict_in_generate=True,
+                **kwargs
+            )
+        metrics.observe_generation(timings["tokens"], time.perf_counter() - timings["start"])
+        return (
+            outputs.sequences[0, inputs.shape[1]:].tolist(),
+            to_legacy_cache(outputs.past_key_values)
+        )
+    
     def generate_response(self, message: str, max_length: int = 100, 
-                         temperature: float = 0.7, top_p: float = 0.9) -> str:
-        """Generate response using the loaded model"""
+                         temperature: float = 0.7, top_p: float = 0.9,
+                         adapter: Optional[str] = None) -> str:
+        """Generate response using the loaded model, one request at a time"""
         if not self.is_loaded:
             raise HTTPException(status_code=503, detail="Model not loaded")
         
+        adapter = self.resolve_adapter(adapter)
+        cached = self.cached_response(message, max_length, temperature, top_p, adapter)
+        if cached is not None:
+            return cached
+        
+        self.acquire_adapter(adapter)
         try:
-            import torch
-            
-            # Tokenize input
-            inputs = self.tokenizer.encode(message + self.tokenizer.eos_token, 
-                                         return_tensors="pt")
-            
-            # Generate response
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    inputs,
-                    max_length=inputs.shape[1] + max_length,
-                    temperature=temperature,
-                    top_p=top_p,
-                    do_sample=True,
-                    pad_token_id=self.tokenizer.eos_token_id
-                )
-            
-            # Decode response
-            response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            
-            # Extract only the generated part
-            response = response[len(message):].strip()
-            
+            prompt_ids, past = self.prepare_prompt(message, max_length, adapter=adapter)
+            output_ids, _ = self.generate_ids(
+                prompt_ids, max_length, temperature, top_p, past=past, adapter=adapter
+            )
+            response = self.tokenizer.decode(output_ids, skip_special_tokens=True).strip()
+            self.store_response(message, response, max_length, temperature, top_p, adapter)
             return response
             
         except Exception as e:
             logger.error(f"Error generating response: {e}")
             raise HTTPException(status_code=500, detail=f"Generation error: {str(e)}")
+        finally:
+            self.release_adapter(adapter)
+    
+    async def stream_response(self, message: str, max_length: int = 100,
+                              temperature: float = 0.7, top_p: float = 0.9,
+                              session_id: Optional[str] = None,
+                              adapter: Optional[str] = None) -> AsyncIterator[str]:
+        """Yield response text as tokens are generated"""
+        from app.streaming import IncrementalDetokenizer
+        
+        if not self.is_loaded:
+            raise HTTPException(status_code=503, detail="Model not loaded")
+        
+        loop = asyncio.get_running_loop()
+        token_queue: asyncio.Queue = asyncio.Queue()
+        
+        def on_token(token_id: int):
+            loop.call_soon_threadsafe(token_queue.put_nowait, token_id)
+        
+        adapter = await self.pin_adapter(adapter)
+        try:
+            prompt_ids, past = await self.aprepare_prompt(message, max_length, session_id, adapter)
+        except BaseException:
+            # Also on cancellation, or the pin would keep the adapter resident forever
+            self.release_adapter(adapter)
+            raise
+        task = asyncio.ensure_future(self.run_generation(
+            prompt_ids, max_length, temperature, top_p,
+            on_token=on_token, past=past, keep_cache=session_id is not None, adapter=adapter
+        ))
+        task.add_done_callback(lambda _: self.release_adapter(adapter))
+        # Tokens are queued before the task finishes, so None always arrives last
+        task.add_done_callback(lambda _: token_queue.put_nowait(None))
+        
+        detokenizer = IncrementalDetokenizer(self.tokenizer)
+        detokenize_time = 0.0
+        started = False
+        try:
+            while True:
+                token_id = await token_queue.get()
+                tick = time.perf_counter()
+                text = detokenizer.flush() if token_id is None else detokenizer.push(token_id)
+                detokenize_time += time.perf_counter() - tick
+                if not started:
+                    # Match the stripped output of the non-streaming path
+                    text = text.lstrip()
+                    started = bool(text)
+                if text:
+                    yield text
+                if token_id is None:
+                    break
+            
+            metrics.observe_stage("detokenize", detokenize_time)
+            # Surface generation errors to the caller
+            output_ids, cache = await task
+            if session_id is not None:
+                self.update_session(session_id, prompt_ids, output_ids, cache, adapter)
+        finally:
+            if not task.done():
+                # Consumer went away (disconnect or deadline): stop generating
+                task.cancel()
+
+def set_reload_status(status: str, message: str, progress: float):
+    global reload_status
+    started_at = reload_status.get("started_at") if reload_status["status"] not in ("ready", "error", "idle") else None
+    reload_status = {
+        "status": status,
+        "message": message,
+        "progress": progress,
+        "started_at": started_at or time.time(),
+        "updated_at": time.time()
+    }
+
+def startup_load():
+    """Initial model load, run off the event loop by the lifespan hook"""
+    try:
+        reload_model(MODEL_PATH)
+    except Exception as e:
+        logger.warning(f"Could not load model on startup: {e}")
+
+def reload_model(model_path: Optional[str] = None, adapter_name: Optional[str] = None,
+                 warmup: bool = True) -> ModelManager:
+    """Swap in a new model without downtime.
+    
+    The new model is loaded and warmed up next to the serving one, then
+    published with a single assignment; the old manager hands late arrivals
+    to its successor and is freed once its in-flight requests finish. An
+    adapter for the base already being served is registered in place instead.
+    """
+    global model_manager
+    
+    with reload_lock:
+        old = model_manager
+        try:
+            if old is not None and old.is_loaded and old.shares_base(model_path):
+                set_reload_status("loading", f"Adding adapter from {model_path}", 0.1)
+                old.load_model(model_path, adapter_name)
+                if warmup:
+                    old.warm_up()
+                set_reload_status("ready", f"Serving {old.model_name}", 1.0)
+                return old
+            
+            set_reload_status("loading", f"Loading {model_path or 'default model'}", 0.1)
+            new = ModelManager()
+            if old is not None and old.response_cache is not None:
+                # Keys include the model version, so cached responses stay valid
+                new.response_cache = old.response_cache
+            new.load_model(model_path, adapter_name)
+            if warmup:
+                set_reload_status("warming", f"Warming up {new.model_name}", 0.7)
+                new.warm_up()
+        except Exception as e:
+            set_reload_status("error", f"Reload failed: {str(e)}", 0.0)
+            raise
+        
+        model_manager = new
+        if old is not None:
+            set_reload_status("draining", f"Draining requests on {old.model_name}", 0.9)
+            old.retire(new)
+        set_reload_status("ready", f"Serving {new.model_name}", 1.0)
+        logger.info(f"Now serving {new.model_name}")
+        return new
 
 # Initialize model manager
 def get_model_manager():
     global model_manager
     if model_manager is None:
+        # Loading happens at startup (or via /load_model); until then endpoints answer 503
         model_manager = ModelManager()
-        try:
-            model_manager.load_model()
-        except Exception as e:
-            logger.warning(f"Could not load model on startup: {e}")
     return model_manager
 
 # API Endpoints
@@ -236,41 +931,261 @@ async def health_check():
         dependencies=dependencies
     )
 
+@app.get("/livez")
+async def liveness():
+    """Liveness probe: the process is up and the event loop is responsive"""
+    return {"status": "alive", "timestamp": time.time()}
+
+@app.get("/readyz")
+async def readiness():
+    """Readiness probe: 200 once a model is loaded and warmed up, 503 with load progress before"""
+    ready = model_manager is not None and model_manager.is_loaded
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "loading",
+            "model_name": model_manager.model_name if ready else None,
+            "load": reload_status,
+            "timestamp": time.time()
+        }
+    )
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest, manager: ModelManager = Depends(get_model_manager)):
+async def chat(request: ChatRequest, http_request: Request,
+               manager: ModelManager = Depends(get_model_manager)):
     """Chat with the fine-tuned model"""
     start_time = time.time()
     
-    try:
-        response = manager.generate_response(
-            request.message,
-            request.max_length,
-            request.temperature,
-            request.top_p
-        )
+    # Stay on one model instance for the whole request, even across a reload
+    with manager.serving() as manager:
+        if not manager.is_loaded:
+            raise HTTPException(status_code=503, detail="Model not loaded")
         
-        processing_time = time.time() - start_time
+        adapter = manager.resolve_adapter(request.adapter)
         
-        return ChatResponse(
-            response=response,
-            processing_time=processing_time,
-            model_name=manager.model_name or "unknown"
-        )
+        # Repeated questions are answered without taking a generation slot
+        if request.session_id is None and manager.response_cache is not None:
+            # Lookups may embed the message or call Redis, so they run off the event loop
+            cached = await asyncio.get_running_loop().run_in_executor(
+                None, manager.cached_response,
+                request.message, request.max_length, request.temperature, request.top_p, adapter
+            )
+            if cached is not None:
+                return ChatResponse(
+                    response=cached,
+                    processing_time=time.time() - start_time,
+                    model_name=manager.model_name or "unknown",
+                    adapter=adapter,
+                    cached=True
+                )
         
-    except Exception as e:
-        logger.error(f"Chat error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        admitted_at = admission.acquire(request.timeout)
+        completed = False
+        try:
+            response = await admission.run(
+                manager.agenerate_response(
+                    request.message,
+                    request.max_length,
+                    request.temperature,
+                    request.top_p,
+                    session_id=request.session_id,
+                    adapter=request.adapter
+                ),
+                timeout=request.timeout,
+                is_disconnected=http_request.is_disconnected
+            )
+            completed = True
+
+            processing_time = time.time() - start_time
+            
+            return ChatResponse(
+                response=response,
+                processing_time=processing_time,
+                model_name=manager.model_name or "unknown",
+                session_id=request.session_id,
+                adapter=adapter
+            )
+        
+        except HTTPException:
+            raise
+        except ClientDisconnected:
+            logger.info("Client disconnected, generation cancelled")
+            raise HTTPException(status_code=499, detail="Client closed request")
+        except Exception as e:
+            logger.error(f"Chat error: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            admission.release(admitted_at, completed)
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, manager: ModelManager = Depends(get_model_manager)):
+    """Stream the model's reply as Server-Sent Events"""
+    from app.streaming import sse_event
+    
+    # Released when the stream ends, so a reload waits for it to finish
+    manager = manager.begin_request()
+    try:
+        if not manager.is_loaded:
+            raise HTTPException(status_code=503, detail="Model not loaded")
+        
+        adapter = manager.resolve_adapter(request.adapter)
+        admitted_at = admission.acquire(request.timeout)
+    except Exception:
+        manager.end_request()
+        raise
+    
+    async def event_stream():
+        start_time = time.time()
+        completed = False
+        try:
+            async for text in admission.stream(
+                manager.stream_response(
+                    request.message,
+                    request.max_length,
+                    request.temperature,
+                    request.top_p,
+                    session_id=request.session_id,
+                    adapter=request.adapter
+                ),
+                timeout=request.timeout
+            ):
+                yield sse_event({"token": text})
+            completed = True
+            yield sse_event({
+                "done": True,
+                "processing_time": time.time() - start_time,
+                "model_name": manager.model_name or "unknown",
+                "session_id": request.session_id,
+                "adapter": adapter
+            })
+        except HTTPException as e:
+            yield sse_event({"error": e.detail})
+        except Exception as e:
+            logger.error(f"Streaming chat error: {e}")
+            yield sse_event({"error": str(e)})
+        finally:
+            admission.release(admitted_at, completed)
+            manager.end_request()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/chat/ws")
+async def chat_websocket(websocket: WebSocket, manager: ModelManager = Depends(get_model_manager)):
+    """Stream replies over a WebSocket; each client message is a ChatRequest JSON object"""
+    await websocket.accept()
+    try:
+        while True:
+            payload = await websocket.receive_json()
+            start_time = time.time()
+            try:
+                request = ChatRequest(**payload)
+                # Follows reloads: a retired manager forwards to its successor
+                with manager.serving() as current:
+                    if not current.is_loaded:
+                        raise HTTPException(status_code=503, detail="Model not loaded")
+                    adapter = current.resolve_adapter(request.adapter)
+                    admitted_at = admission.acquire(request.timeout)
+                    completed = False
+                    stream = admission.stream(
+                        current.stream_response(
+                            request.message,
+                            request.max_length,
+                            request.temperature,
+                            request.top_p,
+                            session_id=request.session_id,
+                            adapter=request.adapter
+                        ),
+                        timeout=request.timeout
+                    )
+                    try:
+                        async for text in stream:
+                            await websocket.send_json({"token": text})
+                        completed = True
+                    finally:
+                        await stream.aclose()
+                        admission.release(admitted_at, completed)
+                    await websocket.send_json({
+                        "done": True,
+                        "processing_time": time.time() - start_time,
+                        "model_name": current.model_name or "unknown",
+                        "session_id": request.session_id,
+                        "adapter": adapter
+                    })
+            except WebSocketDisconnect:
+                raise
+            except HTTPException as e:
+                await websocket.send_json({"error": e.detail})
+            except Exception as e:
+                logger.error(f"WebSocket chat error: {e}")
+                await websocket.send_json({"error": str(e)})
+    except WebSocketDisconnect:
+        pass
+
+@app.delete("/sessions/{session_id}")
+async def end_session(session_id: str, manager: ModelManager = Depends(get_model_manager)):
+    """Forget a conversation and free its cached attention state"""
+    if not manager.sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail=f"Unknown session: {session_id}")
+    return {"status": "success", "message": f"Session {session_id} ended"}
 
 @app.post("/load_model")
-async def load_model(model_path: Optional[str] = None, 
-                    manager: ModelManager = Depends(get_model_manager)):
-    """Load or reload the model"""
+async def load_model(background_tasks: BackgroundTasks, model_path: Optional[str] = None,
+                     adapter_name: Optional[str] = None, warmup: bool = True):
+    """Reload the model in the background; the current one keeps serving until the swap"""
+    if reload_lock.locked():
+        raise HTTPException(status_code=409, detail="A model reload is already in progress")
+    
+    def run_reload():
+        try:
+            reload_model(model_path, adapter_name, warmup)
+        except Exception as e:
+            logger.error(f"Model loading error: {e}")
+    
+    background_tasks.add_task(run_reload)
+    set_reload_status("queued", f"Reload of {model_path or 'default model'} queued", 0.0)
+    return {"status": "success", "message": f"Reloading model from {model_path or 'default path'}, see /load_model/status"}
+
+@app.get("/load_model/status")
+async def load_model_status():
+    """Progress of the last model reload"""
+    return reload_status
+
+@app.get("/adapters")
+async def list_adapters(manager: ModelManager = Depends(get_model_manager)):
+    """Registered LoRA adapters and which of them are resident"""
+    if manager.adapters is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    return {"default": manager.default_adapter, **manager.adapters.stats()}
+
+@app.post("/adapters")
+async def register_adapter(request: AdapterRequest, manager: ModelManager = Depends(get_model_manager)):
+    """Register a LoRA adapter for the loaded base model; weights load on first use"""
+    if manager.adapters is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
     try:
-        manager.load_model(model_path)
-        return {"status": "success", "message": f"Model loaded from {manager.model_name}"}
-    except Exception as e:
-        logger.error(f"Model loading error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        manager.adapters.register(request.name, request.path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success", "message": f"Adapter {request.name} registered"}
+
+@app.delete("/adapters/{name}")
+async def unregister_adapter(name: str, manager: ModelManager = Depends(get_model_manager)):
+    """Remove a LoRA adapter and free its weights"""
+    if manager.adapters is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    try:
+        removed = manager.adapters.unregister(name)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not removed:
+        raise HTTPException(status_code=404, detail=f"Unknown adapter: {name}")
+    if manager.default_adapter == name:
+        manager.default_adapter = None
+    return {"status": "success", "message": f"Adapter {name} removed"}
 
 @app.get("/model_status")
 async def model_status(manager: ModelManager = Depends(get_model_manager)):
@@ -278,7 +1193,9 @@ async def model_status(manager: ModelManager = Depends(get_model_manager)):
     return {
         "is_loaded": manager.is_loaded,
         "model_name": manager.model_name,
-        "model_type": type(manager.model).__name__ if manager.model else None
+        "model_type": type(manager.model).__name__ if manager.model else None,
+        "default_adapter": manager.default_adapter,
+        "adapters": manager.adapters.stats() if manager.adapters else None
     }
 
 @app.post("/train")
@@ -360,7 +1277,15 @@ async def list_models():
 
 @app.get("/metrics")
 async def get_metrics():
-    """Get system metrics"""
+    """Prometheus metrics (falls back to the JSON snapshot without prometheus_client)"""
+    if not metrics.PROMETHEUS_AVAILABLE:
+        return await get_stats()
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/stats")
+async def get_stats():
+    """Get system metrics as JSON"""
     try:
         import psutil
         
@@ -368,10 +1293,17 @@ async def get_metrics():
             "cpu_percent": psutil.cpu_percent(),
             "memory_percent": psutil.virtual_memory().percent,
             "disk_usage": psutil.disk_usage('/').percent,
+            "admission": admission.stats(),
+            "sessions": model_manager.sessions.stats() if model_manager else None,
+            "prefix_cache": model_manager.prefix_cache.stats() if model_manager else None,
+            "response_cache": (
+                model_manager.response_cache.stats()
+                if model_manager and model_manager.response_cache else None
+            ),
             "timestamp": time.time()
         }
     except ImportError:
-        return {"error": "psutil not available"}
+        return {"error": "psutil not available", "admission": admission.stats()}
 
 # Error handlers
 @app.exception_handler(Exception)
@@ -0,0 +1,521 @@
+"""
+QLORAX Continuous Batching Engine
+Iteration-level scheduler that shares a single decode loop between concurrent requests
+"""
+
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import CancelledError, Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+
+from app import metrics
+from app.adapters import BASE_ADAPTER
+
+logger = logging.getLogger(__name__)
+
+# Legacy cache layout: one (key, value) pair per layer, each [batch, heads, seq, head_dim]
+LegacyCache = Tuple[Tuple[torch.Tensor, torch.Tensor], ...]
+
+
+def to_legacy_cache(past: Any) -> Optional[LegacyCache]:
+    """Convert a model's past_key_values into the legacy tuple layout"""
+    if past is None or isinstance(past, tuple):
+        return past
+    if hasattr(past, "to_legacy_cache"):
+        return past.to_legacy_cache()
+    # transformers>=5 removed to_legacy_cache, the per-layer tensors are still exposed
+    return tuple((layer.keys, layer.values) for layer in past.layers)
+
+
+def from_legacy_cache(legacy: Optional[LegacyCache]) -> Any:
+    """Wrap a legacy tuple cache in whatever cache object the installed transformers expects"""
+    if legacy is None:
+        return None
+    try:
+        from transformers.cache_utils import DynamicCache
+    except ImportError:
+        # transformers<4.36 consumes the tuples directly
+        return legacy
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(legacy)
+    return DynamicCache(legacy)
+
+
+def cache_length(legacy: Optional[LegacyCache]) -> int:
+    """Number of positions held by a legacy cache"""
+    if not legacy:
+        return 0
+    return legacy[0][0].shape[-2]
+
+
+def cache_nbytes(legacy: Optional[LegacyCache]) -> int:
+    """Memory held by a legacy cache"""
+    if not legacy:
+        return 0
+    return sum(t.numel() * t.element_size() for layer in legacy for t in layer)
+
+
+def crop_cache(legacy: LegacyCache, length: int) -> LegacyCache:
+    """Keep only the first `length` positions of a legacy cache"""
+    return tuple((key[:, :, :length, :], value[:, :, :length, :]) for key, value in legacy)
+
+
+def fit_cache_to_prompt(legacy: Optional[LegacyCache], prompt_length: int) -> Optional[LegacyCache]:
+    """Crop a prefix cache so at least one prompt token is left to feed through the model"""
+    if legacy is None or cache_length(legacy) < prompt_length:
+        return legacy
+    return crop_cache(legacy, prompt_length - 1) if prompt_length > 1 else None
+
+
+def detach_cache(legacy: Optional[LegacyCache]) -> Optional[LegacyCache]:
+    """Copy a cache out of the batched storage it was sliced from, so that storage can be freed"""
+    if legacy is None:
+        return None
+    return tuple((key.clone(), value.clone()) for key, value in legacy)
+
+
+def stack_caches(caches: List[Optional[LegacyCache]]) -> Tuple[LegacyCache, List[int]]:
+    """Left-pad per-sequence caches to a common length and stack them into one batch.
+
+    Empty caches (None) become all-padding rows.
+    """
+    lengths = [cache_length(c) for c in caches]
+    max_len = max(lengths)
+    reference = next(c for c, length in zip(caches, lengths) if length)
+    stacked = []
+    for layer in range(len(reference)):
+        ref_key, ref_value = reference[layer]
+        keys, values = [], []
+        for cache, length in zip(caches, lengths):
+            if not length:
+                heads = ref_key.shape[1]
+                keys.append(ref_key.new_zeros((1, heads, max_len, ref_key.shape[-1])))
+                values.append(ref_value.new_zeros((1, heads, max_len, ref_value.shape[-1])))
+                continue
+            key, value = cache[layer]
+            pad = max_len - length
+            if pad:
+                key = F.pad(key, (0, 0, pad, 0))
+                value = F.pad(value, (0, 0, pad, 0))
+            keys.append(key)
+            values.append(value)
+        stacked.append((torch.cat(keys, dim=0), torch.cat(values, dim=0)))
+    return tuple(stacked), lengths
+
+
+def split_cache(batched: LegacyCache, lengths: List[int]) -> List[LegacyCache]:
+    """Split a left-padded batched cache back into per-sequence caches without the padding"""
+    total = cache_length(batched)
+    caches = []
+    for row, length in enumerate(lengths):
+        start = total - length
+        caches.append(tuple(
+            (key[row:row + 1, :, start:, :], value[row:row + 1, :, start:, :])
+            for key, value in batched
+        ))
+    return caches
+
+
+def select_rows(batched: LegacyCache, lengths: List[int],
+                rows: List[int]) -> Tuple[Optional[LegacyCache], List[int]]:
+    """Keep only some rows of a left-padded batched cache, trimming padding no kept row needs"""
+    if not rows:
+        return None, []
+    kept = [lengths[row] for row in rows]
+    start = cache_length(batched) - max(kept)
+    index = torch.tensor(rows, device=batched[0][0].device)
+    return tuple(
+        (key[:, :, start:, :].index_select(0, index), value[:, :, start:, :].index_select(0, index))
+        for key, value in batched
+    ), kept
+
+
+def split_prefill_cache(batched: LegacyCache, past_len: int,
+                        cached_lengths: List[int], new_lengths: List[int]) -> List[LegacyCache]:
+    """Split a prefill cache laid out as [pad | cached | pad | new] per row, dropping both pads"""
+    total = cache_length(batched)
+    caches = []
+    for row, (cached, new) in enumerate(zip(cached_lengths, new_lengths)):
+        layers = []
+        for key, value in batched:
+            key_new = key[row:row + 1, :, total - new:, :]
+            value_new = value[row:row + 1, :, total - new:, :]
+            if cached:
+                key_new = torch.cat([key[row:row + 1, :, past_len - cached:past_len, :], key_new], dim=2)
+                value_new = torch.cat([value[row:row + 1, :, past_len - cached:past_len, :], value_new], dim=2)
+            layers.append((key_new, value_new))
+        caches.append(tuple(layers))
+    return caches
+
+
+def sample_token(logits: torch.Tensor, temperature: float, top_p: float) -> int:
+    """Pick the next token from a single row of logits"""
+    if temperature is None or temperature <= 0:
+        return int(torch.argmax(logits).item())
+
+    probs = torch.softmax(logits.float() / temperature, dim=-1)
+    if top_p is not None and 0 < top_p < 1:
+        sorted_probs, sorted_ids = torch.sort(probs, descending=True)
+        cumulative = torch.cumsum(sorted_probs, dim=-1)
+        # Keep the smallest set of tokens whose mass reaches top_p
+        sorted_probs[(cumulative - sorted_probs) > top_p] = 0
+        choice = torch.multinomial(sorted_probs / sorted_probs.sum(), 1)
+        return int(sorted_ids[choice].item())
+    return int(torch.multinomial(probs, 1).item())
+
+
+class GenerationFuture(Future):
+    """Future whose cancel() also stops a request that is already decoding.
+
+    A plain Future can only be cancelled while pending; here cancel() flags
+    the request so the scheduler drops it from the batch at the next step.
+    asyncio.wrap_future forwards cancellation of the awaiting task to this
+    method, so a cancelled coroutine frees its batch slot automatically.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.cancel_requested = False
+        # With keep_cache, the KV cache covering prompt + all generated tokens but the last
+        self.past_key_values: Optional[LegacyCache] = None
+
+    def cancel(self) -> bool:
+        self.cancel_requested = True
+        return super().cancel() or not self.done()
+
+
+@dataclass
+class GenerationRequest:
+    """A single generation job tracked by the scheduler"""
+    prompt_ids: List[int]
+    max_new_tokens: int = 100
+    temperature: float = 0.7
+    top_p: float = 0.9
+    eos_token_id: Optional[int] = None
+    on_token: Optional[Callable[[int], None]] = None
+    keep_cache: bool = False
+    adapter: Optional[str] = None
+    future: GenerationFuture = field(default_factory=GenerationFuture)
+    enqueued_at: float = field(default_factory=time.time)
+
+    # Decode state, owned by the scheduler thread. past may start out holding
+    # a cache for a prefix of prompt_ids, in which case only the rest is prefilled;
+    # once the request joins the batch its cache lives in the engine's batched cache
+    generated: List[int] = field(default_factory=list)
+    past: Optional[LegacyCache] = None
+
+    def append_token(self, token_id: int):
+        self.generated.append(token_id)
+        if self.on_token is not None:
+            try:
+                self.on_token(token_id)
+            except Exception as e:
+                logger.warning(f"Token callback failed: {e}")
+
+    @property
+    def finished(self) -> bool:
+        if not self.generated:
+            return False
+        if len(self.generated) >= self.max_new_tokens:
+            return True
+        return self.eos_token_id is not None and self.generated[-1] == self.eos_token_id
+
+
+class ContinuousBatchingEngine:
+    """Runs all in-flight requests through one shared decode loop.
+
+    New requests join the running batch at the next step boundary after a
+    padded prefill, and finished requests leave it immediately, so a long
+    generation never holds short ones hostage.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size: int = 8, max_queue_wait: float = 0.01,
+                 model_lock: Optional[threading.RLock] = None):
+        self.model = model
+        self.tokenizer = tokenizer
+        # Held around every forward pass; adapter loading takes it too
+        self.model_lock = model_lock or threading.RLock()
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_queue_wait = max(0.0, max_queue_wait)
+
+        self._waiting: "queue.Queue[Optional[GenerationRequest]]" = queue.Queue()
+        self._active: List[GenerationRequest] = []
+        # KV cache of the running batch, one left-padded row per active request,
+        # re-laid out only when requests join or leave rather than on every step
+        self._batch: Optional[LegacyCache] = None
+        self._lengths: List[int] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.steps = 0
+        self.completed = 0
+        self.cancelled = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._waiting.qsize()
+
+    @property
+    def active_count(self) -> int:
+        return len(self._active)
+
+    def start(self):
+        """Start the scheduler thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="qlorax-batching", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Continuous batching engine started "
+            f"(max_batch_size={self.max_batch_size}, max_queue_wait={self.max_queue_wait}s)"
+        )
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the scheduler and fail anything still pending"""
+        self._stop.set()
+        self._waiting.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+        pending = list(self._active)
+        self._reset_batch()
+        while True:
+            try:
+                request = self._waiting.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                pending.append(request)
+        for request in pending:
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("Generation engine stopped"))
+
+    def submit(self, prompt_ids: List[int], max_new_tokens: int = 100,
+               temperature: float = 0.7, top_p: float = 0.9,
+               ignore_eos: bool = False,
+               on_token: Optional[Callable[[int], None]] = None,
+               past: Optional[LegacyCache] = None,
+               keep_cache: bool = False,
+               adapter: Optional[str] = None) -> GenerationFuture:
+        """Queue a request; the returned future resolves to the generated token ids.
+
+        on_token, if given, is called from the scheduler thread with every
+        token as soon as it is sampled. past is a KV cache for a prefix of
+        prompt_ids (e.g. an earlier turn of the conversation); only the
+        tokens after it are prefilled. With keep_cache the final cache is
+        left on future.past_key_values for reuse. adapter names the LoRA
+        adapter of a PEFT model to run the request with (None for the base
+        weights); requests for different adapters share each forward pass.
+        """
+        if self._stop.is_set() or self._thread is None:
+            raise RuntimeError("Generation engine is not running")
+        if not prompt_ids:
+            raise ValueError("prompt_ids must not be empty")
+        request = GenerationRequest(
+            prompt_ids=list(prompt_ids),
+            max_new_tokens=max(1, int(max_new_tokens)),
+            temperature=temperature,
+            top_p=top_p,
+            eos_token_id=None if ignore_eos else self.tokenizer.eos_token_id,
+            on_token=on_token,
+            keep_cache=keep_cache,
+            adapter=adapter,
+            past=fit_cache_to_prompt(past, len(prompt_ids)),
+        )
+        self._waiting.put(request)
+        return request.future
+
+    def generate(self, prompt_ids: List[int], **kwargs) -> List[int]:
+        """Blocking convenience wrapper around submit"""
+        return self.submit(prompt_ids, **kwargs).result()
+
+    # ------------------------------------------------------------------
+    # Scheduler loop
+    # ------------------------------------------------------------------
+
+    def _run(self):
+        with torch.no_grad():
+            while not self._stop.is_set():
+                joined = self._collect()
+                try:
+                    if joined:
+                        self._prefill(joined)
+                    if self._active:
+                        self._decode_step()
+                except Exception as e:
+                    logger.error(f"Batched generation step failed: {e}")
+                    for request in joined + self._active:
+                        if not request.future.done():
+                            request.future.set_exception(e)
+                    self._reset_batch()
+
+    def _reset_batch(self):
+        self._active = []
+        self._batch = None
+        self._lengths = []
+
+    def _collect(self) -> List[GenerationRequest]:
+        """Pull waiting requests that can join the batch at this step"""
+        joined: List[GenerationRequest] = []
+        capacity = self.max_batch_size - len(self._active)
+
+        if not self._active:
+            # Idle: block for the first request, then hold the door open briefly
+            # so a burst of arrivals is prefilled together
+            request = self._waiting.get()
+            if request is None:
+                return joined
+            joined.append(request)
+            deadline = time.time() + self.max_queue_wait
+            while len(joined) < capacity:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._waiting.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is None:
+                    break
+                joined.append(request)
+        else:
+            # Busy: never stall running sequences waiting for new arrivals
+            while len(joined) < capacity:
+                try:
+                    request = self._waiting.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    break
+                joined.append(request)
+
+        return [r for r in joined if r.future.set_running_or_notify_cancel()]
+
+    def _forward(self, input_ids, attention_mask, position_ids, past,
+                 requests: List[GenerationRequest]):
+        kwargs = {}
+        if hasattr(self.model, "peft_config"):
+            # PEFT mixed-adapter batch: each row goes through its own LoRA weights
+            kwargs["adapter_names"] = [r.adapter or BASE_ADAPTER for r in requests]
+        with self.model_lock:
+            outputs = self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=from_legacy_cache(past),
+                use_cache=True,
+                **kwargs
+            )
+        return outputs.logits, to_legacy_cache(outputs.past_key_values)
+
+    def _prefill(self, requests: List[GenerationRequest]):
+        """Run the uncached part of newly joined prompts as one padded batch.
+
+        Each row is laid out as [pad | cached prefix] in the past and
+        [pad | new tokens] in the input; the padding is masked out here and
+        cut away again when the cache is split per request.
+        """
+        started = time.perf_counter()
+        cached_lengths = [cache_length(r.past) for r in requests]
+        suffixes = [r.prompt_ids[cached:] for r, cached in zip(requests, cached_lengths)]
+        new_lengths = [len(suffix) for suffix in suffixes]
+        past_len = max(cached_lengths)
+        new_len = max(new_lengths)
+        pad_id = self.tokenizer.pad_token_id
+        if pad_id is None:
+            pad_id = self.tokenizer.eos_token_id or 0
+
+        past = None
+        if past_len:
+            past, _ = stack_caches([r.past for r in requests])
+
+        input_ids = torch.full((len(requests), new_len), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(requests), past_len + new_len), dtype=torch.long)
+        position_ids = torch.zeros((len(requests), new_len), dtype=torch.long)
+        for row, (suffix, cached, length) in enumerate(zip(suffixes, cached_lengths, new_lengths)):
+            input_ids[row, new_len - length:] = torch.tensor(suffix, dtype=torch.long)
+            attention_mask[row, past_len - cached:past_len] = 1
+            attention_mask[row, past_len + new_len - length:] = 1
+            position_ids[row, new_len - length:] = torch.arange(cached, cached + length)
+
+        device = self.model.device
+        logits, past = self._forward(
+            input_ids.to(device), attention_mask.to(device), position_ids.to(device), past, requests
+        )
+
+        caches = split_prefill_cache(past, past_len, cached_lengths, new_lengths)
+        if self._batch is not None:
+            caches = split_cache(self._batch, self._lengths) + caches
+        self._batch, self._lengths = stack_caches(caches)
+
+        now = time.time()
+        for request, row_logits in zip(requests, logits[:, -1, :]):
+            request.past = None
+            request.append_token(sample_token(row_logits, request.temperature, request.top_p))
+            metrics.observe_first_token(now - request.enqueued_at)
+            self._active.append(request)
+
+        metrics.observe_stage("prefill", time.perf_counter() - started)
+        self._retire()
+
+    def _decode_step(self):
+        """Advance every active sequence by one token in a single forward pass"""
+        started = time.perf_counter()
+        active = self._active
+        lengths = self._lengths
+        max_len = cache_length(self._batch)
+
+        input_ids = torch.tensor([[r.generated[-1]] for r in active], dtype=torch.long)
+        attention_mask = torch.zeros((len(active), max_len + 1), dtype=torch.long)
+        for row, length in enumerate(lengths):
+            attention_mask[row, max_len - length:] = 1
+        position_ids = torch.tensor([[length] for length in lengths], dtype=torch.long)
+
+        device = self.model.device
+        logits, self._batch = self._forward(
+            input_ids.to(device), attention_mask.to(device), position_ids.to(device), self._batch, active
+        )
+
+        self._lengths = [length + 1 for length in lengths]
+        for request, row_logits in zip(active, logits[:, -1, :]):
+            request.append_token(sample_token(row_logits, request.temperature, request.top_p))
+
+        self.steps += 1
+        metrics.observe_batch(len(active))
+        metrics.observe_stage("decode", time.perf_counter() - started)
+        self._retire()
+
+    def _retire(self):
+        """Resolve finished or cancelled requests and drop them from the batch"""
+        still_active, rows, leaving = [], [], []
+        for row, request in enumerate(self._active):
+            if request.future.cancel_requested or request.finished:
+                if request.keep_cache and not request.future.cancel_requested:
+                    request.future.past_key_values = detach_cache(split_cache(self._batch, self._lengths)[row])
+                leaving.append(request)
+            else:
+                still_active.append(request)
+                rows.append(row)
+        if not leaving:
+            return
+        # Shrink the batch before resolving, so a woken caller sees its slot freed
+        self._batch, self._lengths = select_rows(self._batch, self._lengths, rows)
+        self._active = still_active
+
+        for request in leaving:
+            if request.future.cancel_requested:
+                self.cancelled += 1
+                if not request.future.done():
+                    request.future.set_exception(CancelledError())
+            else:
+                self.completed += 1
+                request.future.set_result(list(request.generated))
+                metrics.observe_generation(len(request.generated), time.time() - request.enqueued_at)
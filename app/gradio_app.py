@@ -5,7 +5,9 @@ User-friendly web interface for the QLORAX platform
 
 import os
 import sys
+import json
 import time
+import uuid
 from pathlib import Path
 
 # Add project root to Python path
@@ -24,43 +26,64 @@ except ImportError:
 # Configuration
 API_BASE_URL = "http://localhost:8000"
 
-def chat_with_model(message, history, max_length, temperature, top_p):
-    """Chat interface function"""
+def chat_with_model(message, history, max_length, temperature, top_p, session_id=None):
+    """Chat interface function, streams tokens into the conversation as they arrive.
+
+    The session id lets the API continue the conversation from its cached
+    state instead of re-reading the whole history every turn.
+    """
     if not message.strip():
-        return history, ""
+        yield history, ""
+        return
     
     try:
         # Add user message to history
-        history.append([message, None])
+        history.append([message, ""])
+        yield history, ""
         
-        # Call API
-        response = requests.post(
-            f"{API_BASE_URL}/chat",
+        # Call streaming API; the timeout applies between chunks, not to the whole reply
+        with requests.post(
+            f"{API_BASE_URL}/chat/stream",
             json={
                 "message": message,
                 "max_length": int(max_length),
                 "temperature": float(temperature),
-                "top_p": float(top_p)
+                "top_p": float(top_p),
+                "session_id": session_id
             },
+            stream=True,
             timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            bot_response = result["response"]
-            processing_time = result["processing_time"]
+        ) as response:
+            if response.status_code != 200:
+                history[-1][1] = f"Error: {response.status_code} - {response.text}"
+                yield history, ""
+                return
             
-            # Add bot response to history
-            history[-1][1] = f"{bot_response}\n\n*Processing time: {processing_time:.2f}s*"
-        else:
-            history[-1][1] = f"Error: {response.status_code} - {response.text}"
+            bot_response = ""
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data: "):
+                    continue
+                event = json.loads(line[len("data: "):])
+                
+                if "token" in event:
+                    bot_response += event["token"]
+                    history[-1][1] = bot_response
+                    yield history, ""
+                elif "error" in event:
+                    history[-1][1] = f"{bot_response}\n\nError: {event['error']}"
+                    yield history, ""
+                    return
+                elif event.get("done"):
+                    processing_time = event["processing_time"]
+                    history[-1][1] = f"{bot_response}\n\n*Processing time: {processing_time:.2f}s*"
+                    yield history, ""
             
     except requests.exceptions.RequestException as e:
         history[-1][1] = f"Connection error: {str(e)}"
+        yield history, ""
     except Exception as e:
         history[-1][1] = f"Error: {str(e)}"
-    
-    return history, ""
+        yield history, ""
 
 def get_model_status():
     """Get current model status"""
@@ -157,6 +180,7 @@ def create_interface():
                 with gr.Row():
                     with gr.Column(scale=3):
                         chatbot = gr.Chatbot(height=400, label="Conversation")
+                        session_id = gr.State(lambda: str(uuid.uuid4()))
                         msg = gr.Textbox(label="Your message", placeholder="Type your message here...")
                         
                         with gr.Row():
@@ -176,15 +200,16 @@ def create_interface():
                 # Chat functionality
                 send_btn.click(
                     chat_with_model,
-                    inputs=[msg, chatbot, max_length, temperature, top_p],
+                    inputs=[msg, chatbot, max_length, temperature, top_p, session_id],
                     outputs=[chatbot, msg]
                 )
                 msg.submit(
                     chat_with_model,
-                    inputs=[msg, chatbot, max_length, temperature, top_p],
+                    inputs=[msg, chatbot, max_length, temperature, top_p, session_id],
                     outputs=[chatbot, msg]
                 )
-                clear_btn.click(lambda: ([], ""), outputs=[chatbot, msg])
+                # A cleared chat starts a new server-side session
+                clear_btn.click(lambda: ([], "", str(uuid.uuid4())), outputs=[chatbot, msg, session_id])
                 refresh_status_btn.click(get_model_status, outputs=status_display)
             
             # Model Management Tab
@@ -250,6 +275,7 @@ def create_interface():
                         - **Documentation**: {API_BASE_URL}/docs
                         - **Health Check**: {API_BASE_URL}/health
                         - **Chat API**: {API_BASE_URL}/chat
+                        - **Streaming Chat**: {API_BASE_URL}/chat/stream (SSE), {API_BASE_URL}/chat/ws (WebSocket)
                         """)
                 
                 refresh_health_btn.click(get_health_status, outputs=health_display)
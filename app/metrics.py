@@ -0,0 +1,175 @@
+"""
+QLORAX Metrics
+Prometheus instrumentation for the serving path (no-ops when prometheus_client is not installed)
+"""
+
+import os
+import time
+import logging
+from typing import Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+# Latency buckets from sub-millisecond tokenizer calls up to long generations
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+if PROMETHEUS_AVAILABLE:
+    REQUESTS = Counter(
+        "qlorax_http_requests", "HTTP requests by endpoint and status code", ["endpoint", "method", "status"]
+    )
+    REQUEST_LATENCY = Histogram(
+        "qlorax_http_request_duration_seconds", "HTTP request latency until the response starts",
+        ["endpoint"], buckets=LATENCY_BUCKETS
+    )
+    STAGE_LATENCY = Histogram(
+        "qlorax_stage_duration_seconds",
+        "Latency of generation stages: tokenize and detokenize per request, prefill per batch, decode per step",
+        ["stage"], buckets=LATENCY_BUCKETS
+    )
+    TIME_TO_FIRST_TOKEN = Histogram(
+        "qlorax_time_to_first_token_seconds", "Time from submission to the first generated token",
+        buckets=LATENCY_BUCKETS
+    )
+    TOKENS_PER_SECOND = Histogram(
+        "qlorax_request_tokens_per_second", "Generated tokens per second of each finished request",
+        buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+    )
+    GENERATED_TOKENS = Counter("qlorax_generated_tokens", "Tokens generated")
+    BATCH_SIZE = Histogram(
+        "qlorax_batch_size", "Sequences per batched forward pass",
+        buckets=(1, 2, 4, 8, 16, 32, 64)
+    )
+
+
+def observe_stage(stage: str, seconds: float):
+    if PROMETHEUS_AVAILABLE:
+        STAGE_LATENCY.labels(stage).observe(seconds)
+
+
+def observe_batch(size: int):
+    if PROMETHEUS_AVAILABLE:
+        BATCH_SIZE.observe(size)
+
+
+def observe_first_token(seconds: float):
+    if PROMETHEUS_AVAILABLE:
+        TIME_TO_FIRST_TOKEN.observe(seconds)
+
+
+def observe_generation(tokens: int, seconds: float):
+    """Record a finished generation"""
+    if PROMETHEUS_AVAILABLE and tokens:
+        GENERATED_TOKENS.inc(tokens)
+        if seconds > 0:
+            TOKENS_PER_SECOND.observe(tokens / seconds)
+
+
+def observe_request(endpoint: str, method: str, status: int, seconds: float):
+    if PROMETHEUS_AVAILABLE:
+        REQUESTS.labels(endpoint, method, str(status)).inc()
+        REQUEST_LATENCY.labels(endpoint).observe(seconds)
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests per route template (not raw path, which
+    would explode label cardinality with session ids)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROMETHEUS_AVAILABLE:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                observe_request(
+                    route.path if route is not None else "unmatched",
+                    scope["method"], message["status"], time.perf_counter() - started
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_metrics)
+
+
+class ServingCollector:
+    """Reads queue, cache and memory state at scrape time, so none of it costs
+    anything on the request path"""
+
+    def __init__(self, get_manager: Callable[[], Optional[object]], admission):
+        self.get_manager = get_manager
+        self.admission = admission
+
+    def collect(self):
+        stats = self.admission.stats()
+        yield GaugeMetricFamily("qlorax_requests_in_flight", "Admitted generation requests", value=stats["in_flight"])
+        for name in ("admitted", "rejected", "timed_out", "cancelled"):
+            yield CounterMetricFamily(f"qlorax_admission_{name}", f"Generation requests {name.replace('_', ' ')}",
+                                      value=stats[name])
+
+        manager = self.get_manager()
+        loaded = manager is not None and manager.is_loaded
+        yield GaugeMetricFamily("qlorax_model_loaded", "1 when a model is serving", value=int(loaded))
+        if not loaded:
+            return
+
+        engine = manager.engine
+        yield GaugeMetricFamily("qlorax_queue_depth", "Requests waiting to join the batch",
+                                value=engine.queue_depth if engine else 0)
+        yield GaugeMetricFamily("qlorax_active_sequences", "Sequences in the running batch",
+                                value=engine.active_count if engine else 0)
+
+        lookups = CounterMetricFamily("qlorax_cache_lookups", "Cache lookups", labels=["cache"])
+        hits = CounterMetricFamily("qlorax_cache_hits", "Cache hits", labels=["cache"])
+        ratio = GaugeMetricFamily("qlorax_cache_hit_ratio", "Cache hit ratio since start", labels=["cache"])
+        caches = {"prefix": manager.prefix_cache.stats()}
+        session_stats = manager.sessions.stats()
+        caches["session"] = {
+            "lookups": session_stats["hits"] + session_stats["misses"], "hits": session_stats["hits"]
+        }
+        if manager.response_cache is not None:
+            caches["response"] = manager.response_cache.stats()
+        for cache, values in caches.items():
+            lookups.add_metric([cache], values["lookups"])
+            hits.add_metric([cache], values["hits"])
+            ratio.add_metric([cache], values["hits"] / values["lookups"] if values["lookups"] else 0.0)
+        yield lookups
+        yield hits
+        yield ratio
+
+        cache_bytes = GaugeMetricFamily("qlorax_kv_cache_bytes", "Memory held by cached KV state", labels=["cache"])
+        cache_bytes.add_metric(["prefix"], manager.prefix_cache.total_bytes)
+        cache_bytes.add_metric(["session"], manager.sessions.total_bytes)
+        yield cache_bytes
+
+        if manager.adapters is not None:
+            yield GaugeMetricFamily("qlorax_adapters_loaded", "LoRA adapters resident in memory",
+                                    value=len(manager.adapters.loaded))
+
+        try:
+            import psutil
+            yield GaugeMetricFamily("qlorax_model_rss_bytes", "Resident memory of the serving process",
+                                    value=psutil.Process(os.getpid()).memory_info().rss)
+        except ImportError:
+            pass
+
+
+def register_collector(get_manager: Callable[[], Optional[object]], admission):
+    if PROMETHEUS_AVAILABLE:
+        REGISTRY.register(ServingCollector(get_manager, admission))
+
+
+def render() -> Tuple[bytes, str]:
+    """Current metrics in the Prometheus text exposition format"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
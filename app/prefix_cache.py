@@ -0,0 +1,262 @@
+"""
+QLORAX Prefix Cache
+Radix tree of token-id prefixes with precomputed KV state, shared across requests
+"""
+
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+from app.adapters import BASE_ADAPTER
+from app.engine import (
+    LegacyCache, cache_nbytes, crop_cache, detach_cache,
+    fit_cache_to_prompt, from_legacy_cache, to_legacy_cache
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RadixNode:
+    """Edge-compressed trie node; `tokens` labels the edge from the parent"""
+    __slots__ = ("tokens", "children", "parent", "past", "nbytes", "last_used")
+
+    def __init__(self, tokens: Tuple[int, ...] = (), parent: Optional["RadixNode"] = None):
+        self.tokens = tokens
+        self.children: Dict[int, "RadixNode"] = {}
+        self.parent = parent
+        self.past: Optional[LegacyCache] = None
+        self.nbytes = 0
+        self.last_used = time.time()
+
+
+def _common_length(a, b) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class PrefixCache:
+    """KV states for common prompt prefixes (system prompt, template header),
+    keyed by token ids in a radix tree.
+
+    A lookup returns the cache for the longest stored prefix of the prompt,
+    so only the remaining tokens have to be prefilled. A cache stored deeper
+    in the tree also serves any shorter prefix of its path, by cropping.
+    Entries are evicted least-recently-used once max_bytes is exceeded.
+    Each LoRA adapter changes the KV state, so every adapter gets its own
+    tree under the shared byte budget.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.roots: Dict[Optional[str], RadixNode] = {}
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.hits = 0
+        self.hit_tokens = 0
+        self.prompt_tokens = 0
+        self.inserts = 0
+        self.evictions = 0
+        # Prompts whose tokenization does not start with the prefix's ids
+        self.bypasses = 0
+
+    # ------------------------------------------------------------------
+    # Tree operations
+    # ------------------------------------------------------------------
+
+    def insert(self, token_ids: List[int], past: LegacyCache, adapter: Optional[str] = None):
+        """Store the KV state covering exactly token_ids"""
+        if not token_ids:
+            return
+        past = detach_cache(past)
+        nbytes = cache_nbytes(past)
+        if nbytes > self.max_bytes:
+            logger.info(f"Prefix of {len(token_ids)} tokens ({nbytes} bytes) exceeds cache budget, not cached")
+            return
+
+        with self._lock:
+            node = self.roots.setdefault(adapter, RadixNode())
+            i = 0
+            while i < len(token_ids):
+                child = node.children.get(token_ids[i])
+                if child is None:
+                    child = RadixNode(tuple(token_ids[i:]), node)
+                    node.children[token_ids[i]] = child
+                    node, i = child, len(token_ids)
+                    break
+
+                k = _common_length(child.tokens, token_ids[i:])
+                if k < len(child.tokens):
+                    # Split the edge so the new prefix ends on a node
+                    middle = RadixNode(child.tokens[:k], node)
+                    child.tokens = child.tokens[k:]
+                    child.parent = middle
+                    middle.children[child.tokens[0]] = child
+                    node.children[token_ids[i]] = middle
+                    child = middle
+                node, i = child, i + k
+
+            self.total_bytes += nbytes - node.nbytes
+            node.past, node.nbytes = past, nbytes
+            node.last_used = time.time()
+            self.inserts += 1
+            self._evict(keep=node)
+
+    def match(self, token_ids: List[int],
+              adapter: Optional[str] = None) -> Tuple[int, Optional[LegacyCache]]:
+        """Return (number of tokens covered, KV cache) for the longest cached prefix"""
+        with self._lock:
+            self.lookups += 1
+            self.prompt_tokens += len(token_ids)
+
+            root = self.roots.get(adapter) or RadixNode()
+            best_len, best_node = 0, None
+            node, i = root, 0
+            reach_node, reach_len = root, 0
+            while i < len(token_ids):
+                child = node.children.get(token_ids[i])
+                if child is None:
+                    break
+                k = _common_length(child.tokens, token_ids[i:])
+                reach_node, reach_len = child, i + k
+                if k < len(child.tokens):
+                    break
+                node, i = child, i + k
+                if node.past is not None:
+                    best_len, best_node = i, node
+
+            past = best_node.past if best_node is not None else None
+            if best_node is not None:
+                best_node.last_used = time.time()
+
+            # Any cached descendant of where the match stopped also covers the shared part
+            if reach_len > best_len:
+                descendant = self._cached_descendant(reach_node)
+                if descendant is not None:
+                    descendant.last_used = time.time()
+                    best_len, past = reach_len, crop_cache(descendant.past, reach_len)
+
+            if past is not None:
+                self.hits += 1
+                self.hit_tokens += best_len
+            return best_len, past
+
+    def _cached_descendant(self, node: RadixNode) -> Optional[RadixNode]:
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.past is not None:
+                return current
+            stack.extend(current.children.values())
+        return None
+
+    def _cached_nodes(self) -> List[RadixNode]:
+        nodes, stack = [], list(self.roots.values())
+        while stack:
+            current = stack.pop()
+            if current.past is not None:
+                nodes.append(current)
+            stack.extend(current.children.values())
+        return nodes
+
+    def _evict(self, keep: RadixNode):
+        if self.total_bytes <= self.max_bytes:
+            return
+        for node in sorted(self._cached_nodes(), key=lambda n: n.last_used):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if node is keep:
+                continue
+            self.total_bytes -= node.nbytes
+            node.past, node.nbytes = None, 0
+            self.evictions += 1
+            self._prune(node)
+
+    def _prune(self, node: RadixNode):
+        """Drop cache-less leaves left behind by eviction"""
+        while node.parent is not None and node.past is None and not node.children:
+            parent = node.parent
+            del parent.children[node.tokens[0]]
+            node = parent
+
+    def clear(self):
+        with self._lock:
+            self.roots = {}
+            self.total_bytes = 0
+
+    def drop(self, adapter: Optional[str]):
+        """Forget every prefix computed with an adapter, e.g. after its weights changed"""
+        with self._lock:
+            root = self.roots.pop(adapter, None)
+            stack = [root] if root is not None else []
+            while stack:
+                node = stack.pop()
+                self.total_bytes -= node.nbytes
+                stack.extend(node.children.values())
+
+    # ------------------------------------------------------------------
+    # Model helpers
+    # ------------------------------------------------------------------
+
+    def warm(self, model, token_ids: List[int], adapter: Optional[str] = None) -> LegacyCache:
+        """Precompute and store the KV state for a prefix, returning it"""
+        inputs = torch.tensor([token_ids], device=model.device)
+        kwargs = {"adapter_names": [adapter or BASE_ADAPTER]} if hasattr(model, "peft_config") else {}
+        with torch.no_grad():
+            outputs = model(
+                input_ids=inputs, attention_mask=torch.ones_like(inputs), use_cache=True, **kwargs
+            )
+        past = to_legacy_cache(outputs.past_key_values)
+        self.insert(token_ids, past, adapter)
+        return past
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._cached_nodes()),
+            "cache_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "hit_tokens": self.hit_tokens,
+            "token_hit_rate": self.hit_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            "inserts": self.inserts,
+            "evictions": self.evictions,
+            "bypasses": self.bypasses
+        }
+
+
+def generate_with_prefix(model, tokenizer, cache: PrefixCache, prefix: str, text: str, **generate_kwargs):
+    """model.generate over prefix + text, reusing the cached KV state of prefix.
+
+    The prompt is tokenized as one string, the way training sees it. The
+    cache only applies when those ids start with the prefix's own ids, i.e.
+    the prefix ends on a token boundary (a newline or a closing header usually
+    does); otherwise a BPE/sentencepiece merge across the join would change
+    the prompt, so generation runs without the cache. Returns (input_ids,
+    output sequences) like a plain generate call.
+    """
+    prefix_ids = tokenizer.encode(prefix)
+    prompt_ids = tokenizer.encode(prefix + text)
+
+    past = None
+    if prefix_ids and prompt_ids[:len(prefix_ids)] == prefix_ids:
+        matched, past = cache.match(prompt_ids)
+        if matched < len(prefix_ids):
+            past = cache.warm(model, prefix_ids)
+    else:
+        cache.bypasses += 1
+
+    inputs = torch.tensor([prompt_ids], device=model.device)
+    if past is not None:
+        generate_kwargs["past_key_values"] = from_legacy_cache(fit_cache_to_prompt(past, len(prompt_ids)))
+    with torch.no_grad():
+        outputs = model.generate(inputs, attention_mask=torch.ones_like(inputs), **generate_kwargs)
+    return inputs, outputs
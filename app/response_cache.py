@@ -0,0 +1,291 @@
+"""
+QLORAX Response Cache
+Caches /chat responses for repeated questions, with optional near-duplicate lookup by embedding
+"""
+
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_message(message: str) -> str:
+    """Case- and whitespace-insensitive form of a message used for cache keys"""
+    return re.sub(r"\s+", " ", message).strip().casefold()
+
+
+def _digest(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class InMemoryBackend:
+    """Process-local LRU store with a size limit and per-entry TTL"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        # scope -> (unit embeddings, keys) of cached messages
+        self._vectors: Dict[str, Tuple[np.ndarray, List[str]]] = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            stored_at, value = item
+            if self.ttl and time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._vectors.clear()
+
+    def add_vector(self, scope: str, key: str, vector: np.ndarray):
+        """Remember a cached message's embedding for near-duplicate search within scope"""
+        with self._lock:
+            vectors, keys = self._vectors.get(scope, (np.empty((0, vector.shape[0]), np.float32), []))
+            if key in keys:
+                return
+            vectors, keys = np.vstack([vectors, vector[None, :]]), keys + [key]
+            # Entries evicted from the store simply miss; bound the index the same way
+            self._vectors[scope] = (vectors[-self.max_entries:], keys[-self.max_entries:])
+
+    def vectors(self, scope: str) -> Tuple[Optional[np.ndarray], List[str]]:
+        with self._lock:
+            return self._vectors.get(scope, (None, []))
+
+    def drop_vector(self, scope: str, key: str):
+        with self._lock:
+            vectors, keys = self._vectors.get(scope, (None, []))
+            if key in keys:
+                i = keys.index(key)
+                self._vectors[scope] = (np.delete(vectors, i, axis=0), keys[:i] + keys[i + 1:])
+
+
+class RedisBackend:
+    """Shared store on redis, so replicas behind a load balancer share hits.
+
+    Entries expire through redis TTLs; a sorted set of last-use times
+    keeps the number of entries under max_entries. Message embeddings live
+    in one hash per scope next to the entries, so near-duplicate hits are
+    shared across replicas and survive restarts as well.
+    """
+
+    def __init__(self, client=None, url: Optional[str] = None, max_entries: int = 1024,
+                 ttl: float = 3600.0, prefix: str = "qlorax:response:"):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url or "redis://localhost:6379/0")
+        self.client = client
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.index_key = f"{prefix}index"
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return int(self.client.zcard(self.index_key))
+
+    def get(self, key: str) -> Optional[dict]:
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            # Expired in redis; drop it from the LRU index too
+            self.client.zrem(self.index_key, key)
+            return None
+        self.client.zadd(self.index_key, {key: time.time()})
+        return json.loads(raw)
+
+    def set(self, key: str, value: dict):
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, json.dumps(value), ex=int(self.ttl) if self.ttl else None)
+        pipe.zadd(self.index_key, {key: time.time()})
+        pipe.execute()
+
+        excess = self.client.zcard(self.index_key) - self.max_entries
+        if excess > 0:
+            for oldest, _ in self.client.zpopmin(self.index_key, excess):
+                oldest = oldest.decode() if isinstance(oldest, bytes) else oldest
+                self.client.delete(self.prefix + oldest)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key)
+        self.client.zrem(self.index_key, key)
+
+    def clear(self):
+        keys = [k.decode() if isinstance(k, bytes) else k
+                for k in self.client.zrange(self.index_key, 0, -1)]
+        if keys:
+            self.client.delete(*[self.prefix + k for k in keys])
+        vector_keys = list(self.client.scan_iter(match=f"{self.prefix}vectors:*"))
+        if vector_keys:
+            self.client.delete(*vector_keys)
+        self.client.delete(self.index_key)
+
+    def _vectors_key(self, scope: str) -> str:
+        return f"{self.prefix}vectors:{scope}"
+
+    def add_vector(self, scope: str, key: str, vector: np.ndarray):
+        """Remember a cached message's embedding for near-duplicate search within scope"""
+        name = self._vectors_key(scope)
+        pipe = self.client.pipeline()
+        pipe.hset(name, key, np.asarray(vector, dtype=np.float32).tobytes())
+        if self.ttl:
+            # Lives as long as the newest entry of the scope
+            pipe.expire(name, int(self.ttl))
+        pipe.hlen(name)
+        size = pipe.execute()[-1]
+
+        if size > self.max_entries:
+            # Forget embeddings whose entries expired or were evicted
+            fields = [f.decode() if isinstance(f, bytes) else f for f in self.client.hkeys(name)]
+            pipe = self.client.pipeline()
+            for field in fields:
+                pipe.exists(self.prefix + field)
+            stale = [field for field, alive in zip(fields, pipe.execute()) if not alive]
+            if stale:
+                self.client.hdel(name, *stale)
+
+    def vectors(self, scope: str) -> Tuple[Optional[np.ndarray], List[str]]:
+        stored = self.client.hgetall(self._vectors_key(scope))
+        if not stored:
+            return None, []
+        keys = [k.decode() if isinstance(k, bytes) else k for k in stored]
+        return np.stack([np.frombuffer(v, dtype=np.float32) for v in stored.values()]), keys
+
+    def drop_vector(self, scope: str, key: str):
+        self.client.hdel(self._vectors_key(scope), key)
+
+
+class ResponseCache:
+    """Response cache in front of generation for (near-)deterministic requests.
+
+    Only requests with temperature <= max_temperature are cached, since
+    sampled responses are not meant to repeat. The exact key covers the
+    normalized message, the model version and all sampling parameters.
+    With an `embed` function, a miss falls back to the most similar cached
+    message under the same model and parameters, if its cosine similarity
+    reaches similarity_threshold. Embeddings are kept in the backend, so
+    with redis every replica finds the same near-duplicates.
+    """
+
+    def __init__(self, backend=None, max_temperature: float = 0.3,
+                 embed: Optional[Callable[[List[str]], np.ndarray]] = None,
+                 similarity_threshold: float = 0.95):
+        self.backend = backend if backend is not None else InMemoryBackend()
+        self.max_temperature = max_temperature
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+
+        self.lookups = 0
+        self.hits = 0
+        self.semantic_hits = 0
+        self.stores = 0
+
+    def cacheable(self, temperature: float) -> bool:
+        return temperature <= self.max_temperature
+
+    def _scope(self, model_version: str, params: dict) -> str:
+        return _digest(model_version, params)
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embed([text]), dtype=np.float32).reshape(-1)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def get(self, message: str, model_version: str, **params) -> Optional[str]:
+        """Cached response for a request, or None"""
+        if not self.cacheable(params.get("temperature", 1.0)):
+            return None
+
+        self.lookups += 1
+        scope = self._scope(model_version, params)
+        entry = self.backend.get(_digest(scope, normalize_message(message)))
+        if entry is not None:
+            self.hits += 1
+            return entry["response"]
+
+        if self.embed is None:
+            return None
+        vectors, keys = self.backend.vectors(scope)
+        if vectors is None:
+            return None
+
+        similarities = vectors @ self._embed(normalize_message(message))
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        entry = self.backend.get(keys[best])
+        if entry is None:
+            # Expired or evicted since it was indexed
+            self.backend.drop_vector(scope, keys[best])
+            return None
+        self.hits += 1
+        self.semantic_hits += 1
+        return entry["response"]
+
+    def put(self, message: str, response: str, model_version: str, **params):
+        """Store a generated response if the request is cacheable"""
+        if not self.cacheable(params.get("temperature", 1.0)):
+            return
+
+        scope = self._scope(model_version, params)
+        normalized = normalize_message(message)
+        key = _digest(scope, normalized)
+        self.backend.set(key, {"message": normalized, "response": response, "model": model_version})
+        self.stores += 1
+
+        if self.embed is not None:
+            self.backend.add_vector(scope, key, self._embed(normalized))
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.backend.evictions
+        }
+
+
+def sentence_embedder(model_name: str) -> Callable[[List[str]], np.ndarray]:
+    """Embedding function backed by a sentence-transformers model"""
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name)
+    return lambda texts: model.encode(texts, convert_to_numpy=True)
@@ -0,0 +1,136 @@
+"""
+QLORAX Chat Sessions
+Server-side conversation store that keeps each session's KV cache between turns
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from app.engine import LegacyCache, cache_length, cache_nbytes
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ChatSession:
+    """Conversation state for one session id"""
+    session_id: str
+    token_ids: List[int]
+    past: Optional[LegacyCache] = None  # covers token_ids[:cached_tokens]
+    nbytes: int = 0
+    adapter: Optional[str] = None  # LoRA adapter the cache was computed with
+    last_used: float = field(default_factory=time.time)
+
+    @property
+    def cached_tokens(self) -> int:
+        return cache_length(self.past)
+
+
+class SessionStore:
+    """Chat sessions whose KV caches are bounded by total memory (LRU) and idle TTL.
+
+    Follow-up turns prefill only the tokens after the cached conversation,
+    turning per-turn prefill cost from O(history) into O(new tokens).
+    """
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024, ttl: float = 1800.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        """Return a live session and mark it most recently used"""
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is None:
+                self.misses += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            session.last_used = time.time()
+            self.hits += 1
+            return session
+
+    def put(self, session_id: str, token_ids: List[int], past: Optional[LegacyCache] = None,
+            adapter: Optional[str] = None):
+        """Store (or replace) a session, dropping least recently used caches over budget"""
+        nbytes = cache_nbytes(past)
+        if nbytes > self.max_bytes:
+            # Too big to cache at all; keep the token history so context is not lost
+            logger.info(f"Session {session_id} cache ({nbytes} bytes) exceeds budget, storing tokens only")
+            past, nbytes = None, 0
+
+        with self._lock:
+            self._remove(session_id)
+            self._sessions[session_id] = ChatSession(session_id, list(token_ids), past, nbytes, adapter)
+            self.total_bytes += nbytes
+
+            # Over budget: drop the least recently used caches but keep every conversation's
+            # tokens, so the next turn re-prefills instead of losing context; TTL removes sessions
+            for session in list(self._sessions.values())[:-1]:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                if session.past is not None:
+                    self.total_bytes -= session.nbytes
+                    session.past, session.nbytes = None, 0
+                    self.evictions += 1
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._remove(session_id)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self.total_bytes = 0
+
+    def drop_caches(self, adapter: Optional[str]) -> int:
+        """Discard KV caches computed with an adapter; the conversations keep their tokens"""
+        with self._lock:
+            dropped = 0
+            for session in self._sessions.values():
+                if session.adapter == adapter and session.past is not None:
+                    self.total_bytes -= session.nbytes
+                    session.past, session.nbytes = None, 0
+                    dropped += 1
+            return dropped
+
+    def _remove(self, session_id: str) -> bool:
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self.total_bytes -= session.nbytes
+        return True
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        expired = [sid for sid, s in self._sessions.items() if s.last_used < cutoff]
+        for session_id in expired:
+            self._remove(session_id)
+            self.expirations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "cache_bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
@@ -0,0 +1,77 @@
+"""
+QLORAX Token Streaming
+Incremental detokenization and helpers for streaming generated tokens to clients
+"""
+
+import json
+from typing import Callable, List
+
+try:
+    from transformers.generation.streamers import BaseStreamer
+except ImportError:  # very old transformers
+    BaseStreamer = object
+
+
+class IncrementalDetokenizer:
+    """Turns a stream of token ids into text deltas.
+
+    Only a small window of trailing tokens is decoded per step, so the cost
+    does not grow with the length of the response. The window is needed
+    because byte-level BPE tokens can split a character (and sentencepiece
+    tokens carry leading-space markers), so a token's text is only final
+    once the following token has been seen.
+    """
+
+    def __init__(self, tokenizer, skip_special_tokens: bool = True):
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.token_ids: List[int] = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def _decode(self, token_ids: List[int]) -> str:
+        return self.tokenizer.decode(token_ids, skip_special_tokens=self.skip_special_tokens)
+
+    def push(self, token_id: int) -> str:
+        """Add one token and return the newly completed text, if any"""
+        self.token_ids.append(token_id)
+        prefix_text = self._decode(self.token_ids[self.prefix_offset:self.read_offset])
+        new_text = self._decode(self.token_ids[self.prefix_offset:])
+
+        # A trailing replacement character means a multi-byte character is incomplete
+        if len(new_text) > len(prefix_text) and not new_text.endswith("�"):
+            self.prefix_offset = self.read_offset
+            self.read_offset = len(self.token_ids)
+            return new_text[len(prefix_text):]
+        return ""
+
+    def flush(self) -> str:
+        """Return any text still held back at the end of generation"""
+        prefix_text = self._decode(self.token_ids[self.prefix_offset:self.read_offset])
+        new_text = self._decode(self.token_ids[self.prefix_offset:])
+        self.prefix_offset = self.read_offset = len(self.token_ids)
+        return new_text[len(prefix_text):]
+
+
+class TokenCallbackStreamer(BaseStreamer):
+    """model.generate streamer that forwards each new token id to a callback"""
+
+    def __init__(self, on_token: Callable[[int], None]):
+        self.on_token = on_token
+        self.prompt_seen = False
+
+    def put(self, value):
+        # generate() first pushes the prompt, which must not be streamed back
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        for token_id in value.reshape(-1).tolist():
+            self.on_token(token_id)
+
+    def end(self):
+        pass
+
+
+def sse_event(data: dict) -> str:
+    """Format a Server-Sent Events message"""
+    return f"data: {json.dumps(data)}\n\n"
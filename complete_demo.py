@@ -13,11 +13,14 @@ from transformers import AutoTokenizer, AutoModelForCausalLM
 from peft import PeftModel
 import time
 
+from app.prefix_cache import PrefixCache, generate_with_prefix
+
 class QLORAXDemo:
     def __init__(self, model_path="models/production-model/checkpoints"):
         self.model_path = Path(model_path)
         self.model = None
         self.tokenizer = None
+        self.prefix_cache = PrefixCache()
         self.demo_queries = [
             "What is machine learning?",
             "How do neural networks work?",
@@ -86,32 +89,26 @@ class QLORAXDemo:
             return "❌ Model not loaded"
         
         try:
-            # Format prompt
-            formatted_prompt = f"### Input:\n{prompt}\n\n### Output:\n"
-            
-            # Tokenize
-            inputs = self.tokenizer.encode(formatted_prompt, return_tensors="pt")
-            
-            # Generate
+            # Generate, reusing the cached KV state of the "### Input:" header
             start_time = time.time()
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    inputs,
-                    max_length=inputs.shape[1] + max_length,
-                    temperature=temperature,
-                    do_sample=do_sample,
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    eos_token_id=self.tokenizer.eos_token_id,
-                    repetition_penalty=1.1
-                )
+            inputs, outputs = generate_with_prefix(
+                self.model,
+                self.tokenizer,
+                self.prefix_cache,
+                "### Input:\n",
+                f"{prompt}\n\n### Output:\n",
+                max_new_tokens=max_length,
+                temperature=temperature,
+                do_sample=do_sample,
+                pad_token_id=self.tokenizer.eos_token_id,
+                eos_token_id=self.tokenizer.eos_token_id,
+                repetition_penalty=1.1
+            )
             
             inference_time = time.time() - start_time
             
-            # Decode response
-            full_response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            
-            # Extract only the generated part
-            response = full_response[len(formatted_prompt):].strip()
+            # Decode only the generated part
+            response = self.tokenizer.decode(outputs[0][inputs.shape[1]:], skip_special_tokens=True).strip()
             
             return {
                 "response": response,
@@ -119,7 +119,7 @@ case "${1:-api}" in
 import requests
 import sys
 try:
-    response = requests.get('http://localhost:8000/health', timeout=5)
+    response = requests.get('http://localhost:8000/readyz', timeout=5)
     if response.status_code == 200:
         print('✓ Health check passed')
         sys.exit(0)
@@ -72,17 +72,17 @@ check_containers() {
 check_health_endpoint() {
     print_status "INFO" "Checking health endpoints..."
     
-    # Wait for services to be ready
-    sleep 5
-    
-    # Check FastAPI health
-    if curl -f -s http://localhost:8000/health >/dev/null 2>&1; then
-        print_status "OK" "FastAPI health endpoint is responding"
+    # Liveness: the API process is up
+    if curl -f -s http://localhost:8000/livez >/dev/null 2>&1; then
+        print_status "OK" "FastAPI is alive"
     else
-        print_status "ERROR" "FastAPI health endpoint is not responding"
+        print_status "ERROR" "FastAPI liveness endpoint is not responding"
         return 1
     fi
     
+    # Readiness: the model is loaded and warmed up; wait up to READY_TIMEOUT seconds
+    check_readiness || return 1
+    
     # Check if Gradio is accessible
     if curl -f -s http://localhost:7860 >/dev/null 2>&1; then
         print_status "OK" "Gradio interface is accessible"
@@ -93,6 +93,26 @@ check_health_endpoint() {
     return 0
 }
 
+check_readiness() {
+    local timeout=${READY_TIMEOUT:-300}
+    local waited=0
+    
+    until curl -f -s http://localhost:8000/readyz >/dev/null 2>&1; do
+        if [ $waited -ge $timeout ]; then
+            print_status "ERROR" "Model is not ready after ${timeout}s: $(curl -s http://localhost:8000/readyz)"
+            return 1
+        fi
+        if [ $((waited % 30)) -eq 0 ]; then
+            print_status "INFO" "Waiting for model: $(curl -s http://localhost:8000/readyz)"
+        fi
+        sleep 5
+        waited=$((waited + 5))
+    done
+    
+    print_status "OK" "Model is loaded and ready to serve"
+    return 0
+}
+
 check_volumes() {
     print_status "INFO" "Checking volume mounts..."
     
@@ -250,9 +270,12 @@ if [ "${1:-full}" = "full" ]; then
     run_comprehensive_check
 elif [ "$1" = "quick" ]; then
     check_docker && check_containers && check_health_endpoint
+elif [ "$1" = "ready" ]; then
+    check_readiness
 else
-    echo "Usage: $0 [full|quick]"
+    echo "Usage: $0 [full|quick|ready]"
     echo "  full  - Run comprehensive health check (default)"
     echo "  quick - Run basic connectivity check"
+    echo "  ready - Wait until the model is loaded and serving"
     exit 1
 fi
\ No newline at end of file
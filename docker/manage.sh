@@ -126,7 +126,7 @@ show_status() {
     docker-compose ps
     
     print_info "\nHealth checks:"
-    docker-compose exec qlorax curl -f http://localhost:8000/health 2>/dev/null || print_warning "Health check failed"
+    docker-compose exec qlorax curl -f http://localhost:8000/readyz 2>/dev/null || print_warning "Health check failed"
 }
 
 cleanup() {
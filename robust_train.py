@@ -18,6 +18,8 @@ from peft import LoraConfig, get_peft_model, TaskType
 from datasets import Dataset
 import logging
 
+from scripts.token_cache import cache_key, load_or_build
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -112,12 +114,7 @@ def main():
     
     # Load and prepare dataset
     print("📊 Loading dataset...")
-    raw_data = load_dataset(dataset_path)
-    
-    # Create training prompts
-    train_texts = [create_training_prompt(example) for example in raw_data]
     
-    # Tokenize
     def tokenize_function(examples):
         return tokenizer(
             examples["text"], 
@@ -127,8 +124,16 @@ def main():
             return_tensors="pt"
         )
     
-    train_dataset = Dataset.from_dict({"text": train_texts})
-    train_dataset = train_dataset.map(tokenize_function, batched=True)
+    def build_dataset():
+        raw_data = load_dataset(dataset_path)
+        train_texts = [create_training_prompt(example) for example in raw_data]
+        return Dataset.from_dict({"text": train_texts}).map(tokenize_function, batched=True)
+    
+    # Reuse the tokenized dataset while the data, tokenizer and prompt format are unchanged
+    template = create_training_prompt({"input": "{input}", "output": "{output}"})
+    train_dataset = load_or_build(
+        cache_key(dataset_path, tokenizer, template, 256, padding=True), build_dataset
+    )
     
     # Training arguments - optimized for quick training
     training_args = TrainingArguments(
@@ -166,7 +171,7 @@ def main():
     
     # Start training
     print("🏃 Starting training...")
-    print(f"Dataset size: {len(train_texts)} examples")
+    print(f"Dataset size: {len(train_dataset)} examples")
     print(f"Model: {model.config._name_or_path}")
     print(f"Output directory: {output_dir}")
     print("=" * 60)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+QLORAX Training Batches
+Length-grouped sampling and per-log-step throughput and padding figures for the Trainer
+"""
+
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+from transformers import Trainer
+
+# Batches per megabatch: more batches means tighter length groups but less random batches
+MEGABATCH_MULT = 50
+
+
+class MegabatchLengthSampler(Sampler):
+    """Random order in which each batch holds examples of similar length.
+
+    Every epoch the dataset is shuffled and cut into megabatches of
+    megabatch_mult * batch_size examples. Each megabatch is sorted by length
+    and split into batches, and then all batches are shuffled. The batch with
+    the longest example goes first, so running out of memory happens at step
+    one rather than hours in.
+    """
+
+    def __init__(self, lengths: Sequence[int], batch_size: int, megabatch_mult: int = MEGABATCH_MULT,
+                 seed: int = 42):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = max(1, batch_size)
+        self.megabatch_size = self.batch_size * max(1, megabatch_mult)
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def batches(self) -> List[np.ndarray]:
+        rng = np.random.default_rng(self.seed + self.epoch)
+        order = rng.permutation(len(self.lengths))
+        batches = []
+        for start in range(0, len(order), self.megabatch_size):
+            megabatch = order[start:start + self.megabatch_size]
+            megabatch = megabatch[np.argsort(-self.lengths[megabatch], kind="stable")]
+            batches.extend(np.array_split(megabatch, range(self.batch_size, len(megabatch), self.batch_size)))
+        batches = [batches[i] for i in rng.permutation(len(batches))]
+        longest = max(range(len(batches)), key=lambda i: self.lengths[batches[i]].max(), default=0)
+        if batches:
+            batches[0], batches[longest] = batches[longest], batches[0]
+        return batches
+
+    def __iter__(self) -> Iterator[int]:
+        batches = self.batches()
+        # A new order every epoch, reproducible from the seed
+        self.epoch += 1
+        for batch in batches:
+            yield from batch.tolist()
+
+
+class LengthSortedSampler(Sampler):
+    """Longest first; evaluation order does not change the loss, only how much is padding"""
+
+    def __init__(self, lengths: Sequence[int]):
+        self.order = np.argsort(-np.asarray(lengths), kind="stable").tolist()
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.order)
+
+
+class TokenCountingCollator:
+    """Wraps a collator, adding the batch's unpadded token count as real_tokens"""
+
+    def __init__(self, collator: Callable[[List[Dict[str, Any]]], Dict[str, torch.Tensor]]):
+        self.collator = collator
+
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        real_tokens = sum(len(feature["input_ids"]) for feature in features)
+        batch = self.collator(features)
+        batch["real_tokens"] = torch.tensor(real_tokens)
+        return batch
+
+
+class BatchingTrainer(Trainer):
+    """Trainer with optional length-grouped batches, logging tokens/s and padding ratio every log step.
+
+    Expects batches from TokenCountingCollator. real_tokens is removed before
+    the model sees the batch. Time spent in evaluation is not counted against
+    training throughput.
+    """
+
+    def __init__(self, *args, lengths: Optional[Dict[str, Sequence[int]]] = None,
+                 megabatch_mult: int = MEGABATCH_MULT, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Example lengths per split ("train", "eval"); a split without them keeps the default order
+        self.lengths = lengths or {}
+        self.megabatch_mult = megabatch_mult
+        self.batch_stats = {"real_tokens": 0, "total_tokens": 0}
+        self._window = {"real_tokens": 0, "total_tokens": 0, "paused": 0.0}
+        self._window_start: Optional[float] = None
+
+    def _get_train_sampler(self, *args, **kwargs):
+        if "train" not in self.lengths:
+            return super()._get_train_sampler(*args, **kwargs)
+        return MegabatchLengthSampler(
+            self.lengths["train"], self.args.per_device_train_batch_size,
+            megabatch_mult=self.megabatch_mult, seed=self.args.seed
+        )
+
+    def _get_eval_sampler(self, eval_dataset, *args, **kwargs):
+        if "eval" not in self.lengths or len(self.lengths["eval"]) != len(eval_dataset):
+            return super()._get_eval_sampler(eval_dataset, *args, **kwargs)
+        return LengthSortedSampler(self.lengths["eval"])
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        if self._window_start is None:
+            self._window_start = time.perf_counter()
+        real_tokens = inputs.pop("real_tokens", None)
+        if real_tokens is not None:
+            self._window["real_tokens"] += int(real_tokens)
+            self._window["total_tokens"] += inputs["input_ids"].numel()
+        return super().training_step(model, inputs, *args, **kwargs)
+
+    def prediction_step(self, model, inputs, *args, **kwargs):
+        inputs.pop("real_tokens", None)
+        return super().prediction_step(model, inputs, *args, **kwargs)
+
+    def evaluate(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().evaluate(*args, **kwargs)
+        finally:
+            self._window["paused"] += time.perf_counter() - started
+
+    def log(self, logs: Dict[str, float], *args, **kwargs):
+        window = self._window
+        if "loss" in logs and window["total_tokens"] and self._window_start is not None:
+            now = time.perf_counter()
+            elapsed = now - self._window_start - window["paused"]
+            logs["tokens_per_second"] = round(window["real_tokens"] / elapsed, 2) if elapsed > 0 else 0.0
+            logs["padding_ratio"] = round(1 - window["real_tokens"] / window["total_tokens"], 4)
+            for key in ("real_tokens", "total_tokens"):
+                self.batch_stats[key] += window[key]
+            self._window = {"real_tokens": 0, "total_tokens": 0, "paused": 0.0}
+            self._window_start = now
+        super().log(logs, *args, **kwargs)
+
+    def padding_ratio(self) -> float:
+        """Share of padded token slots across every logged training step"""
+        stats = self.batch_stats
+        return 1 - stats["real_tokens"] / stats["total_tokens"] if stats["total_tokens"] else 0.0
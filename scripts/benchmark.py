@@ -5,12 +5,13 @@ Evaluates fine-tuned models across multiple metrics and generates detailed repor
 """
 
 import os
+import sys
 import json
 import math
 import time
 import argparse
 from pathlib import Path
-from typing import Dict, List, Tuple, Any, Optional
+from typing import Dict, Iterator, List, Tuple, Any, Optional
 from datetime import datetime
 
 import torch
@@ -19,24 +20,109 @@ from datasets import Dataset
 from transformers import AutoTokenizer, AutoModelForCausalLM
 from peft import PeftModel
 import nltk
-from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
-from rouge_score import rouge_scorer
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import matplotlib.pyplot as plt
 import seaborn as sns
 from tqdm import tqdm
 
+# Add project root to Python path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.engine import crop_cache, from_legacy_cache, to_legacy_cache
+from scripts.data_stream import iter_chunks, load_records
+from scripts.memory_profile import MB, MemoryProfiler
+from scripts.text_metrics import EmbeddingCache, compute_text_metrics, rowwise_cosine, score_corpus, text_hash
+
+PROMPT_PREFIX = "### Input:\n"
+SEMANTIC_MODEL = "all-MiniLM-L6-v2"
+
 # Download required NLTK data
 try:
     nltk.data.find('tokenizers/punkt')
 except LookupError:
     nltk.download('punkt')
 
+
+def perplexity(loss: float, tokens: int) -> float:
+    """exp of the mean token loss; inf when no tokens were scored (e.g. an empty test set)"""
+    return math.exp(loss / tokens) if tokens else float('inf')
+
+
+def example_key(example: Dict[str, Any]) -> str:
+    """Stable id of a test example, used to match it with a saved prediction"""
+    return text_hash(json.dumps(example, sort_keys=True))
+
+
+class PredictionStore:
+    """Append-only predictions.jsonl, flushed after every chunk so a killed run can resume.
+    
+    The first line records the settings the predictions were made with;
+    resuming with different settings is refused rather than mixing runs.
+    """
+    
+    def __init__(self, path: Path, run_config: Dict[str, Any], resume: bool = False):
+        self.path = Path(path)
+        self.records: Dict[str, Dict[str, Any]] = {}
+        
+        if resume and self.path.exists():
+            self._load(run_config)
+            self.file = open(self.path, 'a')
+        else:
+            self.file = open(self.path, 'w')
+            self.file.write(json.dumps({'run_config': run_config}) + '\n')
+            self.file.flush()
+        self.resumed = len(self.records)
+    
+    def _load(self, run_config: Dict[str, Any]):
+        with open(self.path, 'rb+') as f:
+            good_bytes = 0
+            for number, line in enumerate(f):
+                try:
+                    # A line cut short by the crash has no newline yet
+                    record = json.loads(line) if line.endswith(b'\n') else None
+                except json.JSONDecodeError:
+                    record = None
+                if record is None:
+                    break
+                if number == 0:
+                    if record.get('run_config') != json.loads(json.dumps(run_config)):
+                        raise ValueError(
+                            f"{self.path} was written with {record.get('run_config')}; "
+                            "use another output directory or drop --resume"
+                        )
+                else:
+                    self.records[record['id']] = record
+                good_bytes += len(line)
+            # Drop a torn last line so new records start on a clean line
+            f.truncate(good_bytes)
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self.records
+    
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        return self.records[key]
+    
+    def append(self, records: List[Dict[str, Any]]):
+        for record in records:
+            self.records[record['id']] = record
+            self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+    
+    def close(self):
+        self.file.close()
+
+
 class ModelBenchmark:
     """Comprehensive model evaluation and benchmarking"""
     
-    def __init__(self, model_path: str, test_data_path: str, output_dir: str):
+    def __init__(self, model_path: str, test_data_path: str, output_dir: str, batch_size: int = 8,
+                 max_context: Optional[int] = None, stride: Optional[int] = None,
+                 metric_workers: Optional[int] = None, metrics_backend: str = "numpy",
+                 embedding_cache_dir: Optional[str] = "cache/embeddings", embedding_batch_size: int = 128,
+                 limit: Optional[int] = None, sample: Optional[int] = None, chunk_size: int = 1024,
+                 resume: bool = False, trace_python_memory: bool = False):
         """Initialize benchmark suite"""
         self.model_path = Path(model_path)
         self.test_data_path = Path(test_data_path)
@@ -46,9 +132,39 @@ class ModelBenchmark:
         self.results = {}
         self.predictions = []
         
+        # Read at most limit examples, optionally a random sample of that many, chunk_size at a time
+        self.limit = limit
+        self.sample = sample
+        self.chunk_size = max(1, chunk_size)
+        # Reuse predictions already saved in output_dir/predictions.jsonl
+        self.resume = resume
+        
+        # Examples scored and generated per forward pass / model.generate call
+        self.batch_size = max(1, batch_size)
+        self.generation_kwargs = {"temperature": 0.7, "do_sample": True}
+        
+        # Loss, timing and token counts of evaluate(), summed over every chunk evaluated
+        self.eval_totals = dict.fromkeys(
+            ["loss", "tokens", "prefill_time", "decode_time", "generated_tokens", "samples", "batches"], 0
+        )
+        
+        # Perplexity window; longer examples are scored with overlapping windows stride tokens apart
+        self.max_context = max_context
+        self.stride = stride
+        
+        # "numpy" scores token-id arrays in-process; "library" runs nltk/rouge_score
+        # over metric_workers processes (None = one per CPU)
+        self.metrics_backend = metrics_backend
+        self.metric_workers = metric_workers
+        
+        # Peak RSS of the load, prefill, decode and metrics phases; Python-heap tracing is
+        # opt-in because tracemalloc slows the Python-heavy phases and skews their timings
+        self.memory = MemoryProfiler(trace_python=trace_python_memory)
+        
         # Initialize metrics
-        self.rouge_scorer = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
         self.semantic_model = None
+        self.embedding_batch_size = embedding_batch_size
+        self.embedding_cache = EmbeddingCache(embedding_cache_dir, SEMANTIC_MODEL) if embedding_cache_dir else None
         
         print(f"🔬 Initializing benchmark for model: {self.model_path}")
         print(f"📊 Test data: {self.test_data_path}")
@@ -95,223 +211,409 @@ class ModelBenchmark:
         self.model.eval()
         print("✅ Model loaded successfully")
     
+    def iter_test_data(self) -> Iterator[Dict[str, str]]:
+        """Stream test examples (.json/.jsonl, optionally .gz/.zst), honouring limit and sample"""
+        return load_records(str(self.test_data_path), limit=self.limit, sample=self.sample)
+    
     def load_test_data(self) -> List[Dict[str, str]]:
         """Load test dataset"""
         print("📊 Loading test data...")
         
-        test_data = []
-        if self.test_data_path.suffix == '.jsonl':
-            with open(self.test_data_path, 'r') as f:
-                for line in f:
-                    test_data.append(json.loads(line.strip()))
-        elif self.test_data_path.suffix == '.json':
-            with open(self.test_data_path, 'r') as f:
-                test_data = json.load(f)
-        else:
-            raise ValueError(f"Unsupported file format: {self.test_data_path.suffix}")
+        test_data = list(self.iter_test_data())
         
         print(f"📋 Loaded {len(test_data)} test examples")
         return test_data
     
-    def generate_prediction(self, input_text: str, max_length: int = 512) -> str:
-        """Generate prediction for a single input"""
-        prompt = f"### Input:\n{input_text}\n\n### Output:\n"
-        inputs = self.tokenizer.encode(prompt, return_tensors="pt")
+    def encode_prompt(self, input_text: str) -> List[int]:
+        """Prompt token ids, tokenized as one string like the training data"""
+        return self.tokenizer.encode(f"{PROMPT_PREFIX}{input_text}\n\n### Output:\n")
+    
+    def encode_example(self, example: Dict[str, str]) -> List[int]:
+        """Prompt and reference token ids, tokenized as one string exactly as training sees them"""
+        return self.tokenizer.encode(f"{PROMPT_PREFIX}{example['input']}\n\n### Output:\n{example['output']}")
+    
+    def generate_batch(self, prompts: List[List[int]], max_length: int = 512) -> List[str]:
+        """Generate predictions for a batch of tokenized prompts in one call"""
+        # Left-pad so every prompt ends at the same position and new tokens line up
+        width = max(len(ids) for ids in prompts)
+        input_ids = torch.tensor(
+            [[self.pad_token_id] * (width - len(ids)) + ids for ids in prompts], device=self.model.device
+        )
+        attention_mask = torch.tensor(
+            [[0] * (width - len(ids)) + [1] * len(ids) for ids in prompts], device=self.model.device
+        )
         
         with torch.no_grad():
             outputs = self.model.generate(
-                input_ids=inputs,
-                max_length=inputs.shape[1] + max_length,
-                num_return_sequences=1,
-                temperature=0.7,
-                do_sample=True,
+                input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=max_length,
                 pad_token_id=self.tokenizer.eos_token_id,
-                eos_token_id=self.tokenizer.eos_token_id
+                eos_token_id=self.tokenizer.eos_token_id,
+                **self.generation_kwargs
             )
         
-        generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-        # Extract only the generated part
-        response = generated_text[len(prompt):].strip()
-        return response
+        # Finished rows are padded with eos, which skip_special_tokens drops
+        return [
+            self.tokenizer.decode(row[width:], skip_special_tokens=True).strip()
+            for row in outputs
+        ]
     
-    def calculate_perplexity(self, test_data: List[Dict[str, str]]) -> float:
-        """Calculate perplexity on test set"""
-        print("📈 Calculating perplexity...")
-        
-        total_loss = 0
-        total_tokens = 0
-        
-        for example in tqdm(test_data, desc="Computing perplexity"):
-            prompt = f"### Input:\n{example['input']}\n\n### Output:\n{example['output']}"
-            inputs = self.tokenizer(prompt, return_tensors="pt", truncation=True, max_length=1024)
+    def perplexity_window(self) -> Tuple[int, int]:
+        """(window length, stride) for perplexity, defaulting to the model context capped at 1024"""
+        max_context = self.max_context
+        if max_context is None:
+            config = self.model.config
+            max_context = min(getattr(config, "max_position_embeddings", None) or getattr(config, "n_positions", 1024), 1024)
+        # Keep at least one token of overlap so no window starts without context
+        stride = min(self.stride or max_context // 2, max_context - 1)
+        return max_context, max(1, stride)
+    
+    def perplexity_segments(self, token_ids: List[int]) -> List[Tuple[List[int], int]]:
+        """Split a sequence into (window ids, number of leading context-only tokens).
+        
+        Each window re-reads up to max_context - stride earlier tokens as
+        context and is scored only on tokens no previous window scored, so
+        every token after the first is counted exactly once.
+        """
+        max_context, stride = self.perplexity_window()
+        segments = []
+        scored_end = 0
+        for begin in range(0, max(len(token_ids) - 1, 1), stride):
+            end = min(begin + max_context, len(token_ids))
+            segments.append((token_ids[begin:end], scored_end - begin if scored_end > begin else 0))
+            scored_end = end
+            if end == len(token_ids):
+                break
+        return segments
+    
+    @property
+    def pad_token_id(self) -> int:
+        if self.tokenizer.pad_token_id is not None:
+            return self.tokenizer.pad_token_id
+        return self.tokenizer.eos_token_id
+    
+    @staticmethod
+    def token_losses(logits: torch.Tensor, labels: torch.Tensor) -> Tuple[List[float], List[int]]:
+        """Summed next-token loss and number of scored tokens per row (labels of -100 are skipped)"""
+        labels = labels[:, 1:].to(logits.device)
+        losses = torch.nn.functional.cross_entropy(
+            logits[:, :-1].float().transpose(1, 2), labels, ignore_index=-100, reduction="none"
+        )
+        return losses.sum(-1).tolist(), (labels != -100).sum(-1).tolist()
+    
+    def segment_loss(self, segments: List[Tuple[List[int], int]]) -> Tuple[List[float], List[int]]:
+        """Loss and token count of each perplexity window, run in length-bucketed batches"""
+        # Longest first: similar lengths share a batch, and an OOM shows up on the first batch
+        order = sorted(range(len(segments)), key=lambda i: len(segments[i][0]), reverse=True)
+        
+        losses = [0.0] * len(segments)
+        tokens = [0] * len(segments)
+        for start in tqdm(range(0, len(order), self.batch_size), desc="Computing perplexity"):
+            bucket = order[start:start + self.batch_size]
+            batch = [segments[i] for i in bucket]
+            width = len(batch[0][0])
+            input_ids = torch.tensor([ids + [self.pad_token_id] * (width - len(ids)) for ids, _ in batch])
+            attention_mask = torch.tensor([[1] * len(ids) + [0] * (width - len(ids)) for ids, _ in batch])
+            # Padding and context-only tokens carry no loss
+            labels = input_ids.masked_fill(attention_mask == 0, -100)
+            for row, (_, context) in enumerate(batch):
+                labels[row, :context] = -100
             
             with torch.no_grad():
-                outputs = self.model(**inputs, labels=inputs["input_ids"])
-                loss = outputs.loss
-                total_loss += loss.item() * inputs["input_ids"].shape[1]
-                total_tokens += inputs["input_ids"].shape[1]
-        
-        avg_loss = total_loss / total_tokens
-        perplexity = math.exp(avg_loss)
+                logits = self.model(
+                    input_ids=input_ids.to(self.model.device),
+                    attention_mask=attention_mask.to(self.model.device)
+                ).logits
+            for i, loss, count in zip(bucket, *self.token_losses(logits, labels)):
+                losses[i] = loss
+                tokens[i] = count
+        return losses, tokens
+    
+    def semantic_scores(self, predictions: List[str], references: List[str]) -> np.ndarray:
+        """Cosine similarity of each prediction's sentence embedding to its reference's"""
+        def encode(texts: List[str]) -> np.ndarray:
+            if self.semantic_model is None:
+                print("📥 Loading sentence transformer model...")
+                self.semantic_model = SentenceTransformer(SEMANTIC_MODEL)
+            return self.semantic_model.encode(
+                texts, batch_size=self.embedding_batch_size, convert_to_numpy=True, show_progress_bar=len(texts) > 1000
+            )
         
-        print(f"📊 Perplexity: {perplexity:.2f}")
-        return perplexity
+        # Encode all texts at once; the cache skips references seen on earlier runs
+        if self.embedding_cache is not None:
+            pred_embeddings = self.embedding_cache.embed(predictions, encode)
+            ref_embeddings = self.embedding_cache.embed(references, encode)
+        else:
+            pred_embeddings = encode(predictions)
+            ref_embeddings = encode(references)
+        return rowwise_cosine(pred_embeddings, ref_embeddings)
     
-    def calculate_bleu_scores(self, predictions: List[str], references: List[str]) -> Dict[str, float]:
-        """Calculate BLEU scores"""
-        print("🔤 Calculating BLEU scores...")
+    def calculate_semantic_similarity(self, predictions: List[str], references: List[str]) -> float:
+        """Mean semantic similarity; per-sample scores already saved with the predictions are reused"""
+        print("🧠 Calculating semantic similarity...")
         
-        smoothing = SmoothingFunction().method1
-        bleu_1_scores = []
-        bleu_2_scores = []
-        bleu_4_scores = []
+        entries = self.predictions[-len(predictions):] if predictions else []
+        missing = [i for i, entry in enumerate(entries) if 'semantic_similarity' not in entry.get('scores', {})]
+        if missing:
+            similarities = self.semantic_scores([predictions[i] for i in missing], [references[i] for i in missing])
+            for i, similarity in zip(missing, similarities):
+                entries[i].setdefault('scores', {})['semantic_similarity'] = float(similarity)
+        if self.embedding_cache is not None:
+            print(f"💾 Embedding cache: {self.embedding_cache.hits} hits, {self.embedding_cache.misses} encoded")
         
-        for pred, ref in tqdm(zip(predictions, references), desc="Computing BLEU", total=len(predictions)):
-            pred_tokens = nltk.word_tokenize(pred.lower())
-            ref_tokens = [nltk.word_tokenize(ref.lower())]
-            
-            # BLEU-1
-            bleu_1 = sentence_bleu(ref_tokens, pred_tokens, weights=(1, 0, 0, 0), smoothing_function=smoothing)
-            bleu_1_scores.append(bleu_1)
-            
-            # BLEU-2
-            bleu_2 = sentence_bleu(ref_tokens, pred_tokens, weights=(0.5, 0.5, 0, 0), smoothing_function=smoothing)
-            bleu_2_scores.append(bleu_2)
-            
-            # BLEU-4
-            bleu_4 = sentence_bleu(ref_tokens, pred_tokens, weights=(0.25, 0.25, 0.25, 0.25), smoothing_function=smoothing)
-            bleu_4_scores.append(bleu_4)
-        
-        results = {
-            'bleu_1': np.mean(bleu_1_scores) * 100,
-            'bleu_2': np.mean(bleu_2_scores) * 100,
-            'bleu_4': np.mean(bleu_4_scores) * 100
-        }
+        avg_similarity = float(np.mean([entry['scores']['semantic_similarity'] for entry in entries]))
+        print(f"📊 Semantic Similarity: {avg_similarity:.3f}")
+        return avg_similarity
+    
+    def calculate_text_metrics(self, predictions: List[str], references: List[str]) -> Dict[str, float]:
+        """BLEU, ROUGE and exact match in one pass, with NumPy or the nltk/rouge_score libraries"""
+        if self.metrics_backend == "numpy":
+            print("🔤 Calculating BLEU, ROUGE and exact match (numpy)...")
+            results, per_sample = score_corpus(predictions, references)
+            # Per-example scores end up in predictions.json
+            for i, entry in enumerate(self.predictions[-len(predictions):]):
+                entry.setdefault('scores', {}).update({name: float(values[i]) for name, values in per_sample.items()})
+        else:
+            print(f"🔤 Calculating BLEU, ROUGE and exact match ({self.metric_workers or os.cpu_count()} workers)...")
+            results = compute_text_metrics(predictions, references, workers=self.metric_workers)
         
         print(f"📊 BLEU-1: {results['bleu_1']:.2f}")
         print(f"📊 BLEU-2: {results['bleu_2']:.2f}")
         print(f"📊 BLEU-4: {results['bleu_4']:.2f}")
-        
-        return results
-    
-    def calculate_rouge_scores(self, predictions: List[str], references: List[str]) -> Dict[str, float]:
-        """Calculate ROUGE scores"""
-        print("🌹 Calculating ROUGE scores...")
-        
-        rouge_1_scores = []
-        rouge_2_scores = []
-        rouge_l_scores = []
-        
-        for pred, ref in tqdm(zip(predictions, references), desc="Computing ROUGE", total=len(predictions)):
-            scores = self.rouge_scorer.score(ref, pred)
-            rouge_1_scores.append(scores['rouge1'].fmeasure)
-            rouge_2_scores.append(scores['rouge2'].fmeasure)
-            rouge_l_scores.append(scores['rougeL'].fmeasure)
-        
-        results = {
-            'rouge_1': np.mean(rouge_1_scores),
-            'rouge_2': np.mean(rouge_2_scores),
-            'rouge_l': np.mean(rouge_l_scores)
-        }
-        
+        if 'corpus_bleu_4' in results:
+            print(f"📊 Corpus BLEU-4: {results['corpus_bleu_4']:.2f}")
         print(f"📊 ROUGE-1: {results['rouge_1']:.3f}")
         print(f"📊 ROUGE-2: {results['rouge_2']:.3f}")
         print(f"📊 ROUGE-L: {results['rouge_l']:.3f}")
-        
+        print(f"📊 Exact Match: {results['exact_match']:.3f}")
         return results
     
-    def calculate_semantic_similarity(self, predictions: List[str], references: List[str]) -> float:
-        """Calculate semantic similarity using sentence transformers"""
-        print("🧠 Calculating semantic similarity...")
-        
-        if self.semantic_model is None:
-            print("📥 Loading sentence transformer model...")
-            self.semantic_model = SentenceTransformer('all-MiniLM-L6-v2')
-        
-        # Encode sentences
-        pred_embeddings = self.semantic_model.encode(predictions)
-        ref_embeddings = self.semantic_model.encode(references)
-        
-        # Calculate cosine similarities
-        similarities = []
-        for pred_emb, ref_emb in zip(pred_embeddings, ref_embeddings):
-            similarity = cosine_similarity([pred_emb], [ref_emb])[0][0]
-            similarities.append(similarity)
+    def score_and_generate(self, prompts: List[List[int]], references: List[List[int]],
+                           max_length: int = 512) -> Tuple[List[str], Dict[str, float]]:
+        """Score prompt + reference and generate from the prompt with one prefill.
+        
+        Prompts are left-padded to a common width and references right-padded
+        after them, so the forward pass that scores the references leaves the
+        KV state of every prompt in the first `width` cache positions. That
+        state is handed to generate(), which then only runs the last prompt
+        token and the decode steps.
+        """
+        width = max(len(ids) for ids in prompts)
+        ref_width = max(len(ids) for ids in references)
+        rows, mask = [], []
+        for prompt, reference in zip(prompts, references):
+            left, right = width - len(prompt), ref_width - len(reference)
+            rows.append([self.pad_token_id] * left + prompt + reference + [self.pad_token_id] * right)
+            mask.append([0] * left + [1] * (len(prompt) + len(reference)) + [0] * right)
+        input_ids = torch.tensor(rows, device=self.model.device)
+        attention_mask = torch.tensor(mask, device=self.model.device)
+        # Positions count real tokens only, as generate() does for left-padded input
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+        
+        # Score every token after the first real one, as segment_loss does for long examples
+        labels = input_ids.masked_fill(attention_mask == 0, -100)
+        for row, prompt in enumerate(prompts):
+            labels[row, :width - len(prompt) + 1] = -100
+        
+        started = time.perf_counter()
+        with self.memory.phase("prefill"), torch.no_grad():
+            outputs = self.model(
+                input_ids=input_ids, attention_mask=attention_mask,
+                position_ids=position_ids, use_cache=True
+            )
+        prefill_time = time.perf_counter() - started
+        losses, tokens = self.token_losses(outputs.logits, labels)
+        past = crop_cache(to_legacy_cache(outputs.past_key_values), width - 1)
+        del outputs
+        
+        started = time.perf_counter()
+        with self.memory.phase("decode"), torch.no_grad():
+            generated = self.model.generate(
+                input_ids[:, :width],
+                attention_mask=attention_mask[:, :width],
+                past_key_values=from_legacy_cache(past),
+                max_new_tokens=max_length,
+                pad_token_id=self.tokenizer.eos_token_id,
+                eos_token_id=self.tokenizer.eos_token_id,
+                **self.generation_kwargs
+            )
+        decode_time = time.perf_counter() - started
         
-        avg_similarity = np.mean(similarities)
-        print(f"📊 Semantic Similarity: {avg_similarity:.3f}")
+        new_tokens = generated[:, width:]
+        # Count tokens up to and including each row's first eos; the rest is padding
+        is_eos = (new_tokens == self.tokenizer.eos_token_id).long()
+        generated_tokens = int(((is_eos.cumsum(-1) - is_eos) == 0).sum())
         
-        return avg_similarity
+        predictions = [self.tokenizer.decode(row, skip_special_tokens=True).strip() for row in new_tokens]
+        return predictions, {
+            "losses": losses, "tokens": tokens, "prefill_time": prefill_time,
+            "decode_time": decode_time, "generated_tokens": generated_tokens
+        }
     
-    def calculate_exact_match(self, predictions: List[str], references: List[str]) -> float:
-        """Calculate exact match accuracy"""
-        print("🎯 Calculating exact match...")
-        
-        exact_matches = 0
-        for pred, ref in zip(predictions, references):
-            if pred.strip().lower() == ref.strip().lower():
-                exact_matches += 1
-        
-        exact_match_ratio = exact_matches / len(predictions)
-        print(f"📊 Exact Match: {exact_match_ratio:.3f}")
-        
-        return exact_match_ratio
+    def evaluate(self, test_data: List[Dict[str, str]], max_length: int = 512) -> List[str]:
+        """Predictions, perplexity and performance from a single sweep over the test set.
+        
+        Can be called once per chunk of a streamed test set: loss and timing
+        totals accumulate across calls and the results cover every chunk so far.
+        Each entry added to self.predictions carries its own summed loss and
+        token count, so perplexity can be rebuilt from saved predictions.
+        """
+        prompts = [self.encode_prompt(example['input']) for example in test_data]
+        sequences = [self.encode_example(example) for example in test_data]
+        # Encoding the reference on its own would differ on sentencepiece tokenizers (a leading
+        # "▁"), so it is cut from the joint encoding at the prompt's token count instead
+        references = [
+            sequence[len(prompt):] if sequence[:len(prompt)] == prompt else None
+            for prompt, sequence in zip(prompts, sequences)
+        ]
+        max_context, _ = self.perplexity_window()
+        
+        # Examples longer than the perplexity window, or whose prompt merges into the reference
+        # so its KV state cannot be reused for generation, are scored separately
+        fits = [i for i in range(len(prompts)) if references[i] is not None and len(sequences[i]) <= max_context]
+        long = sorted(set(range(len(prompts))) - set(fits))
+        fits.sort(key=lambda i: len(prompts[i]))
+        
+        predictions: List[Optional[str]] = [None] * len(prompts)
+        losses = [0.0] * len(prompts)
+        tokens = [0] * len(prompts)
+        totals = self.eval_totals
+        with tqdm(total=len(prompts), desc=f"Evaluating (batch size {self.batch_size})") as progress:
+            for start in range(0, len(fits), self.batch_size):
+                bucket = fits[start:start + self.batch_size]
+                batch_predictions, stats = self.score_and_generate(
+                    [prompts[i] for i in bucket], [references[i] for i in bucket], max_length
+                )
+                for i, prediction, loss, count in zip(bucket, batch_predictions, stats["losses"], stats["tokens"]):
+                    predictions[i] = prediction
+                    losses[i] = loss
+                    tokens[i] = count
+                for key in ("prefill_time", "decode_time", "generated_tokens"):
+                    totals[key] += stats[key]
+                totals["batches"] += 1
+                progress.update(len(bucket))
+            
+            for start in range(0, len(long), self.batch_size):
+                bucket = long[start:start + self.batch_size]
+                started = time.perf_counter()
+                with self.memory.phase("decode"):
+                    batch_predictions = self.generate_batch([prompts[i] for i in bucket], max_length)
+                for i, prediction in zip(bucket, batch_predictions):
+                    predictions[i] = prediction
+                totals["decode_time"] += time.perf_counter() - started
+                totals["batches"] += 1
+                progress.update(len(bucket))
+        
+        if long:
+            owners, segments = [], []
+            for i in long:
+                for segment in self.perplexity_segments(sequences[i]):
+                    owners.append(i)
+                    segments.append(segment)
+            with self.memory.phase("prefill"):
+                segment_losses = self.segment_loss(segments)
+            for i, loss, count in zip(owners, *segment_losses):
+                losses[i] += loss
+                tokens[i] += count
+        totals["loss"] += sum(losses)
+        totals["tokens"] += sum(tokens)
+        totals["samples"] += len(prompts)
+        
+        self.results['perplexity'] = perplexity(totals["loss"], totals["tokens"])
+        print(f"📊 Perplexity: {self.results['perplexity']:.2f}")
+        self.results.update(self.summarize_performance(totals))
+        
+        for example, prediction, loss, count in zip(test_data, predictions, losses, tokens):
+            self.predictions.append({
+                'input': example['input'],
+                'reference': example['output'],
+                'prediction': prediction,
+                'loss': loss,
+                'tokens': count
+            })
+        return predictions
     
-    def measure_performance(self, test_data: List[Dict[str, str]]) -> Dict[str, float]:
-        """Measure inference performance"""
-        print("⚡ Measuring performance...")
-        
-        # Warm up
-        for _ in range(3):
-            self.generate_prediction("Test input")
-        
-        # Measure inference time
-        start_time = time.time()
-        sample_size = min(50, len(test_data))
-        
-        for i in range(sample_size):
-            self.generate_prediction(test_data[i]['input'])
-        
-        end_time = time.time()
-        
-        avg_inference_time = (end_time - start_time) / sample_size * 1000  # milliseconds
-        throughput = 1000 / avg_inference_time  # samples per second
+    def run_config(self) -> Dict[str, Any]:
+        """Settings that must match for saved predictions to be reused"""
+        return {
+            'model_path': str(self.model_path),
+            'test_data_path': str(self.test_data_path),
+            'generation_kwargs': self.generation_kwargs,
+            'max_context': self.max_context,
+            'stride': self.stride
+        }
+    
+    def evaluate_stream(self, max_length: int = 512) -> Tuple[List[str], List[str]]:
+        """Evaluate the streamed test set chunk by chunk, checkpointing each chunk.
+        
+        Only one chunk's prompts are held at a time. Predictions, losses and
+        per-sample scores are appended to predictions.jsonl as each chunk
+        finishes; with resume, examples already in that file are not run again.
+        Returns (predictions, references) in test set order.
+        """
+        store = PredictionStore(self.output_dir / 'predictions.jsonl', self.run_config(), resume=self.resume)
+        if store.resumed:
+            print(f"♻️  Resuming: {store.resumed} examples already scored")
+        print(f"🤖 Generating predictions and scoring references ({self.chunk_size} examples per chunk)...")
+        
+        records = []
+        try:
+            for chunk in iter_chunks(self.iter_test_data(), self.chunk_size):
+                keys = [example_key(example) for example in chunk]
+                pending = [(key, example) for key, example in zip(keys, chunk) if key not in store]
+                if pending:
+                    predictions = self.evaluate([example for _, example in pending], max_length)
+                    entries = self.predictions[-len(pending):]
+                    references = [example['output'] for _, example in pending]
+                    # Scored before checkpointing, so a resumed run reuses exactly these values
+                    with self.memory.phase("metrics"):
+                        _, per_sample = score_corpus(predictions, references)
+                        per_sample['semantic_similarity'] = self.semantic_scores(predictions, references)
+                    for i, ((key, _), entry) in enumerate(zip(pending, entries)):
+                        entry['id'] = key
+                        entry['scores'] = {name: float(values[i]) for name, values in per_sample.items()}
+                    store.append(entries)
+                records.extend(store[key] for key in keys)
+        finally:
+            store.close()
+        
+        self.predictions = records
+        self.results['resumed_examples'] = len(records) - self.eval_totals['samples']
+        self.results['perplexity'] = perplexity(
+            sum(record['loss'] for record in records), sum(record['tokens'] for record in records)
+        )
+        self.results.update(self.summarize_performance(self.eval_totals))
+        print(f"📋 Evaluated {len(records)} test examples ({self.eval_totals['samples']} in this run)")
+        return [record['prediction'] for record in records], [record['reference'] for record in records]
+    
+    def summarize_performance(self, totals: Dict[str, float]) -> Dict[str, float]:
+        """Performance figures from the timings of the evaluation sweep"""
+        num_samples, num_batches = totals["samples"], totals["batches"]
+        # Prefill here also covers the reference tokens, so latency is a slight overestimate
+        elapsed = totals["prefill_time"] + totals["decode_time"]
+        avg_inference_time = elapsed / num_samples * 1000 if num_samples else 0.0
         
-        # Estimate memory usage
-        if torch.cuda.is_available():
-            memory_used = torch.cuda.max_memory_allocated() / 1024 / 1024  # MB
-        else:
-            memory_used = 0  # CPU memory measurement is more complex
+        memory_used = self.memory_usage_mb()
         
         performance = {
             'avg_inference_time_ms': avg_inference_time,
-            'throughput_samples_per_sec': throughput,
+            'avg_batch_latency_ms': elapsed / num_batches * 1000 if num_batches else 0.0,
+            'throughput_samples_per_sec': num_samples / elapsed if elapsed else 0.0,
+            'generated_tokens_per_sec': totals["generated_tokens"] / totals["decode_time"] if totals["decode_time"] else 0.0,
             'memory_usage_mb': memory_used
         }
         
-        print(f"📊 Avg Inference Time: {avg_inference_time:.2f} ms")
-        print(f"📊 Throughput: {throughput:.2f} samples/sec")
+        print(f"📊 Avg Inference Time: {avg_inference_time:.2f} ms (batch size {self.batch_size})")
+        print(f"📊 Throughput: {performance['throughput_samples_per_sec']:.2f} samples/sec")
         print(f"📊 Memory Usage: {memory_used:.2f} MB")
-        
         return performance
     
-    def generate_predictions(self, test_data: List[Dict[str, str]]) -> List[str]:
-        """Generate predictions for all test examples"""
-        print("🤖 Generating predictions...")
-        
-        predictions = []
-        for example in tqdm(test_data, desc="Generating"):
-            prediction = self.generate_prediction(example['input'])
-            predictions.append(prediction)
-            
-            # Store for detailed analysis
-            self.predictions.append({
-                'input': example['input'],
-                'reference': example['output'],
-                'prediction': prediction
-            })
-        
-        return predictions
+    def memory_usage_mb(self) -> float:
+        """Peak GPU allocation on CUDA, otherwise peak resident memory of the process"""
+        if torch.cuda.is_available():
+            return torch.cuda.max_memory_allocated() / MB
+        return max(self.memory.peak_rss, self.memory.rss()) / MB
     
     def create_visualizations(self):
         """Create visualization plots"""
@@ -328,7 +630,7 @@ class ModelBenchmark:
         # 1. Metrics overview
         metrics = ['Perplexity', 'BLEU-4', 'ROUGE-L', 'Semantic Sim']
         values = [
-            self.results.get('perplexity', 0),
+            self.results['perplexity'] if math.isfinite(self.results.get('perplexity', 0)) else 0,
             self.results.get('bleu_4', 0),
             self.results.get('rouge_l', 0) * 100,  # Scale to 0-100
             self.results.get('semantic_similarity', 0) * 100  # Scale to 0-100
@@ -412,6 +714,7 @@ This report presents a comprehensive evaluation of the fine-tuned model across m
 - **BLEU-1:** {self.results.get('bleu_1', 'N/A'):.2f}
 - **BLEU-2:** {self.results.get('bleu_2', 'N/A'):.2f}
 - **BLEU-4:** {self.results.get('bleu_4', 'N/A'):.2f}
+- **Corpus BLEU-4:** {self.results.get('corpus_bleu_4', float('nan')):.2f}
 
 ### Semantic Quality
 - **ROUGE-1:** {self.results.get('rouge_1', 'N/A'):.3f}
@@ -426,7 +729,7 @@ This report presents a comprehensive evaluation of the fine-tuned model across m
 - **Average Inference Time:** {self.results.get('avg_inference_time_ms', 'N/A'):.2f} ms
 - **Throughput:** {self.results.get('throughput_samples_per_sec', 'N/A'):.2f} samples/sec
 - **Memory Usage:** {self.results.get('memory_usage_mb', 'N/A'):.2f} MB
-
+{self.memory_report()}
 ## Interpretation
 
 ### Perplexity
@@ -479,6 +782,7 @@ This report presents a comprehensive evaluation of the fine-tuned model across m
         report += "\n## Files Generated\n"
         report += f"- Detailed results: `{self.output_dir / 'detailed_results.json'}`\n"
         report += f"- Predictions: `{self.output_dir / 'predictions.json'}`\n"
+        report += f"- Prediction checkpoint (for --resume): `{self.output_dir / 'predictions.jsonl'}`\n"
         report += f"- Visualizations: `{self.output_dir / 'evaluation_results.png'}`\n"
         
         # Save report
@@ -487,36 +791,59 @@ This report presents a comprehensive evaluation of the fine-tuned model across m
         
         print(f"📄 Report saved to: {self.output_dir / 'evaluation_report.md'}")
     
+    def memory_report(self) -> str:
+        """Markdown table of per-phase memory use, empty if it was not profiled"""
+        memory = self.results.get('memory')
+        if not memory or not memory['phases']:
+            return ""
+        
+        lines = [
+            "",
+            "### Memory by Phase",
+            f"Baseline RSS {memory['baseline_rss_mb']:.0f} MB, peak {memory['peak_rss_mb']:.0f} MB."
+            + (" Timings were taken with tracemalloc on." if memory.get('python_heap_traced') else ""),
+            "",
+            "| Phase | Calls | RSS delta (MB) | Peak RSS (MB) | Peak RSS increase (MB) | Python heap delta (MB) | Python heap peak (MB) |",
+            "|-------|-------|----------------|---------------|------------------------|------------------------|-----------------------|"
+        ]
+        for name, stats in memory['phases'].items():
+            heap_delta = stats.get('python_heap_delta_mb')
+            heap_peak = stats.get('python_heap_peak_mb')
+            lines.append(
+                f"| {name} | {stats['calls']} | {stats['rss_delta_mb']:.1f} | {stats['peak_rss_mb']:.1f} "
+                f"| {stats['peak_rss_increase_mb']:.1f} "
+                f"| {'N/A' if heap_delta is None else f'{heap_delta:.1f}'} "
+                f"| {'N/A' if heap_peak is None else f'{heap_peak:.1f}'} |"
+            )
+        return "\n".join(lines) + "\n"
+    
     def run_benchmark(self):
         """Run complete benchmark suite"""
         print("🚀 Starting comprehensive benchmark...")
         start_time = time.time()
         
-        # Load model and data
-        self.load_model()
-        test_data = self.load_test_data()
-        
-        # Generate predictions
-        predictions = self.generate_predictions(test_data)
-        references = [item['output'] for item in test_data]
-        
-        # Calculate all metrics
-        self.results['perplexity'] = self.calculate_perplexity(test_data)
-        bleu_scores = self.calculate_bleu_scores(predictions, references)
-        rouge_scores = self.calculate_rouge_scores(predictions, references)
-        self.results['semantic_similarity'] = self.calculate_semantic_similarity(predictions, references)
-        self.results['exact_match'] = self.calculate_exact_match(predictions, references)
-        performance = self.measure_performance(test_data)
-        
-        # Combine all results
-        self.results.update(bleu_scores)
-        self.results.update(rouge_scores)
-        self.results.update(performance)
+        self.memory.start()
+        try:
+            # Load model
+            with self.memory.phase("load"):
+                self.load_model()
+            
+            # One sweep yields predictions, perplexity and performance
+            predictions, references = self.evaluate_stream()
+            
+            # Calculate all metrics
+            with self.memory.phase("metrics"):
+                self.results.update(self.calculate_text_metrics(predictions, references))
+                self.results['semantic_similarity'] = self.calculate_semantic_similarity(predictions, references)
+        finally:
+            self.memory.stop()
+        self.results['memory'] = self.memory.summary()
+        self.results['memory_usage_mb'] = self.memory_usage_mb()
         
         # Add metadata
         self.results['model_path'] = str(self.model_path)
         self.results['test_data_path'] = str(self.test_data_path)
-        self.results['num_test_examples'] = len(test_data)
+        self.results['num_test_examples'] = len(predictions)
         self.results['evaluation_time'] = time.time() - start_time
         self.results['timestamp'] = datetime.now().isoformat()
         
@@ -543,14 +870,46 @@ def main():
     """Main benchmarking function"""
     parser = argparse.ArgumentParser(description="QLORAX Model Benchmarking")
     parser.add_argument("--model", required=True, help="Path to fine-tuned model")
-    parser.add_argument("--test-data", required=True, help="Path to test dataset")
+    parser.add_argument("--test-data", required=True, help="Path to test dataset (.json or .jsonl, optionally .gz or .zst)")
     parser.add_argument("--output", required=True, help="Output directory for results")
     parser.add_argument("--quick", action="store_true", help="Run quick evaluation (subset of metrics)")
+    parser.add_argument("--limit", type=int, default=None, help="Stop reading after this many test examples")
+    parser.add_argument("--sample", type=int, default=None,
+                        help="Evaluate a uniform random sample of this many test examples (seed 42)")
+    parser.add_argument("--chunk-size", type=int, default=1024,
+                        help="Test examples read and evaluated at a time, bounding memory on large test sets")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip examples already saved in <output>/predictions.jsonl by an interrupted run")
+    parser.add_argument("--batch-size", type=int, default=8,
+                        help="Examples scored and generated per batch")
+    parser.add_argument("--max-context", type=int, default=None,
+                        help="Perplexity window in tokens (default: model context, at most 1024)")
+    parser.add_argument("--stride", type=int, default=None,
+                        help="Sliding-window stride for examples longer than the window (default: half the window)")
+    parser.add_argument("--metric-workers", type=int, default=None,
+                        help="Processes for the library metrics backend (default: one per CPU, 1 = serial)")
+    parser.add_argument("--metrics-backend", choices=["numpy", "library"], default="numpy",
+                        help="Vectorized NumPy BLEU/ROUGE, or the nltk/rouge_score reference implementation")
+    parser.add_argument("--embedding-cache", default="cache/embeddings",
+                        help="Directory caching sentence embeddings across runs")
+    parser.add_argument("--no-embedding-cache", action="store_true", help="Always re-encode every text")
+    parser.add_argument("--embedding-batch-size", type=int, default=128,
+                        help="Texts per sentence-transformer batch")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="Also track Python-heap use per phase (slows generation, so timings are not comparable)")
     
     args = parser.parse_args()
     
     # Initialize and run benchmark
-    benchmark = ModelBenchmark(args.model, args.test_data, args.output)
+    benchmark = ModelBenchmark(
+        args.model, args.test_data, args.output,
+        batch_size=args.batch_size, max_context=args.max_context, stride=args.stride,
+        metric_workers=args.metric_workers, metrics_backend=args.metrics_backend,
+        embedding_cache_dir=None if args.no_embedding_cache else args.embedding_cache,
+        embedding_batch_size=args.embedding_batch_size,
+        limit=args.limit, sample=args.sample, chunk_size=args.chunk_size, resume=args.resume,
+        trace_python_memory=args.tracemalloc
+    )
     results = benchmark.run_benchmark()
     
     # Print summary
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+QLORAX Serving Benchmark
+Compares one-at-a-time model.generate against the continuous batching engine
+"""
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.engine import ContinuousBatchingEngine
+from scripts.make_tiny_model import build_tiny_model
+
+DEMO_QUERIES = [
+    "What is machine learning?",
+    "How do neural networks work?",
+    "Explain gradient descent in simple terms",
+    "What is the difference between supervised and unsupervised learning?",
+    "How does backpropagation work?",
+    "What are the advantages of deep learning?",
+    "Explain overfitting and how to prevent it",
+    "What is cross-validation?",
+    "How do you evaluate a machine learning model?",
+    "What is the bias-variance tradeoff?"
+]
+
+
+def load(model_path: str = None):
+    """Load a model by path, or build the tiny offline model"""
+    if model_path is None:
+        return build_tiny_model()
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32)
+    model.eval()
+    return model, tokenizer
+
+
+def run_sequential(model, tokenizer, prompts, max_new_tokens: int) -> float:
+    """Serve every request with its own model.generate call, like ModelManager.generate_response"""
+    start = time.time()
+    for ids in prompts:
+        inputs = torch.tensor([ids])
+        with torch.no_grad():
+            model.generate(
+                inputs,
+                attention_mask=torch.ones_like(inputs),
+                max_new_tokens=max_new_tokens,
+                min_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.eos_token_id
+            )
+    return time.time() - start
+
+
+def run_batched(model, tokenizer, prompts, max_new_tokens: int, concurrency: int,
+                max_batch_size: int, max_queue_wait: float) -> float:
+    """Serve the same requests from concurrent clients through the batching engine"""
+    engine = ContinuousBatchingEngine(model, tokenizer, max_batch_size, max_queue_wait)
+    engine.start()
+    try:
+        def client(ids):
+            return engine.generate(ids, max_new_tokens=max_new_tokens, temperature=0, ignore_eos=True)
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(client, prompts))
+        return time.time() - start
+    finally:
+        engine.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QLORAX serving throughput benchmark")
+    parser.add_argument("--model", default=None, help="Model path (default: tiny offline GPT-2)")
+    parser.add_argument("--requests", type=int, default=32, help="Number of requests to serve")
+    parser.add_argument("--max-new-tokens", type=int, default=32, help="Tokens generated per request")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients for the batched run")
+    parser.add_argument("--max-batch-size", type=int, default=8, help="Engine max batch size")
+    parser.add_argument("--max-queue-wait-ms", type=float, default=10, help="Engine max queue wait")
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+
+    args = parser.parse_args()
+
+    model, tokenizer = load(args.model)
+    prompts = [tokenizer.encode(DEMO_QUERIES[i % len(DEMO_QUERIES)]) for i in range(args.requests)]
+    total_tokens = args.requests * args.max_new_tokens
+
+    print(f"⚡ Serving {args.requests} requests x {args.max_new_tokens} tokens")
+
+    sequential_time = run_sequential(model, tokenizer, prompts, args.max_new_tokens)
+    batched_time = run_batched(
+        model, tokenizer, prompts, args.max_new_tokens, args.concurrency,
+        args.max_batch_size, args.max_queue_wait_ms / 1000
+    )
+
+    results = {
+        "requests": args.requests,
+        "max_new_tokens": args.max_new_tokens,
+        "sequential_seconds": sequential_time,
+        "sequential_tokens_per_sec": total_tokens / sequential_time,
+        "batched_seconds": batched_time,
+        "batched_tokens_per_sec": total_tokens / batched_time,
+        "speedup": sequential_time / batched_time
+    }
+
+    print(f"📊 Sequential: {sequential_time:.2f}s ({results['sequential_tokens_per_sec']:.1f} tokens/s)")
+    print(f"📊 Batched:    {batched_time:.2f}s ({results['batched_tokens_per_sec']:.1f} tokens/s)")
+    print(f"🚀 Speedup:    {results['speedup']:.2f}x")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+QLORAX Data Streaming
+Constant-memory readers for JSON/JSONL datasets, optionally gzip or zstd compressed
+"""
+
+import io
+import re
+import json
+import gzip
+import random
+import itertools
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+COMPRESSION_SUFFIXES = {'.gz', '.zst'}
+
+# Characters read per step when parsing a JSON array incrementally
+READ_SIZE = 1 << 16
+
+_WHITESPACE = re.compile(r'\s*')
+_SEPARATORS = re.compile(r'[\s,]*')
+
+
+def data_format(path: str) -> str:
+    """'.json' or '.jsonl', looking past a compression suffix"""
+    suffixes = Path(path).suffixes
+    if suffixes and suffixes[-1] in COMPRESSION_SUFFIXES:
+        suffixes = suffixes[:-1]
+    fmt = suffixes[-1] if suffixes else ''
+    if fmt not in ('.json', '.jsonl'):
+        raise ValueError(f"Unsupported data format: {path}")
+    return fmt
+
+
+def open_text(path: str) -> TextIO:
+    """Open a possibly compressed file for streaming text reads"""
+    suffix = Path(path).suffix
+    if suffix == '.gz':
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if suffix == '.zst':
+        if not ZSTD_AVAILABLE:
+            raise ImportError("Reading .zst files requires zstandard: pip install zstandard")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return io.TextIOWrapper(reader, encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def iter_jsonl(f: TextIO) -> Iterator[Any]:
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_json_array(f: TextIO) -> Iterator[Any]:
+    """Yield the elements of a top-level JSON array without loading the whole file"""
+    decoder = json.JSONDecoder()
+    buffer, pos = '', 0
+    eof = False
+    started = False
+    read_size = READ_SIZE
+
+    while True:
+        pos = (_SEPARATORS if started else _WHITESPACE).match(buffer, pos).end()
+        if pos < len(buffer):
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError("Expected a JSON array of examples")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+                # Only trust a value that is followed by something, or a number could be cut short
+                if end < len(buffer) or eof:
+                    pos = end
+                    read_size = READ_SIZE
+                    yield element
+                    continue
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+        elif eof:
+            raise ValueError("Unexpected end of JSON array")
+
+        # Drop what has been consumed and read on; doubling keeps huge elements linear
+        chunk = f.read(read_size)
+        eof = not chunk
+        buffer, pos = buffer[pos:] + chunk, 0
+        read_size *= 2
+
+
+def iter_records(path: str, limit: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Stream examples from a .json/.jsonl file (optionally .gz/.zst), stopping after limit"""
+    fmt = data_format(path)
+    with open_text(str(path)) as f:
+        records = iter_jsonl(f) if fmt == '.jsonl' else iter_json_array(f)
+        # islice stops before parsing the record after the limit
+        yield from itertools.islice(records, limit)
+
+
+def sample_records(records: Iterable[Dict[str, Any]], size: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """Uniform random sample of size records in one pass, holding only the sample in memory"""
+    rng = random.Random(seed)
+    sample: List[Dict[str, Any]] = []
+    for seen, record in enumerate(records):
+        if seen < size:
+            sample.append(record)
+        else:
+            # Reservoir sampling: keep each record with probability size / (seen + 1)
+            slot = rng.randint(0, seen)
+            if slot < size:
+                sample[slot] = record
+    return sample
+
+
+def load_records(path: str, limit: Optional[int] = None, sample: Optional[int] = None,
+                 seed: int = 42) -> Iterator[Dict[str, Any]]:
+    """Examples from path, stopping after limit; with sample, a uniform random sample of that size"""
+    records = iter_records(path, limit)
+    if sample is not None:
+        return iter(sample_records(records, sample, seed))
+    return records
+
+
+def iter_chunks(records: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
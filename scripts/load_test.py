@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+QLORAX Load Test
+Drives the running API (/chat or /chat/stream) with concurrent clients or open-loop arrivals
+and reports latency percentiles, time to first token, inter-token latency, throughput,
+errors and server memory over time. With --spawn it serves the tiny offline model itself.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import httpx
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from scripts.benchmark_serving import DEMO_QUERIES
+
+RSS_METRIC = re.compile(r'^qlorax_model_rss_bytes\s+(\S+)', re.MULTILINE)
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """Mean and p50/p90/p99 in milliseconds"""
+    if not values:
+        return {"mean_ms": None, "p50_ms": None, "p90_ms": None, "p99_ms": None}
+    ms = np.asarray(values) * 1000
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return {"mean_ms": float(ms.mean()), "p50_ms": float(p50), "p90_ms": float(p90), "p99_ms": float(p99)}
+
+
+class RequestResult:
+    """Timings of one request, relative to when it was sent"""
+
+    def __init__(self, sent_at: float):
+        self.sent_at = sent_at
+        self.latency: Optional[float] = None
+        self.first_token: Optional[float] = None
+        self.token_times: List[float] = []
+        self.tokens = 0
+        self.status: Optional[int] = None
+        self.error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and self.error is None
+
+
+async def send_chat(client: httpx.AsyncClient, payload: dict,
+                    count_tokens: Optional[Callable[[str], int]]) -> RequestResult:
+    result = RequestResult(time.perf_counter())
+    try:
+        response = await client.post("/chat", json=payload)
+        result.latency = time.perf_counter() - result.sent_at
+        result.status = response.status_code
+        if response.status_code == 200:
+            text = response.json()["response"]
+            result.tokens = count_tokens(text) if count_tokens else 0
+        else:
+            result.error = response.text[:200]
+    except httpx.HTTPError as e:
+        result.error = f"{type(e).__name__}: {e}"
+    return result
+
+
+async def send_stream(client: httpx.AsyncClient, payload: dict,
+                      count_tokens: Optional[Callable[[str], int]]) -> RequestResult:
+    """POST /chat/stream and time every SSE token event (one event per decoded token delta)"""
+    result = RequestResult(time.perf_counter())
+    try:
+        async with client.stream("POST", "/chat/stream", json=payload) as response:
+            result.status = response.status_code
+            if response.status_code != 200:
+                result.error = (await response.aread()).decode()[:200]
+            else:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    event = json.loads(line[len("data: "):])
+                    now = time.perf_counter() - result.sent_at
+                    if "token" in event:
+                        if result.first_token is None:
+                            result.first_token = now
+                        result.token_times.append(now)
+                        result.tokens += 1
+                    elif "error" in event:
+                        result.error = str(event["error"])
+        result.latency = time.perf_counter() - result.sent_at
+    except httpx.HTTPError as e:
+        result.error = f"{type(e).__name__}: {e}"
+    return result
+
+
+async def sample_rss(client: httpx.AsyncClient, interval: float, samples: List[Dict[str, float]],
+                     started: float, stop: asyncio.Event):
+    """Poll the server's Prometheus endpoint for its resident memory until stopped"""
+    while not stop.is_set():
+        try:
+            response = await client.get("/metrics")
+            match = RSS_METRIC.search(response.text)
+            if match:
+                samples.append({"t": time.perf_counter() - started, "rss_mb": float(match.group(1)) / 1024 / 1024})
+        except httpx.HTTPError:
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_load(base_url: str, requests: int, concurrency: Optional[int] = None, rate: Optional[float] = None,
+                   stream: bool = True, max_length: int = 32, temperature: float = 0.0,
+                   count_tokens: Optional[Callable[[str], int]] = None, rss_interval: float = 1.0,
+                   timeout: float = 120.0, seed: int = 0) -> Dict[str, Any]:
+    """Send requests closed-loop (concurrency clients back to back) or open-loop (Poisson
+    arrivals at rate per second, sent whether or not earlier requests have finished)"""
+    send = send_stream if stream else send_chat
+    payloads = [
+        {"message": DEMO_QUERIES[i % len(DEMO_QUERIES)], "max_length": max_length, "temperature": temperature}
+        for i in range(requests)
+    ]
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    results: List[RequestResult] = []
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        rss_samples: List[Dict[str, float]] = []
+        stop = asyncio.Event()
+        started = time.perf_counter()
+        sampler = asyncio.create_task(sample_rss(client, rss_interval, rss_samples, started, stop))
+
+        if rate:
+            rng = random.Random(seed)
+            tasks = []
+            next_arrival = started
+            for payload in payloads:
+                await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+                tasks.append(asyncio.create_task(send(client, payload, count_tokens)))
+                next_arrival += rng.expovariate(rate)
+            results = list(await asyncio.gather(*tasks))
+        else:
+            queue = iter(payloads)
+
+            async def worker():
+                for payload in queue:
+                    results.append(await send(client, payload, count_tokens))
+
+            await asyncio.gather(*(worker() for _ in range(concurrency or 1)))
+
+        duration = time.perf_counter() - started
+        stop.set()
+        await sampler
+
+    return summarize(results, duration, rss_samples, {
+        "mode": "open-loop" if rate else "closed-loop",
+        "endpoint": "/chat/stream" if stream else "/chat",
+        "concurrency": None if rate else (concurrency or 1),
+        "arrival_rate": rate,
+        "max_length": max_length
+    })
+
+
+def summarize(results: List[RequestResult], duration: float, rss_samples: List[Dict[str, float]],
+              settings: Dict[str, Any]) -> Dict[str, Any]:
+    ok = [r for r in results if r.ok]
+    inter_token = [b - a for r in ok for a, b in zip(r.token_times, r.token_times[1:])]
+    statuses: Dict[str, int] = {}
+    for r in results:
+        key = str(r.status) if r.status is not None else "connection_error"
+        statuses[key] = statuses.get(key, 0) + 1
+    tokens = sum(r.tokens for r in ok)
+
+    return {
+        **settings,
+        "requests": len(results),
+        "succeeded": len(ok),
+        "error_rate": 1 - len(ok) / len(results) if results else 0.0,
+        "status_codes": statuses,
+        "errors": [r.error for r in results if r.error][:10],
+        "duration_s": duration,
+        "requests_per_sec": len(ok) / duration if duration else 0.0,
+        "tokens_per_sec": tokens / duration if duration else 0.0,
+        "generated_tokens": tokens,
+        "latency": percentiles([r.latency for r in ok]),
+        "time_to_first_token": percentiles([r.first_token for r in ok if r.first_token is not None]),
+        "inter_token_latency": percentiles(inter_token),
+        "server_rss_mb": {
+            "start": rss_samples[0]["rss_mb"] if rss_samples else None,
+            "peak": max(s["rss_mb"] for s in rss_samples) if rss_samples else None,
+            "end": rss_samples[-1]["rss_mb"] if rss_samples else None,
+            "samples": rss_samples
+        }
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn_server(model_path: str, port: int, env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    """Start uvicorn serving app.api with model_path loaded at startup"""
+    server_env = {
+        **os.environ,
+        "QLORAX_MODEL_PATH": model_path,
+        "QLORAX_EAGER_LOAD": "true",
+        "QLORAX_WARMUP_LENGTHS": "16",
+        **(env or {})
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.api:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=str(project_root), env=server_env
+    )
+
+
+def wait_until_ready(base_url: str, server: Optional[subprocess.Popen] = None, timeout: float = 120.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            if httpx.get(f"{base_url}/readyz", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"{base_url} not ready after {timeout:.0f}s")
+
+
+def print_summary(results: Dict[str, Any]):
+    def fmt(stats):
+        if stats["p50_ms"] is None:
+            return "n/a"
+        return f"p50 {stats['p50_ms']:.1f} / p90 {stats['p90_ms']:.1f} / p99 {stats['p99_ms']:.1f} ms"
+
+    print(f"\n📊 {results['endpoint']} {results['mode']}: {results['succeeded']}/{results['requests']} ok "
+          f"in {results['duration_s']:.2f}s")
+    print(f"⏱️  Latency:            {fmt(results['latency'])}")
+    print(f"⚡ Time to first token: {fmt(results['time_to_first_token'])}")
+    print(f"🔁 Inter-token latency: {fmt(results['inter_token_latency'])}")
+    print(f"🚀 Throughput:          {results['requests_per_sec']:.2f} req/s, {results['tokens_per_sec']:.1f} tokens/s")
+    print(f"❌ Error rate:          {results['error_rate']:.1%} {results['status_codes']}")
+    rss = results["server_rss_mb"]
+    if rss["peak"] is not None:
+        print(f"💾 Server RSS:          {rss['start']:.0f} MB -> peak {rss['peak']:.0f} MB -> {rss['end']:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QLORAX API load test")
+    parser.add_argument("--url", default=None, help="Base URL of a running API (default: spawn one)")
+    parser.add_argument("--model", default=None, help="Model to serve with a spawned API (default: tiny offline GPT-2)")
+    parser.add_argument("--endpoint", choices=["stream", "chat"], default="stream",
+                        help="/chat/stream (TTFT and inter-token latency) or /chat")
+    parser.add_argument("--requests", type=int, default=64, help="Requests to send")
+    parser.add_argument("--concurrency", type=int, default=8, help="Closed loop: clients sending back to back")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="Open loop: Poisson arrival rate in requests/sec (overrides --concurrency)")
+    parser.add_argument("--max-length", type=int, default=32, help="max_length of each request")
+    parser.add_argument("--temperature", type=float, default=0.0, help="Sampling temperature of each request")
+    parser.add_argument("--tokenizer", default=None, help="Tokenizer for counting /chat reply tokens")
+    parser.add_argument("--rss-interval", type=float, default=1.0, help="Seconds between server memory samples")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for open-loop arrivals")
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    model_dir = None
+    tokenizer_path = args.tokenizer
+    try:
+        if base_url is None:
+            model_path = args.model
+            if model_path is None:
+                from scripts.make_tiny_model import save_tiny_model
+                model_dir = tempfile.TemporaryDirectory()
+                model_path = str(save_tiny_model(Path(model_dir.name) / "tiny-gpt2"))
+            tokenizer_path = tokenizer_path or model_path
+            port = free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            print(f"🚀 Starting API with {model_path} on {base_url}...")
+            server = spawn_server(model_path, port)
+            wait_until_ready(base_url, server)
+
+        count_tokens = None
+        if tokenizer_path:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
+            count_tokens = lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+        print(f"⚡ Sending {args.requests} requests to {base_url} "
+              f"({f'{args.rate} req/s open loop' if args.rate else f'{args.concurrency} concurrent clients'})")
+        results = asyncio.run(run_load(
+            base_url, args.requests, concurrency=args.concurrency, rate=args.rate,
+            stream=args.endpoint == "stream", max_length=args.max_length, temperature=args.temperature,
+            count_tokens=count_tokens, rss_interval=args.rss_interval, seed=args.seed
+        ))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(30)
+        if model_dir is not None:
+            model_dir.cleanup()
+
+    print_summary(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"📁 Results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Build a tiny randomly-initialised GPT-2 for offline benchmarks and CI.
+Reuses the GPT-2 tokenizer files checked into test_output/, so nothing is downloaded.
+"""
+
+import argparse
+from pathlib import Path
+
+import torch
+from transformers import AutoTokenizer, GPT2Config, GPT2LMHeadModel
+
+PROJECT_ROOT = Path(__file__).parent.parent
+DEFAULT_TOKENIZER_PATH = PROJECT_ROOT / "test_output"
+
+
+def build_tiny_model(tokenizer_path=DEFAULT_TOKENIZER_PATH, n_layer: int = 2,
+                     n_embd: int = 64, n_head: int = 4, n_positions: int = 1024, seed: int = 0):
+    """Return (model, tokenizer) for a tiny GPT-2 with random weights"""
+    tokenizer = AutoTokenizer.from_pretrained(str(tokenizer_path))
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    torch.manual_seed(seed)
+    config = GPT2Config(
+        vocab_size=len(tokenizer),
+        n_positions=n_positions,
+        n_embd=n_embd,
+        n_layer=n_layer,
+        n_head=n_head,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+    )
+    model = GPT2LMHeadModel(config)
+    model.eval()
+    return model, tokenizer
+
+
+def save_tiny_model(output_dir: str, **kwargs) -> Path:
+    """Write a tiny model and its tokenizer to output_dir so it can be loaded by path"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    model, tokenizer = build_tiny_model(**kwargs)
+    model.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    return output_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create a tiny GPT-2 for offline testing")
+    parser.add_argument("--output-dir", default="models/tiny-gpt2", help="Where to save the model")
+    parser.add_argument("--layers", type=int, default=2, help="Number of transformer layers")
+    parser.add_argument("--hidden", type=int, default=64, help="Hidden size")
+    parser.add_argument("--heads", type=int, default=4, help="Number of attention heads")
+
+    args = parser.parse_args()
+    path = save_tiny_model(args.output_dir, n_layer=args.layers, n_embd=args.hidden, n_head=args.heads)
+    print(f"Tiny model saved to: {path}")
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+QLORAX Memory Profiling
+Peak RSS from a background sampling thread plus Python-heap deltas from tracemalloc,
+attributed to named phases (load, prefill, decode, ...)
+"""
+
+import os
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+MB = 1024 * 1024
+
+
+class MemoryProfiler:
+    """Tracks process memory while started; wrap work in phase(name) to attribute it.
+
+    RSS covers everything the process holds, including tensors allocated by
+    torch outside the Python heap. A thread samples it every interval seconds
+    so short spikes inside a phase are caught, not just the value at its end.
+    tracemalloc only sees Python-level allocations and slows them down a
+    little, so trace_python can be turned off for timing-sensitive runs.
+    """
+
+    def __init__(self, interval: float = 0.01, trace_python: bool = True):
+        self.interval = interval
+        self.trace_python = trace_python
+        self.process = psutil.Process(os.getpid()) if PSUTIL_AVAILABLE else None
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self.baseline_rss = 0
+        self.peak_rss = 0
+        self._phase_peak = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started_tracemalloc = False
+
+    def rss(self) -> int:
+        return self.process.memory_info().rss if self.process else 0
+
+    def _record(self, rss: int):
+        with self._lock:
+            self.peak_rss = max(self.peak_rss, rss)
+            self._phase_peak = max(self._phase_peak, rss)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._record(self.rss())
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.baseline_rss = self.peak_rss = self.rss()
+        if self.trace_python and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        if self.process is not None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sample, name="memory-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Attribute memory used by the wrapped block to name; repeated phases accumulate.
+
+        Deltas are net growth (what the phase leaves behind) summed over calls;
+        peaks are the worst single call, which is what sizes a container.
+        """
+        rss_before = self.rss()
+        with self._lock:
+            self._phase_peak = rss_before
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            heap_before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            rss_after = self.rss()
+            self._record(rss_after)
+            stats = self.phases.setdefault(name, {
+                "calls": 0, "rss_delta_mb": 0.0, "peak_rss_mb": 0.0, "peak_rss_increase_mb": 0.0
+            })
+            stats["calls"] += 1
+            stats["rss_delta_mb"] += (rss_after - rss_before) / MB
+            stats["peak_rss_mb"] = max(stats["peak_rss_mb"], self._phase_peak / MB)
+            stats["peak_rss_increase_mb"] = max(stats["peak_rss_increase_mb"], (self._phase_peak - rss_before) / MB)
+            if tracing:
+                heap_after, heap_peak = tracemalloc.get_traced_memory()
+                stats["python_heap_delta_mb"] = stats.get("python_heap_delta_mb", 0.0) + (heap_after - heap_before) / MB
+                stats["python_heap_peak_mb"] = max(stats.get("python_heap_peak_mb", 0.0), (heap_peak - heap_before) / MB)
+
+    def summary(self) -> Dict[str, Any]:
+        self._record(self.rss())
+        return {
+            "rss_available": self.process is not None,
+            # tracemalloc slows allocation-heavy code, so timings taken alongside it are inflated
+            "python_heap_traced": self.trace_python,
+            "baseline_rss_mb": self.baseline_rss / MB,
+            "peak_rss_mb": self.peak_rss / MB,
+            "current_rss_mb": self.rss() / MB,
+            "phases": self.phases
+        }
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+QLORAX Sequence Packing
+Packs tokenized examples into max_length blocks so training batches carry tokens instead of padding
+"""
+
+from typing import Any, Dict, List, Optional
+
+import torch
+from datasets import Dataset
+
+# Examples packed together per map batch; bins never span two groups
+PACKING_GROUP_SIZE = 1000
+
+
+def pack_lengths(lengths: List[int], max_length: int) -> List[List[int]]:
+    """Group example indices into bins of at most max_length tokens (best-fit decreasing).
+
+    Bins are indexed by the room they have left, so placing an example costs
+    at most max_length lookups however many bins are open.
+    """
+    bins: List[List[int]] = []
+    by_room: Dict[int, List[int]] = {}
+    for index in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        length = min(lengths[index], max_length)
+        room = next((r for r in range(length, max_length + 1) if by_room.get(r)), None)
+        if room is None:
+            bins.append([])
+            room, target = max_length, len(bins) - 1
+        else:
+            target = by_room[room].pop()
+        bins[target].append(index)
+        by_room.setdefault(room - length, []).append(target)
+    # Keep examples in their original order inside each bin
+    return [sorted(members) for members in bins]
+
+
+def pack_batch(examples: Dict[str, List[List[int]]], max_length: int) -> Dict[str, List[Any]]:
+    """Batched map function: concatenate examples into blocks with per-example position ids.
+
+    The first label of every example after the first in a block is masked,
+    so no token is trained to predict the start of an unrelated example.
+    """
+    packed: Dict[str, List[Any]] = {"input_ids": [], "labels": [], "position_ids": [], "length": []}
+    for members in pack_lengths([len(ids) for ids in examples["input_ids"]], max_length):
+        input_ids, labels, position_ids = [], [], []
+        for index in members:
+            ids = examples["input_ids"][index][:max_length]
+            example_labels = list(examples["labels"][index][:max_length])
+            if input_ids:
+                example_labels[0] = -100
+            input_ids.extend(ids)
+            labels.extend(example_labels)
+            position_ids.extend(range(len(ids)))
+        packed["input_ids"].append(input_ids)
+        packed["labels"].append(labels)
+        packed["position_ids"].append(position_ids)
+        packed["length"].append(len(input_ids))
+    return packed
+
+
+def pack_dataset(dataset: Dataset, max_length: int, group_size: int = PACKING_GROUP_SIZE) -> Dataset:
+    """Pack a tokenized dataset (input_ids, labels) into blocks of at most max_length tokens"""
+    return dataset.map(
+        pack_batch,
+        batched=True,
+        batch_size=group_size,
+        fn_kwargs={"max_length": max_length},
+        remove_columns=dataset.column_names,
+        desc="Packing"
+    )
+
+
+def packing_stats(examples: int, packed: Dataset, max_length: int) -> Dict[str, Any]:
+    """Share of each max_length block filled with real tokens"""
+    tokens = sum(packed["length"])
+    blocks = len(packed)
+    return {
+        "examples": examples,
+        "blocks": blocks,
+        "examples_per_block": examples / blocks if blocks else 0.0,
+        "tokens": tokens,
+        "efficiency": tokens / (blocks * max_length) if blocks else 0.0
+    }
+
+
+class PackedDataCollator:
+    """Pads packed blocks into a batch and keeps their examples from attending to each other.
+
+    An example starts wherever position_ids resets to 0. With block_mask the
+    batch gets a 4D block-diagonal causal mask in the model's dtype (additive:
+    0 where attention is allowed, the dtype minimum elsewhere), which eager
+    and SDPA attention both accept. Without it only position_ids are passed,
+    for flash attention, which finds the example boundaries from them itself.
+    """
+
+    def __init__(self, pad_token_id: int, block_mask: bool = True, dtype: torch.dtype = torch.float32,
+                 pad_to_multiple_of: Optional[int] = None):
+        self.pad_token_id = pad_token_id
+        self.block_mask = block_mask
+        self.dtype = dtype
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features: List[Dict[str, List[int]]]) -> Dict[str, torch.Tensor]:
+        width = max(len(feature["input_ids"]) for feature in features)
+        if self.pad_to_multiple_of:
+            width = -(-width // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        def pad(key: str, value: int) -> torch.Tensor:
+            return torch.tensor([
+                list(feature[key]) + [value] * (width - len(feature[key])) for feature in features
+            ])
+
+        batch = {
+            "input_ids": pad("input_ids", self.pad_token_id),
+            "labels": pad("labels", -100),
+            "position_ids": pad("position_ids", 0)
+        }
+        if self.block_mask:
+            lengths = torch.tensor([len(feature["input_ids"]) for feature in features])
+            real = torch.arange(width)[None, :] < lengths[:, None]
+            batch["attention_mask"] = self.block_attention_mask(batch["position_ids"], real)
+        return batch
+
+    def block_attention_mask(self, position_ids: torch.Tensor, real: torch.Tensor) -> torch.Tensor:
+        """(batch, 1, width, width) additive causal mask confined to each example"""
+        segments = (position_ids == 0).cumsum(-1).masked_fill(~real, 0)
+        width = position_ids.shape[1]
+        causal = torch.ones(width, width, dtype=torch.bool).tril()
+        allowed = (segments[:, :, None] == segments[:, None, :]) & causal & real[:, None, :]
+        # Padding rows attend to themselves so softmax never sees an all-masked row
+        allowed |= torch.eye(width, dtype=torch.bool)
+        mask = torch.zeros(allowed.shape, dtype=self.dtype).masked_fill(~allowed, torch.finfo(self.dtype).min)
+        return mask[:, None]
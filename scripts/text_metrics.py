@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+QLORAX Text Metrics
+BLEU, ROUGE and exact match over prediction/reference pairs: a NumPy implementation
+over token-ID arrays, and the nltk/rouge_score reference sharded across a process pool.
+Also an on-disk embedding cache and row-wise cosine similarity for semantic scoring.
+Kept free of torch and model imports so spawned workers start quickly.
+"""
+
+import os
+import math
+import uuid
+import hashlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from nltk import word_tokenize
+from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
+from rouge_score import rouge_scorer, tokenizers
+
+BLEU_WEIGHTS = {
+    'bleu_1': (1, 0, 0, 0),
+    'bleu_2': (0.5, 0.5, 0, 0),
+    'bleu_4': (0.25, 0.25, 0.25, 0.25)
+}
+ROUGE_TYPES = {'rouge_1': 'rouge1', 'rouge_2': 'rouge2', 'rouge_l': 'rougeL'}
+
+# Epsilon of nltk's SmoothingFunction().method1
+BLEU_EPSILON = 0.1
+
+# DP cells per LCS chunk, bounding memory on long texts
+LCS_CHUNK_CELLS = 1 << 22
+
+# Below this many pairs, starting worker processes costs more than it saves
+MIN_PARALLEL_PAIRS = 256
+
+_rouge_scorer = None
+
+
+def _get_rouge_scorer():
+    """One scorer per process, built on first use"""
+    global _rouge_scorer
+    if _rouge_scorer is None:
+        _rouge_scorer = rouge_scorer.RougeScorer(list(ROUGE_TYPES.values()), use_stemmer=True)
+    return _rouge_scorer
+
+
+def score_pairs(pairs: Sequence[Tuple[str, str]],
+                tokenize: Callable[[str], List[str]] = word_tokenize) -> Dict[str, List[float]]:
+    """Per-pair scores for every text metric, computed in a single pass over the pairs"""
+    smoothing = SmoothingFunction().method1
+    scorer = _get_rouge_scorer()
+    scores = {name: [] for name in [*BLEU_WEIGHTS, *ROUGE_TYPES, 'exact_match']}
+
+    for pred, ref in pairs:
+        pred_tokens = tokenize(pred.lower())
+        ref_tokens = [tokenize(ref.lower())]
+        for name, weights in BLEU_WEIGHTS.items():
+            scores[name].append(sentence_bleu(ref_tokens, pred_tokens, weights=weights, smoothing_function=smoothing))
+
+        rouge = scorer.score(ref, pred)
+        for name, rouge_type in ROUGE_TYPES.items():
+            scores[name].append(rouge[rouge_type].fmeasure)
+
+        scores['exact_match'].append(int(pred.strip().lower() == ref.strip().lower()))
+    return scores
+
+
+def compute_text_metrics(predictions: List[str], references: List[str], workers: Optional[int] = None,
+                         tokenize: Callable[[str], List[str]] = word_tokenize) -> Dict[str, float]:
+    """Corpus-level BLEU (0-100), ROUGE F1 and exact match.
+
+    Pairs are split into contiguous shards and the per-pair scores are
+    concatenated back in input order before averaging, so the result is
+    identical to scoring serially whatever the number of workers.
+    """
+    pairs = list(zip(predictions, references))
+    workers = workers or os.cpu_count() or 1
+
+    if workers <= 1 or len(pairs) < MIN_PARALLEL_PAIRS:
+        scores = score_pairs(pairs, tokenize)
+    else:
+        # A few shards per worker evens out pairs of very different lengths
+        shard_size = math.ceil(len(pairs) / (workers * 4))
+        shards = [pairs[i:i + shard_size] for i in range(0, len(pairs), shard_size)]
+        # spawn, not fork: the parent usually holds a model and torch thread pools
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+            results = list(pool.map(score_pairs, shards, [tokenize] * len(shards)))
+        scores = {name: [value for result in results for value in result[name]] for name in results[0]}
+
+    metrics = {name: np.mean(scores[name]) * 100 for name in BLEU_WEIGHTS}
+    metrics.update({name: np.mean(scores[name]) for name in ROUGE_TYPES})
+    metrics['exact_match'] = sum(scores['exact_match']) / len(pairs)
+    return metrics
+
+
+def encode_texts(texts: Sequence[str], tokenize: Callable[[str], List[str]],
+                 vocab: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Tokenize each text once and map tokens to ids.
+
+    Returns the concatenated token ids, the sample index of every token
+    and the length of every sample, which is all the n-gram and LCS code
+    below needs.
+    """
+    sequences = [[vocab.setdefault(token, len(vocab)) for token in tokenize(text)] for text in texts]
+    lengths = np.array([len(ids) for ids in sequences], dtype=np.int64)
+    flat = np.fromiter((i for ids in sequences for i in ids), dtype=np.int64, count=int(lengths.sum()))
+    return flat, np.repeat(np.arange(len(texts)), lengths), lengths
+
+
+def _ngrams(flat: np.ndarray, samples: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Sample index and token ids of every n-gram that does not cross a sample boundary"""
+    starts = np.arange(max(len(flat) - n + 1, 0))
+    starts = starts[samples[starts] == samples[starts + n - 1]]
+    return samples[starts], np.stack([flat[starts + k] for k in range(n)], axis=1)
+
+
+def ngram_overlap(pred: Tuple[np.ndarray, np.ndarray], ref: Tuple[np.ndarray, np.ndarray],
+                  n: int, num_samples: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Per-sample clipped n-gram matches, prediction n-grams and reference n-grams"""
+    pred_samples, pred_grams = _ngrams(*pred, n)
+    ref_samples, ref_grams = _ngrams(*ref, n)
+    pred_total = np.bincount(pred_samples, minlength=num_samples)
+    ref_total = np.bincount(ref_samples, minlength=num_samples)
+    if not len(pred_samples) or not len(ref_samples):
+        return np.zeros(num_samples, dtype=np.int64), pred_total, ref_total
+
+    # Number every distinct (sample, n-gram), then count both sides per number
+    rows = np.concatenate([
+        np.column_stack([pred_samples, pred_grams]),
+        np.column_stack([ref_samples, ref_grams])
+    ])
+    unique, codes = np.unique(rows, axis=0, return_inverse=True)
+    codes = codes.reshape(-1)
+    pred_counts = np.bincount(codes[:len(pred_samples)], minlength=len(unique))
+    ref_counts = np.bincount(codes[len(pred_samples):], minlength=len(unique))
+    matches = np.bincount(unique[:, 0], weights=np.minimum(pred_counts, ref_counts), minlength=num_samples)
+    return matches.astype(np.int64), pred_total, ref_total
+
+
+def lcs_lengths(pred: Tuple[np.ndarray, np.ndarray, np.ndarray],
+                ref: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> np.ndarray:
+    """Longest common subsequence length of every pair.
+
+    Pairs are sorted by length, padded into chunks and run through the DP
+    together, one prediction token at a time. Each DP row follows from the
+    previous one with a cumulative max:
+    row[j] = max over j' <= j of (prev[j'-1] + 1 if tokens match else prev[j']).
+    """
+    (pred_flat, _, pred_lengths), (ref_flat, _, ref_lengths) = pred, ref
+    pred_offsets = np.concatenate([[0], np.cumsum(pred_lengths)])
+    ref_offsets = np.concatenate([[0], np.cumsum(ref_lengths)])
+    result = np.zeros(len(pred_lengths), dtype=np.int64)
+
+    order = np.argsort(np.maximum(pred_lengths, ref_lengths), kind="stable")
+    start = 0
+    while start < len(order):
+        # Grow the chunk while the padded DP stays within the cell budget
+        rows, cols = pred_lengths[order[start]], ref_lengths[order[start]]
+        end = start + 1
+        while end < len(order):
+            grown_rows = max(rows, pred_lengths[order[end]])
+            grown_cols = max(cols, ref_lengths[order[end]])
+            if (end + 1 - start) * (grown_rows + 1) * (grown_cols + 1) > LCS_CHUNK_CELLS:
+                break
+            rows, cols = grown_rows, grown_cols
+            end += 1
+        chunk = order[start:end]
+        start = end
+
+        if rows == 0 or cols == 0:
+            continue
+        # Different negative padding on each side, so padding never matches
+        a = np.full((len(chunk), rows), -1, dtype=np.int64)
+        b = np.full((len(chunk), cols), -2, dtype=np.int64)
+        for k, i in enumerate(chunk):
+            a[k, :pred_lengths[i]] = pred_flat[pred_offsets[i]:pred_offsets[i + 1]]
+            b[k, :ref_lengths[i]] = ref_flat[ref_offsets[i]:ref_offsets[i + 1]]
+
+        prev = np.zeros((len(chunk), cols + 1), dtype=np.int64)
+        lcs = np.zeros(len(chunk), dtype=np.int64)
+        done = pred_lengths[chunk]
+        for i in range(rows):
+            candidates = np.where(a[:, i:i + 1] == b, prev[:, :-1] + 1, prev[:, 1:])
+            prev[:, 1:] = np.maximum.accumulate(candidates, axis=1)
+            finished = done == i + 1
+            lcs[finished] = prev[finished, ref_lengths[chunk][finished]]
+        result[chunk] = lcs
+    return result
+
+
+def _fmeasure(precision: np.ndarray, recall: np.ndarray) -> np.ndarray:
+    total = precision + recall
+    return np.divide(2 * precision * recall, total, out=np.zeros_like(total), where=total > 0)
+
+
+def _bleu(matches: List[np.ndarray], totals: List[np.ndarray], hyp_lengths: np.ndarray,
+          ref_lengths: np.ndarray, weights: Tuple[float, ...]) -> np.ndarray:
+    """BLEU with nltk's brevity penalty and method1 smoothing, elementwise over the inputs"""
+    denominators = [np.maximum(total, 1) for total in totals]
+    log_precision = sum(
+        weight * np.log(np.where(match > 0, match, BLEU_EPSILON) / denominator)
+        for weight, match, denominator in zip(weights, matches, denominators)
+    )
+    with np.errstate(divide="ignore"):
+        brevity = np.where(
+            hyp_lengths > ref_lengths, 1.0,
+            np.exp(1 - ref_lengths / np.maximum(hyp_lengths, 1))
+        )
+    brevity = np.where(hyp_lengths == 0, 0.0, brevity)
+    # No unigram match at all scores 0, whatever the smoothing
+    return np.where(matches[0] > 0, brevity * np.exp(log_precision), 0.0)
+
+
+def score_corpus(predictions: List[str], references: List[str],
+                 tokenize: Callable[[str], List[str]] = word_tokenize) -> Tuple[Dict[str, float], Dict[str, np.ndarray]]:
+    """NumPy BLEU-1/2/4, ROUGE-1/2/L and exact match; returns (summary, per-sample scores).
+
+    Per-sample values match nltk's sentence_bleu with method1 smoothing
+    and rouge_score's F-measure with stemming. The summary holds the same
+    averages as compute_text_metrics plus corpus-level BLEU, which pools
+    n-gram counts over all pairs instead of averaging sentence scores.
+    """
+    num_samples = len(predictions)
+
+    # BLEU on lowercased nltk tokens, as calculate_bleu_scores does
+    vocab: Dict[str, int] = {}
+    pred = encode_texts([text.lower() for text in predictions], tokenize, vocab)
+    ref = encode_texts([text.lower() for text in references], tokenize, vocab)
+    matches, totals = [], []
+    for n in range(1, 5):
+        match, pred_total, _ = ngram_overlap(pred[:2], ref[:2], n, num_samples)
+        matches.append(match)
+        totals.append(pred_total)
+
+    per_sample = {}
+    summary = {}
+    for name, weights in BLEU_WEIGHTS.items():
+        per_sample[name] = _bleu(matches, totals, pred[2], ref[2], weights)
+        summary[name] = per_sample[name].mean() * 100
+        corpus_totals = [np.maximum(total, 1).sum() for total in totals]
+        summary[f'corpus_{name}'] = float(_bleu(
+            [match.sum() for match in matches], corpus_totals,
+            pred[2].sum(), ref[2].sum(), weights
+        )) * 100
+
+    # ROUGE on rouge_score's own (stemmed) tokens
+    rouge_tokenize = tokenizers.DefaultTokenizer(use_stemmer=True).tokenize
+    vocab = {}
+    pred = encode_texts(predictions, rouge_tokenize, vocab)
+    ref = encode_texts(references, rouge_tokenize, vocab)
+    for name, n in (('rouge_1', 1), ('rouge_2', 2)):
+        overlap, pred_total, ref_total = ngram_overlap(pred[:2], ref[:2], n, num_samples)
+        per_sample[name] = _fmeasure(overlap / np.maximum(pred_total, 1), overlap / np.maximum(ref_total, 1))
+    lcs = lcs_lengths(pred, ref)
+    per_sample['rouge_l'] = _fmeasure(lcs / np.maximum(pred[2], 1), lcs / np.maximum(ref[2], 1))
+    for name in ROUGE_TYPES:
+        summary[name] = per_sample[name].mean()
+
+    per_sample['exact_match'] = np.array(
+        [pred.strip().lower() == ref.strip().lower() for pred, ref in zip(predictions, references)], dtype=np.int64
+    )
+    summary['exact_match'] = per_sample['exact_match'].sum() / num_samples
+    return summary, per_sample
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Sentence embeddings on disk, keyed by model and text hash.
+
+    References are the same on every run over a test set, so after the
+    first run only new predictions are encoded. Each run that encodes
+    anything writes one more .npz shard; shards are read once, on first use.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str):
+        self.directory = Path(cache_dir) / model_name.replace("/", "__")
+        self._embeddings: Optional[Dict[str, np.ndarray]] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self) -> Dict[str, np.ndarray]:
+        if self._embeddings is None:
+            self._embeddings = {}
+            for shard in sorted(self.directory.glob("*.npz")):
+                with np.load(shard) as data:
+                    self._embeddings.update(zip(data["keys"].tolist(), data["embeddings"]))
+        return self._embeddings
+
+    def embed(self, texts: List[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Embedding matrix for texts, encoding only distinct texts not cached yet"""
+        embeddings = self._load()
+        keys = [text_hash(text) for text in texts]
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in embeddings:
+                missing.setdefault(key, text)
+        self.misses += len(missing)
+        self.hits += len(texts) - sum(1 for key in keys if key in missing)
+
+        if missing:
+            encoded = np.asarray(encode(list(missing.values())), dtype=np.float32)
+            embeddings.update(zip(missing, encoded))
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Write under a temporary name so a concurrent reader never sees half a shard
+            shard = self.directory / f"{uuid.uuid4().hex}.npz"
+            partial = shard.with_suffix(".tmp")
+            with open(partial, "wb") as f:
+                np.savez(f, keys=np.array(list(missing)), embeddings=encoded)
+            os.replace(partial, shard)
+
+        return np.stack([embeddings[key] for key in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+
+
+def rowwise_cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Cosine similarity of each row of a with the same row of b"""
+    a_norm = np.linalg.norm(a, axis=1)
+    b_norm = np.linalg.norm(b, axis=1)
+    dot = np.einsum("ij,ij->i", a, b)
+    # Zero vectors get similarity 0, as sklearn's cosine_similarity gives them
+    return np.divide(dot, a_norm * b_norm, out=np.zeros_like(dot), where=(a_norm * b_norm) > 0)
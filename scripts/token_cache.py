@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+QLORAX Tokenized Dataset Cache
+Tokenized datasets saved as memory-mapped Arrow shards, keyed by what went into them:
+the data file's contents, the tokenizer, the prompt template, max_length and any other options
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict
+
+from datasets import Dataset, load_from_disk
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = "cache/tokenized"
+
+# Bump whenever tokenization changes what it produces for the same inputs
+CACHE_VERSION = 2
+
+# Data file hashes are remembered per (size, mtime) so an unchanged file is not re-read
+DIGEST_INDEX = "digests.json"
+
+
+def file_digest(path: str, cache_dir: str) -> str:
+    """sha256 of a file's contents, recomputed only when its size or mtime changes"""
+    index_path = Path(cache_dir) / DIGEST_INDEX
+    try:
+        index = json.loads(index_path.read_text())
+    except (OSError, ValueError):
+        index = {}
+
+    stat = os.stat(path)
+    name = str(Path(path).resolve())
+    entry = index.get(name)
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["sha256"]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    index[name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = index_path.with_name(f"{DIGEST_INDEX}.{os.getpid()}")
+    tmp_path.write_text(json.dumps(index, indent=2))
+    os.replace(tmp_path, index_path)
+    return index[name]["sha256"]
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """Hash of everything that decides how a tokenizer splits text"""
+    digest = hashlib.sha256(type(tokenizer).__name__.encode())
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        state = json.loads(backend.to_str())
+        # Truncation and padding are per-call settings the tokenizer leaves behind, not its identity
+        state.pop("truncation", None)
+        state.pop("padding", None)
+    else:
+        state = {"name_or_path": tokenizer.name_or_path, "vocab": tokenizer.get_vocab()}
+    state["special_tokens"] = tokenizer.special_tokens_map
+    state["sides"] = [tokenizer.padding_side, tokenizer.truncation_side]
+    digest.update(json.dumps(state, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def cache_key(data_path: str, tokenizer, template: str, max_length: int, cache_dir: str = DEFAULT_CACHE_DIR,
+              **options: Any) -> str:
+    """Content address of a tokenized dataset; options covers anything else that changes it"""
+    parts: Dict[str, Any] = {
+        "version": CACHE_VERSION,
+        "data": file_digest(data_path, cache_dir),
+        "tokenizer": tokenizer_fingerprint(tokenizer),
+        "template": template,
+        "max_length": max_length,
+        "options": options
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+
+def load_or_build(key: str, build: Callable[[], Dataset], cache_dir: str = DEFAULT_CACHE_DIR) -> Dataset:
+    """The cached dataset for key, or build() saved under key first.
+
+    Datasets are written to a temporary directory and renamed into place, so
+    an interrupted run never leaves a half-written entry behind. Loading
+    memory-maps the Arrow shards rather than reading them into memory.
+    """
+    path = Path(cache_dir) / key
+    if path.exists():
+        logger.info(f"Using cached tokenized dataset {path}")
+        return load_from_disk(str(path))
+
+    dataset = build()
+    tmp_path = path.with_name(f"{key}.tmp-{os.getpid()}")
+    dataset.save_to_disk(str(tmp_path))
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        # Another run saved the same key first; its copy is identical
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    logger.info(f"Saved tokenized dataset to {path}")
+    return load_from_disk(str(path))
@@ -5,7 +5,9 @@ Comprehensive fine-tuning with monitoring, checkpointing, and evaluation
 """
 
 import os
+import sys
 import json
+import time
 import yaml
 import logging
 import argparse
@@ -22,6 +24,7 @@ from transformers import (
     TrainingArguments,
     Trainer,
     DataCollatorForLanguageModeling,
+    DataCollatorForSeq2Seq,
     EarlyStoppingCallback,
     get_linear_schedule_with_warmup
 )
@@ -29,6 +32,15 @@ from peft import LoraConfig, get_peft_model, TaskType, PeftModel
 import wandb
 from tqdm import tqdm
 
+# Add project root to Python path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from scripts.data_stream import data_format, load_records
+from scripts.packing import PackedDataCollator, pack_dataset, packing_stats
+from scripts.batching import MEGABATCH_MULT, BatchingTrainer, TokenCountingCollator
+from scripts.token_cache import DEFAULT_CACHE_DIR, cache_key, load_or_build
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -36,12 +48,91 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+DEFAULT_PROMPT_TEMPLATE = "### Input:\n{input}\n\n### Output:\n{output}"
+
+# Examples per tokenizer call; fast tokenizers amortise per-call overhead over large batches
+TOKENIZE_BATCH_SIZE = 4096
+# Below this many examples, starting worker processes costs more than it saves
+MIN_PARALLEL_EXAMPLES = 20000
+
+
+def stream_prompts(data_path: str, template: str, limit: Optional[int] = None,
+                   sample: Optional[int] = None, source_version: Optional[tuple] = None):
+    """Yield formatted training prompts one example at a time.
+
+    prompt_chars is the length of the text before the {output} field, the
+    part train_on_inputs: false leaves out of the loss (0 if the template
+    has no {output}). source_version (size and mtime of the data file) is
+    unused here but is part of the arguments datasets fingerprints, so an
+    edited file is re-read instead of being served from the Arrow cache.
+    """
+    prompt_template = template.split("{output}")[0] if "{output}" in template else ""
+    for example in load_records(data_path, limit=limit, sample=sample):
+        yield {"text": template.format(**example), "prompt_chars": len(prompt_template.format(**example))}
+
+
+def prompt_token_count(offsets: List[tuple], prompt_chars: int) -> int:
+    """Tokens before the first one that ends inside the output; a token spanning
+    the boundary belongs to the output. Special tokens have (0, 0) offsets, so a
+    leading BOS counts as prompt and a trailing EOS as output."""
+    return next((i for i, (_, end) in enumerate(offsets) if end > prompt_chars), len(offsets))
+
+
+def tokenize_batch(examples: Dict[str, List[Any]], tokenizer, max_length: int,
+                   train_on_inputs: bool = True) -> Dict[str, List[Any]]:
+    """Batched map function. Module level, so num_proc workers each unpickle
+    their own tokenizer rather than a copy of the whole trainer and model.
+
+    Without train_on_inputs the prompt's labels are -100, located from the
+    tokenizer's character offsets once here rather than on every step.
+    Examples left with no output tokens after truncation are dropped, as
+    they would add nothing but a zero-token loss.
+    """
+    mask_prompt = not train_on_inputs
+    # Tokenize the text
+    tokenized = tokenizer(
+        examples["text"],
+        truncation=True,
+        padding=False,  # Let data collator handle padding
+        max_length=max_length,
+        return_tensors=None,  # Return lists, not tensors
+        return_offsets_mapping=mask_prompt and tokenizer.is_fast
+    )
+    # For causal language modeling, labels are the same as input_ids
+    tokenized["labels"] = [list(ids) for ids in tokenized["input_ids"]]
+    
+    if mask_prompt:
+        if tokenizer.is_fast:
+            prompt_tokens = [
+                prompt_token_count(offsets, chars)
+                for offsets, chars in zip(tokenized.pop("offset_mapping"), examples["prompt_chars"])
+            ]
+        else:
+            # Slow tokenizers give no offsets; tokenizing the prompt alone can differ by a token at the seam
+            prompts = [text[:chars] for text, chars in zip(examples["text"], examples["prompt_chars"])]
+            prompt_tokens = [len(ids) for ids in tokenizer(prompts, truncation=True, max_length=max_length)["input_ids"]]
+        for labels, count in zip(tokenized["labels"], prompt_tokens):
+            labels[:count] = [-100] * min(count, len(labels))
+        
+        keep = [i for i, labels in enumerate(tokenized["labels"]) if any(label != -100 for label in labels)]
+        if len(keep) < len(tokenized["labels"]):
+            tokenized = {key: [values[i] for i in keep] for key, values in tokenized.items()}
+    
+    # Lengths let create_trainer group batches without reading every input_ids row
+    tokenized["length"] = [len(ids) for ids in tokenized["input_ids"]]
+    return tokenized
+
+
 class ProductionTrainer:
     """Production-ready QLoRA training with comprehensive monitoring"""
     
     def __init__(self, config_path: str):
         """Initialize trainer with configuration"""
         self.config = self.load_config(config_path)
+        # Packing efficiency of each tokenized split, when sample_packing is on
+        self.packing_stats: Dict[str, Dict[str, Any]] = {}
+        # Tokenization throughput of each split tokenized in this run (not served from cache)
+        self.tokenization_stats: Dict[str, Dict[str, Any]] = {}
         self.setup_logging()
         self.setup_directories()
         
@@ -94,28 +185,23 @@ class ProductionTrainer:
         logger.info("Loading training data...")
         
         data_path = self.config['data_path']
-        if data_path.endswith('.jsonl'):
-            data = []
-            with open(data_path, 'r') as f:
-                for line in f:
-                    data.append(json.loads(line.strip()))
-        elif data_path.endswith('.json'):
-            with open(data_path, 'r') as f:
-                data = json.load(f)
-        else:
-            raise ValueError(f"Unsupported data format: {data_path}")
-        
-        logger.info(f"Loaded {len(data)} training examples")
+        # .json/.jsonl, optionally .gz/.zst compressed
+        data_format(data_path)
         
-        # Create training prompts
-        def format_prompt(example):
-            template = self.config.get('prompt_template', "### Input:\n{input}\n\n### Output:\n{output}")
-            return template.format(**example)
-        
-        formatted_data = [format_prompt(item) for item in data]
+        # Examples are streamed into an on-disk Arrow table, so memory stays flat however large the file
+        stat = os.stat(data_path)
+        dataset = Dataset.from_generator(
+            stream_prompts,
+            gen_kwargs={
+                "data_path": data_path,
+                "template": self.config.get('prompt_template', DEFAULT_PROMPT_TEMPLATE),
+                "limit": self.config.get('data_limit'),
+                "sample": self.config.get('data_sample'),
+                "source_version": (stat.st_size, stat.st_mtime_ns)
+            }
+        )
         
-        # Create dataset
-        dataset = Dataset.from_dict({"text": formatted_data})
+        logger.info(f"Loaded {len(dataset)} training examples")
         
         # Split data if validation split specified
         if self.config.get('validation_split', 0) > 0:
@@ -195,37 +281,107 @@ class ProductionTrainer:
         total_params = sum(p.numel() for p in self.model.parameters())
         logger.info(f"Trainable parameters: {trainable_params:,} ({trainable_params/total_params*100:.2f}%)")
     
-    def tokenize_dataset(self, dataset: Dataset) -> Dataset:
-        """Tokenize the dataset"""
+    def tokenize_dataset(self, dataset: Dataset, split: str = "train") -> Dataset:
+        """Tokenize the dataset, packing examples into max_length blocks if sample_packing is set.
+        
+        dataset is the given split of the configured data_path. Its tokenized
+        form is cached under tokenized_cache_dir, keyed by the data file's
+        contents, tokenizer, template, max_length and how the split was drawn,
+        so later runs with the same inputs skip tokenization.
+        """
         logger.info("Tokenizing dataset...")
+        max_length = self.config.get('max_length', 1024)
         
-        def tokenize_function(examples):
-            # Tokenize the text
-            tokenized = self.tokenizer(
-                examples["text"],
-                truncation=True,
-                padding=False,  # Let data collator handle padding
-                max_length=self.config.get('max_length', 1024),
-                return_tensors=None  # Return lists, not tensors
+        def tokenize():
+            num_proc = self.tokenization_workers(len(dataset))
+            started = time.perf_counter()
+            # Workers take contiguous shards and datasets concatenates them in order,
+            # so the result is identical to a single-process run
+            tokenized = dataset.map(
+                tokenize_batch,
+                batched=True,
+                batch_size=self.config.get('tokenization_batch_size', TOKENIZE_BATCH_SIZE),
+                num_proc=num_proc if num_proc > 1 else None,
+                fn_kwargs={
+                    "tokenizer": self.tokenizer, "max_length": max_length,
+                    "train_on_inputs": self.config.get('train_on_inputs', True)
+                },
+                remove_columns=dataset.column_names,
+                desc="Tokenizing"
+            )
+            elapsed = time.perf_counter() - started
+            if len(tokenized) == 0 and len(dataset):
+                raise ValueError(f"No {split} example has output tokens within max_length={max_length}")
+            tokens = sum(tokenized["length"])
+            if len(tokenized) < len(dataset):
+                logger.warning(
+                    f"Dropped {len(dataset) - len(tokenized)} {split} examples whose output was cut off by max_length"
+                )
+            stats = {
+                "examples": len(tokenized), "tokens": tokens, "num_proc": num_proc, "seconds": elapsed,
+                "examples_per_second": len(tokenized) / elapsed if elapsed else 0.0,
+                "tokens_per_second": tokens / elapsed if elapsed else 0.0
+            }
+            self.tokenization_stats[split] = stats
+            logger.info(
+                f"Tokenized {split} split with {num_proc} process(es) in {elapsed:.1f}s: "
+                f"{stats['examples_per_second']:,.0f} examples/s, {stats['tokens_per_second']:,.0f} tokens/s"
             )
-            # For causal language modeling, labels are the same as input_ids
-            tokenized["labels"] = tokenized["input_ids"].copy()
             return tokenized
         
-        tokenized = dataset.map(
-            tokenize_function,
-            batched=True,
-            remove_columns=dataset.column_names,
-            desc="Tokenizing"
-        )
+        cache_dir = self.config.get('tokenized_cache_dir', DEFAULT_CACHE_DIR)
+        if cache_dir:
+            key = cache_key(
+                self.config['data_path'], self.tokenizer,
+                self.config.get('prompt_template', DEFAULT_PROMPT_TEMPLATE), max_length, cache_dir,
+                split=split, examples=len(dataset), validation_split=self.config.get('validation_split', 0),
+                data_limit=self.config.get('data_limit'), data_sample=self.config.get('data_sample'),
+                train_on_inputs=self.config.get('train_on_inputs', True)
+            )
+            tokenized = load_or_build(key, tokenize, cache_dir)
+        else:
+            tokenized = tokenize()
         
         logger.info(f"Tokenized {len(tokenized)} examples")
+        
+        if self.config.get('sample_packing', False):
+            packed = pack_dataset(tokenized.select_columns(["input_ids", "labels"]), max_length)
+            stats = packing_stats(len(tokenized), packed, max_length)
+            self.packing_stats[split] = stats
+            logger.info(
+                f"Packed {stats['examples']} {split} examples into {stats['blocks']} blocks of {max_length} tokens "
+                f"({stats['examples_per_block']:.1f} per block, {stats['efficiency']:.1%} filled)"
+            )
+            return packed
         return tokenized
     
+    def tokenization_workers(self, num_examples: int) -> int:
+        """Processes for tokenizing num_examples: tokenization_num_proc if set, else one per CPU for large datasets"""
+        num_proc = self.config.get('tokenization_num_proc')
+        if num_proc is None:
+            num_proc = (os.cpu_count() or 1) if num_examples >= MIN_PARALLEL_EXAMPLES else 1
+        num_proc = max(1, min(num_proc, num_examples))
+        if num_proc > 1:
+            # Each worker tokenizes its shard on one thread; Rust-side threads on top would
+            # oversubscribe the CPUs and can deadlock in forked workers
+            os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+        return num_proc
+    
     def create_trainer(self, train_dataset: Dataset, eval_dataset: Optional[Dataset] = None) -> Trainer:
         """Create and configure trainer"""
         logger.info("Creating trainer...")
         
+        # Batch examples of similar length together (shuffled megabatches) so batches carry less padding
+        lengths = {}
+        if self.config.get('group_by_length', False):
+            lengths['train'] = train_dataset['length']
+            if eval_dataset is not None:
+                lengths['eval'] = eval_dataset['length']
+            logger.info("Grouping batches by example length")
+        train_dataset = train_dataset.remove_columns([c for c in ['length'] if c in train_dataset.column_names])
+        if eval_dataset is not None:
+            eval_dataset = eval_dataset.remove_columns([c for c in ['length'] if c in eval_dataset.column_names])
+        
         # Training arguments
         training_args = TrainingArguments(
             output_dir=str(self.output_dir / 'checkpoints'),
@@ -272,10 +428,24 @@ class ProductionTrainer:
         )
         
         # Data collator
-        data_collator = DataCollatorForLanguageModeling(
-            tokenizer=self.tokenizer,
-            mlm=False,
-        )
+        if self.config.get('sample_packing', False):
+            # Flash attention separates packed examples by position_ids; other kernels need the block mask
+            data_collator = PackedDataCollator(
+                self.tokenizer.pad_token_id,
+                block_mask=getattr(self.model.config, '_attn_implementation', None) != 'flash_attention_2',
+                dtype=self.model.dtype
+            )
+        elif not self.config.get('train_on_inputs', True):
+            # Pads labels with -100 but keeps them, so the masked prompt stays out of the loss
+            data_collator = DataCollatorForSeq2Seq(
+                tokenizer=self.tokenizer,
+                label_pad_token_id=-100,
+            )
+        else:
+            data_collator = DataCollatorForLanguageModeling(
+                tokenizer=self.tokenizer,
+                mlm=False,
+            )
         
         # Callbacks
         callbacks = []
@@ -284,14 +454,16 @@ class ProductionTrainer:
                 early_stopping_patience=self.config['early_stopping_patience']
             ))
         
-        # Create trainer
-        trainer = Trainer(
+        # Create trainer; every log step also reports tokens_per_second and padding_ratio
+        trainer = BatchingTrainer(
             model=self.model,
             args=training_args,
             train_dataset=train_dataset,
             eval_dataset=eval_dataset,
-            data_collator=data_collator,
+            data_collator=TokenCountingCollator(data_collator),
             callbacks=callbacks,
+            lengths=lengths,
+            megabatch_mult=self.config.get('length_megabatch_mult', MEGABATCH_MULT),
         )
         
         return trainer
@@ -315,7 +487,7 @@ class ProductionTrainer:
             
             # Tokenize datasets
             tokenized_train = self.tokenize_dataset(self.train_dataset)
-            tokenized_eval = self.tokenize_dataset(self.eval_dataset) if self.eval_dataset else None
+            tokenized_eval = self.tokenize_dataset(self.eval_dataset, "eval") if self.eval_dataset else None
             
             # Create trainer
             trainer = self.create_trainer(tokenized_train, tokenized_eval)
@@ -335,6 +507,9 @@ class ProductionTrainer:
                 'train_runtime': train_result.metrics['train_runtime'],
                 'train_samples_per_second': train_result.metrics['train_samples_per_second'],
                 'total_flos': train_result.metrics.get('total_flos', 0),
+                'tokenization': self.tokenization_stats,
+                'packing': self.packing_stats,
+                'padding_ratio': trainer.padding_ratio(),
                 'config': self.config
             }
             
@@ -365,6 +540,8 @@ def main():
     parser.add_argument("--output", help="Override output directory from config")
     parser.add_argument("--wandb-project", help="Weights & Biases project name")
     parser.add_argument("--experiment-name", help="Experiment name for logging")
+    parser.add_argument("--limit", type=int, help="Stop reading the data after this many examples")
+    parser.add_argument("--sample", type=int, help="Train on a uniform random sample of this many examples")
     
     args = parser.parse_args()
     
@@ -381,6 +558,10 @@ def main():
         trainer.config['use_wandb'] = True
     if args.experiment_name:
         trainer.config['experiment_name'] = args.experiment_name
+    if args.limit:
+        trainer.config['data_limit'] = args.limit
+    if args.sample:
+        trainer.config['data_sample'] = args.sample
     
     # Run training
     results = trainer.train()
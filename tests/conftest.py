@@ -0,0 +1,42 @@
+import pytest
+import sys
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+
+@pytest.fixture(scope="session")
+def tiny_model():
+    """Tiny random GPT-2 and tokenizer, built offline from test_output/"""
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    from scripts.make_tiny_model import build_tiny_model
+    return build_tiny_model()
+
+
+@pytest.fixture
+def tiny_manager(tiny_model):
+    """ModelManager serving the tiny model through the batching engine"""
+    pytest.importorskip("fastapi")
+    from app.api import ModelManager
+
+    manager = ModelManager()
+    manager.model, manager.tokenizer = tiny_model
+    manager.model_name = "tiny-gpt2"
+    manager.is_loaded = True
+    manager.start_engine()
+    yield manager
+    manager.stop_engine()
+
+
+@pytest.fixture
+def tiny_client(tiny_manager):
+    """TestClient whose endpoints use the tiny model manager"""
+    from fastapi.testclient import TestClient
+    from app.api import app, get_model_manager
+
+    app.dependency_overrides[get_model_manager] = lambda: tiny_manager
+    yield TestClient(app)
+    app.dependency_overrides.clear()
@@ -0,0 +1,218 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("peft")
+
+from app.adapters import BASE_ADAPTER, AdapterRegistry
+from app.engine import ContinuousBatchingEngine
+from scripts.make_tiny_model import build_tiny_model
+
+PROMPTS = ["What is LoRA?", "Explain attention.", "Hello there"]
+
+
+@pytest.fixture(scope="module")
+def adapter_dirs(tmp_path_factory):
+    """Two randomly initialised LoRA adapters for the tiny model"""
+    from peft import LoraConfig, get_peft_model
+
+    root = tmp_path_factory.mktemp("adapters")
+    paths = {}
+    for seed, name in enumerate(["alpha", "beta"], start=1):
+        model, _ = build_tiny_model()
+        torch.manual_seed(seed)
+        config = LoraConfig(r=4, target_modules=["c_attn"], fan_in_fan_out=True,
+                            init_lora_weights=False)
+        get_peft_model(model, config).save_pretrained(str(root / name))
+        paths[name] = str(root / name)
+    return paths
+
+
+@pytest.fixture
+def registry(adapter_dirs):
+    model, tokenizer = build_tiny_model()
+    registry = AdapterRegistry(model, "tiny-gpt2", max_loaded=2)
+    for name, path in adapter_dirs.items():
+        registry.register(name, path)
+    return registry, tokenizer
+
+
+def _reference(model, tokenizer, prompt, adapter):
+    inputs = torch.tensor([tokenizer.encode(prompt)])
+    with torch.no_grad():
+        outputs = model.generate(
+            inputs, attention_mask=torch.ones_like(inputs), max_new_tokens=6,
+            do_sample=False, pad_token_id=tokenizer.eos_token_id,
+            adapter_names=[adapter or BASE_ADAPTER]
+        )
+    return outputs[0, inputs.shape[1]:].tolist()
+
+
+def test_mixed_adapter_batch_matches_single_requests(registry):
+    registry, tokenizer = registry
+    for name in ("alpha", "beta"):
+        registry.acquire(name)
+    model = registry.model
+
+    engine = ContinuousBatchingEngine(model, tokenizer, max_batch_size=8, max_queue_wait=0.05)
+    engine.start()
+    try:
+        jobs = [(prompt, adapter) for prompt in PROMPTS for adapter in ("alpha", "beta", None)]
+        futures = [
+            engine.submit(tokenizer.encode(prompt), max_new_tokens=6, temperature=0.0,
+                          ignore_eos=True, adapter=adapter)
+            for prompt, adapter in jobs
+        ]
+        results = [future.result(timeout=60) for future in futures]
+    finally:
+        engine.stop()
+
+    for (prompt, adapter), output in zip(jobs, results):
+        assert output == _reference(model, tokenizer, prompt, adapter)
+    # The adapters actually change the model
+    assert _reference(model, tokenizer, PROMPTS[0], "alpha") != _reference(model, tokenizer, PROMPTS[0], None)
+
+
+def test_lru_eviction_skips_pinned_adapters(registry, adapter_dirs):
+    registry, _ = registry
+    registry.max_loaded = 1
+    registry.acquire("alpha")
+    registry.acquire("beta")
+    # alpha is pinned by an in-flight request, so both stay resident
+    assert registry.loaded == ["alpha", "beta"]
+
+    # Once unpinned, the least recently used one goes
+    registry.release("alpha")
+    registry.release("beta")
+    assert registry.loaded == ["beta"]
+
+    registry.acquire("alpha")
+    registry.release("alpha")
+    assert registry.loaded == ["alpha"]
+    assert registry.stats()["evictions"] == 2
+
+
+def test_chat_selects_adapter_per_request(tiny_client, tiny_manager, adapter_dirs):
+    # Adapters are injected into the model in place; keep the shared tiny model clean
+    model, _ = build_tiny_model()
+    tiny_manager.model = tiny_manager.engine.model = model
+    tiny_manager.attach_adapters("tiny-gpt2")
+    for name, path in adapter_dirs.items():
+        tiny_manager.adapters.register(name, path)
+
+    payload = {"message": "What is LoRA?", "max_length": 6, "temperature": 0.0}
+    base = tiny_client.post("/chat", json=payload)
+    alpha = tiny_client.post("/chat", json={**payload, "adapter": "alpha"})
+    assert base.status_code == 200 and alpha.status_code == 200
+    assert base.json()["adapter"] is None
+    assert alpha.json()["adapter"] == "alpha"
+
+    assert tiny_client.post("/chat", json={**payload, "adapter": "missing"}).status_code == 404
+    assert tiny_client.get("/adapters").json()["loaded"] == ["alpha"]
+
+
+def _save_adapter(path, seed):
+    from peft import LoraConfig, get_peft_model
+
+    model, _ = build_tiny_model()
+    torch.manual_seed(seed)
+    config = LoraConfig(r=4, target_modules=["c_attn"], fan_in_fan_out=True, init_lora_weights=False)
+    get_peft_model(model, config).save_pretrained(str(path))
+
+
+def test_adapter_retrained_in_place_is_reloaded(tiny_manager, tmp_path):
+    path = tmp_path / "gamma"
+    _save_adapter(path, seed=3)
+
+    model, tokenizer = build_tiny_model()
+    tiny_manager.model = tiny_manager.engine.model = model
+    tiny_manager.attach_adapters("tiny-gpt2")
+    tiny_manager.adapters.register("gamma", str(path))
+
+    def generate():
+        tiny_manager.acquire_adapter("gamma")
+        try:
+            return tiny_manager.engine.generate(
+                tokenizer.encode(PROMPTS[0]), max_new_tokens=6, temperature=0.0,
+                ignore_eos=True, adapter="gamma"
+            )
+        finally:
+            tiny_manager.release_adapter("gamma")
+
+    before = generate()
+    past = tiny_manager.prefix_cache.warm(tiny_manager.model, tokenizer.encode("### Input:\n"), "gamma")
+    tiny_manager.sessions.put("s1", tokenizer.encode("### Input:\n"), past, adapter="gamma")
+
+    # Same name, same directory, new weights
+    _save_adapter(path, seed=4)
+    tiny_manager.adapters.register("gamma", str(path))
+    assert "gamma" not in tiny_manager.prefix_cache.roots
+    assert tiny_manager.sessions.get("s1").past is None
+    assert tiny_manager.sessions.get("s1").token_ids == tokenizer.encode("### Input:\n")
+
+    after = generate()
+    fresh = AdapterRegistry(build_tiny_model()[0], "tiny-gpt2")
+    fresh.register("gamma", str(path))
+    fresh.acquire("gamma")
+    assert after == _reference(fresh.model, tokenizer, PROMPTS[0], "gamma")[:len(after)]
+    assert after != before
+
+
+def test_reregister_while_pinned_queues_new_requests(registry, adapter_dirs):
+    registry, _ = registry
+    changed = []
+    registry.on_change = changed.append
+    registry.acquire("alpha")
+
+    registry.register("alpha", adapter_dirs["alpha"])
+    # The in-flight request keeps the weights it started with
+    assert registry.loaded == ["alpha"]
+    assert changed == ["alpha"]
+
+    # A new request does not pin the old weights again; it waits for them to drain
+    import threading
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (registry.acquire("alpha"), acquired.set()))
+    waiter.start()
+    assert not acquired.wait(0.2)
+    assert registry.stats()["pinned"] == {"alpha": 1}
+
+    registry.release("alpha")
+    assert acquired.wait(10)
+    waiter.join()
+    assert changed == ["alpha", "alpha"]
+    assert registry.loaded == ["alpha"]
+    assert registry.stats()["loads"] == 2 and registry.stats()["pinned"] == {"alpha": 1}
+
+
+def test_adapter_prefix_warmup_runs_off_event_loop(tiny_client, tiny_manager, adapter_dirs, monkeypatch):
+    import asyncio
+    import app.api as api
+
+    model, _ = build_tiny_model()
+    tiny_manager.model = tiny_manager.engine.model = model
+    tiny_manager.attach_adapters("tiny-gpt2")
+    tiny_manager.adapters.register("alpha", adapter_dirs["alpha"])
+    monkeypatch.setattr(api, "SYSTEM_PROMPT", "You are a helpful assistant.\n")
+    tiny_manager._prompt_parts = None
+
+    warm = tiny_manager.prefix_cache.warm
+    threads = []
+
+    def recording_warm(*args, **kwargs):
+        try:
+            asyncio.get_running_loop()
+            threads.append("event loop")
+        except RuntimeError:
+            threads.append("worker")
+        return warm(*args, **kwargs)
+
+    monkeypatch.setattr(tiny_manager.prefix_cache, "warm", recording_warm)
+    payload = {"message": "Hi", "max_length": 4, "temperature": 0.0, "adapter": "alpha"}
+    try:
+        for path in ("/chat", "/chat/stream"):
+            assert tiny_client.post(path, json=payload).status_code == 200
+            tiny_manager.prefix_cache.drop("alpha")
+    finally:
+        tiny_manager._prompt_parts = None
+    # The adapter's prompt head is warmed lazily, by a forward pass that must not stall the loop
+    assert threads == ["worker", "worker"]
@@ -0,0 +1,70 @@
+import time
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("fastapi")
+
+from concurrent.futures import CancelledError
+from fastapi import HTTPException
+
+from app.admission import AdmissionController
+from app.engine import ContinuousBatchingEngine
+
+
+def test_queue_depth_sheds_with_429():
+    admission = AdmissionController(max_queue_depth=2)
+    admission.acquire()
+    admission.acquire()
+    with pytest.raises(HTTPException) as exc:
+        admission.acquire()
+    assert exc.value.status_code == 429
+    assert "Retry-After" in exc.value.headers
+    assert admission.rejected == 1
+
+
+def test_deadline_shorter_than_queue_wait_sheds_with_503():
+    admission = AdmissionController(max_workers=1, max_queue_depth=10)
+    admission.avg_service_time = 5.0
+    admitted_at = admission.acquire(timeout=60)
+
+    # One request already holds the only slot, so the next would wait ~5s
+    with pytest.raises(HTTPException) as exc:
+        admission.acquire(timeout=1)
+    assert exc.value.status_code == 503
+
+    admission.release(admitted_at, completed=False)
+    admission.acquire(timeout=1)
+
+
+def test_cancel_frees_running_batch_slot(tiny_model):
+    model, tokenizer = tiny_model
+    engine = ContinuousBatchingEngine(model, tokenizer)
+    engine.start()
+    try:
+        future = engine.submit(tokenizer.encode("Keep going"), max_new_tokens=900, ignore_eos=True)
+        while engine.active_count == 0:
+            time.sleep(0.01)
+
+        assert future.cancel()
+        with pytest.raises(CancelledError):
+            future.result(timeout=10)
+        assert engine.active_count == 0
+        assert engine.cancelled == 1
+    finally:
+        engine.stop()
+
+
+def test_chat_deadline_returns_504_and_stops_generation(tiny_client, tiny_manager):
+    response = tiny_client.post("/chat", json={
+        "message": "Tell me everything",
+        "max_length": 900,
+        "temperature": 1.0,
+        "top_p": 1.0,
+        "timeout": 0.05
+    })
+    assert response.status_code == 504
+
+    deadline = time.time() + 10
+    while tiny_manager.engine.active_count and time.time() < deadline:
+        time.sleep(0.01)
+    assert tiny_manager.engine.active_count == 0
@@ -0,0 +1,58 @@
+import copy
+import random
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("datasets")
+
+from datasets import Dataset
+from transformers import DataCollatorForLanguageModeling, TrainingArguments
+
+from scripts.batching import BatchingTrainer, LengthSortedSampler, MegabatchLengthSampler, TokenCountingCollator
+
+
+def _padding(lengths, order, batch_size):
+    batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+    slots = sum(max(lengths[i] for i in batch) * len(batch) for batch in batches)
+    return 1 - sum(lengths) / slots
+
+
+def test_megabatches_group_lengths_and_reshuffle_each_epoch():
+    rng = random.Random(0)
+    lengths = [rng.randint(1, 512) for _ in range(1000)]
+    sampler = MegabatchLengthSampler(lengths, batch_size=8, megabatch_mult=10, seed=0)
+
+    first, second = list(sampler), list(sampler)
+    assert sorted(first) == sorted(second) == list(range(len(lengths)))
+    assert first != second
+    assert max(lengths[i] for i in first[:8]) == max(lengths)
+    assert _padding(lengths, first, 8) < 0.1 < _padding(lengths, list(range(len(lengths))), 8)
+    assert list(MegabatchLengthSampler(lengths, 8, 10, seed=0)) == first
+
+    assert [lengths[i] for i in LengthSortedSampler(lengths)] == sorted(lengths, reverse=True)
+
+
+def test_trainer_logs_tokens_per_second_and_padding(tiny_model, tmp_path):
+    model, tokenizer = tiny_model
+    rng = random.Random(0)
+    texts = [" ".join(["word"] * rng.randint(1, 40)) for _ in range(32)]
+    dataset = Dataset.from_dict({"input_ids": [tokenizer.encode(text) for text in texts]})
+    args = TrainingArguments(
+        output_dir=str(tmp_path), per_device_train_batch_size=4, max_steps=8, logging_steps=4,
+        report_to=[], save_strategy="no", seed=0
+    )
+
+    ratios = {}
+    for grouped in (False, True):
+        trainer = BatchingTrainer(
+            model=copy.deepcopy(model), args=args, train_dataset=dataset,
+            data_collator=TokenCountingCollator(DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)),
+            lengths={"train": [len(ids) for ids in dataset["input_ids"]]} if grouped else None
+        )
+        trainer.train()
+        logged = [entry for entry in trainer.state.log_history if "loss" in entry]
+        assert len(logged) == 2
+        assert all(entry["tokens_per_second"] > 0 for entry in logged)
+        ratios[grouped] = trainer.padding_ratio()
+    assert ratios[True] < ratios[False]
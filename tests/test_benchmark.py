@@ -0,0 +1,214 @@
+import json
+import math
+from functools import partial
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("nltk")
+pytest.importorskip("rouge_score")
+pytest.importorskip("sentence_transformers")
+
+import scripts.benchmark as benchmark_module
+from scripts.benchmark import ModelBenchmark
+from scripts.memory_profile import MemoryProfiler
+from scripts.text_metrics import score_corpus
+
+EXAMPLES = [
+    {"input": "What is LoRA?", "output": "Low-rank adaptation."},
+    {"input": "Explain quantization of neural network weights in a few words.", "output": "Fewer bits."},
+    {"input": "Hi", "output": "Hello"},
+    {"input": "Why does padding waste compute during batched generation?", "output": "Pad tokens."},
+    {"input": "Define perplexity.", "output": "exp of the loss."},
+]
+
+
+@pytest.fixture
+def benchmark(tiny_model, tmp_path):
+    bench = ModelBenchmark("tiny-gpt2", tmp_path / "test.jsonl", tmp_path / "results", batch_size=2)
+    bench.model, bench.tokenizer = tiny_model
+    bench.generation_kwargs = {"do_sample": False}
+    return bench
+
+
+def test_batched_predictions_match_single_generation_in_order(benchmark):
+    # A small window sends the longer examples through the sliding-window fallback
+    benchmark.max_context = 24
+    examples = EXAMPLES + [{"input": "word " * 30, "output": "done"}]
+    expected = [benchmark.generate_batch([benchmark.encode_prompt(example["input"])], 8)[0] for example in examples]
+
+    assert any(expected)
+    predictions = benchmark.evaluate(examples, max_length=8)
+    assert predictions == expected
+    assert [p["prediction"] for p in benchmark.predictions] == predictions
+    assert benchmark.results["throughput_samples_per_sec"] > 0
+
+
+def _reference_perplexity(model, tokenizer, examples):
+    """One unpadded forward pass per example"""
+    total_loss, total_tokens = 0.0, 0
+    for example in examples:
+        ids = torch.tensor([tokenizer.encode(f"### Input:\n{example['input']}\n\n### Output:\n{example['output']}")])
+        with torch.no_grad():
+            loss = model(input_ids=ids, labels=ids).loss.item()
+        total_loss += loss * (ids.shape[1] - 1)
+        total_tokens += ids.shape[1] - 1
+    return math.exp(total_loss / total_tokens)
+
+
+def test_batched_perplexity_matches_unpadded_passes(benchmark, tiny_model):
+    expected = _reference_perplexity(*tiny_model, EXAMPLES)
+    benchmark.evaluate(EXAMPLES, max_length=8)
+    assert benchmark.results["perplexity"] == pytest.approx(expected, rel=1e-4)
+
+
+def _sentencepiece_style_tokenizer(path):
+    """Metaspace BPE like Llama's: a word starting a string gets a "▁" it lacks after a newline"""
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast
+
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Metaspace(replacement="▁", prepend_scheme="first")
+    tokenizer.decoder = decoders.Metaspace(replacement="▁", prepend_scheme="first")
+    corpus = [f"### Input:\n{e['input']}\n\n### Output:\n{e['output']}" for e in EXAMPLES] * 20
+    tokenizer.train_from_iterator(corpus, trainers.BpeTrainer(vocab_size=300, special_tokens=["<unk>", "<s>", "</s>"]))
+    PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>", unk_token="<unk>"
+    ).save_pretrained(str(path))
+    return path
+
+
+def test_references_are_scored_as_training_tokenizes_them(tmp_path):
+    from scripts.make_tiny_model import build_tiny_model
+
+    model, tokenizer = build_tiny_model(tokenizer_path=_sentencepiece_style_tokenizer(tmp_path / "tokenizer"))
+    bench = ModelBenchmark("tiny-llama", tmp_path / "test.jsonl", tmp_path / "results", batch_size=2)
+    bench.model, bench.tokenizer = model, tokenizer
+    bench.generation_kwargs = {"do_sample": False}
+
+    # Encoded on its own, the reference would start with a "▁" piece training never sees
+    example = EXAMPLES[0]
+    prompt = bench.encode_prompt(example["input"])
+    assert bench.encode_example(example)[len(prompt):] != tokenizer.encode(example["output"], add_special_tokens=False)
+
+    bench.evaluate(EXAMPLES, max_length=4)
+    assert bench.results["perplexity"] == pytest.approx(_reference_perplexity(model, tokenizer, EXAMPLES), rel=1e-4)
+
+
+def test_perplexity_without_scored_tokens_is_inf(benchmark):
+    assert benchmark.evaluate([], max_length=8) == []
+    assert benchmark.results["perplexity"] == math.inf
+
+
+def test_sliding_window_scores_every_token_once(benchmark):
+    ids = list(range(100, 123))
+    benchmark.max_context, benchmark.stride = 8, 5
+    segments = benchmark.perplexity_segments(ids)
+
+    assert all(len(window) <= 8 for window, _ in segments)
+    scored = [token for window, context in segments for token in window[max(context, 1):]]
+    assert scored == ids[1:]
+
+    # Short sequences are a single window, long ones keep their tail
+    assert benchmark.perplexity_segments(ids[:8]) == [(ids[:8], 0)]
+    benchmark.evaluate([{"input": "word " * 40, "output": "done"}], max_length=4)
+    assert math.isfinite(benchmark.results["perplexity"]) and benchmark.results["perplexity"] > 0
+
+
+def test_chunked_evaluation_accumulates(benchmark, tiny_model, tmp_path):
+    whole = benchmark.evaluate(EXAMPLES, max_length=8)
+    perplexity = benchmark.results["perplexity"]
+
+    chunked = ModelBenchmark("tiny-gpt2", tmp_path / "test.jsonl", tmp_path / "chunked", batch_size=2)
+    chunked.model, chunked.tokenizer = tiny_model
+    chunked.generation_kwargs = {"do_sample": False}
+    predictions = chunked.evaluate(EXAMPLES[:2], max_length=8) + chunked.evaluate(EXAMPLES[2:], max_length=8)
+    assert predictions == whole
+    assert chunked.results["perplexity"] == pytest.approx(perplexity, rel=1e-4)
+    assert chunked.eval_totals["samples"] == len(EXAMPLES)
+
+
+class BatchDependentEncoder:
+    """Stands in for a sentence transformer whose embeddings shift with batch composition, as padding does"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, texts, **kwargs):
+        self.calls += 1
+        return np.array([[len(text) + 1, len(texts)] for text in texts], dtype=np.float32)
+
+
+def _streaming_benchmark(tiny_model, tmp_path, resume=False):
+    tmp_path.mkdir(exist_ok=True)
+    data_path = tmp_path / "test.jsonl"
+    data_path.write_text("\n".join(json.dumps(example) for example in EXAMPLES) + "\n")
+    bench = ModelBenchmark("tiny-gpt2", data_path, tmp_path / "results", batch_size=2, chunk_size=2, resume=resume,
+                           embedding_cache_dir=None)
+    bench.model, bench.tokenizer = tiny_model
+    bench.generation_kwargs = {"do_sample": False}
+    bench.semantic_model = BatchDependentEncoder()
+    return bench
+
+
+def test_resume_skips_examples_saved_before_a_crash(tiny_model, tmp_path, monkeypatch):
+    # Per-sample BLEU tokenizes with nltk's punkt model, which is not available offline
+    monkeypatch.setattr(benchmark_module, "score_corpus", partial(score_corpus, tokenize=str.split))
+    full = _streaming_benchmark(tiny_model, tmp_path / "full")
+    expected, _ = full.evaluate_stream(max_length=8)
+
+    interrupted = _streaming_benchmark(tiny_model, tmp_path)
+    evaluate = interrupted.evaluate
+    calls = []
+
+    def crash_on_second_chunk(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 2:
+            raise MemoryError("killed")
+        return evaluate(*args, **kwargs)
+
+    monkeypatch.setattr(interrupted, "evaluate", crash_on_second_chunk)
+    with pytest.raises(MemoryError):
+        interrupted.evaluate_stream(max_length=8)
+    checkpoint = tmp_path / "results" / "predictions.jsonl"
+    with open(checkpoint, "a") as f:
+        f.write('{"id": "torn')
+
+    resumed = _streaming_benchmark(tiny_model, tmp_path, resume=True)
+    predictions, references = resumed.evaluate_stream(max_length=8)
+    assert predictions == expected
+    assert references == [example["output"] for example in EXAMPLES]
+    assert resumed.results["resumed_examples"] == 2
+    assert resumed.eval_totals["samples"] == len(EXAMPLES) - 2
+    assert len(checkpoint.read_text().splitlines()) == 1 + len(EXAMPLES)
+    assert all("bleu_4" in record["scores"] for record in resumed.predictions)
+    # Semantic scores are checkpointed, not recomputed over a different batch on resume
+    assert [r["scores"] for r in resumed.predictions] == [r["scores"] for r in full.predictions]
+    encodes = resumed.semantic_model.calls
+    similarity = resumed.calculate_semantic_similarity(predictions, references)
+    assert resumed.semantic_model.calls == encodes
+    assert similarity == pytest.approx(full.calculate_semantic_similarity(expected, references))
+
+    changed = _streaming_benchmark(tiny_model, tmp_path, resume=True)
+    changed.generation_kwargs = {"do_sample": True}
+    with pytest.raises(ValueError):
+        changed.evaluate_stream(max_length=8)
+
+
+def test_memory_is_attributed_to_prefill_and_decode(benchmark):
+    assert not benchmark.memory.trace_python
+    benchmark.memory = MemoryProfiler(trace_python=True)
+    benchmark.memory.start()
+    try:
+        benchmark.evaluate(EXAMPLES, max_length=8)
+    finally:
+        benchmark.memory.stop()
+    benchmark.results["memory"] = benchmark.memory.summary()
+
+    phases = benchmark.results["memory"]["phases"]
+    assert phases["prefill"]["calls"] == phases["decode"]["calls"] == 3
+    assert "python_heap_peak_mb" in phases["decode"]
+    assert benchmark.memory_usage_mb() > 0
+    assert "| prefill | 3 |" in benchmark.memory_report()
+    assert "taken with tracemalloc on" in benchmark.memory_report()
@@ -0,0 +1,51 @@
+import gzip
+import json
+
+import pytest
+
+from scripts import data_stream
+from scripts.data_stream import iter_chunks, iter_records, load_records
+
+EXAMPLES = [{"input": f"question {i} " + "x" * (i % 7), "output": str(i)} for i in range(50)]
+
+
+@pytest.fixture(params=["jsonl", "json", "jsonl.gz", "json.gz"])
+def data_file(request, tmp_path):
+    path = tmp_path / f"data.{request.param}"
+    if request.param.startswith("jsonl"):
+        text = "\n".join(json.dumps(example) for example in EXAMPLES) + "\n"
+    else:
+        text = json.dumps(EXAMPLES, indent=2)
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "wt") as f:
+        f.write(text)
+    return path
+
+
+def test_streams_every_format(data_file, monkeypatch):
+    # A tiny read size makes elements straddle many reads
+    monkeypatch.setattr(data_stream, "READ_SIZE", 16)
+    assert list(iter_records(str(data_file))) == EXAMPLES
+
+
+def test_limit_stops_reading_early(tmp_path):
+    path = tmp_path / "data.jsonl"
+    path.write_text("\n".join(json.dumps(example) for example in EXAMPLES[:3]) + "\n{not json\n")
+    # The malformed line after the limit is never parsed
+    assert list(iter_records(str(path), limit=3)) == EXAMPLES[:3]
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_records(str(path)))
+
+
+def test_sample_is_reproducible_subset(data_file):
+    sample = list(load_records(str(data_file), sample=10))
+    assert len(sample) == 10
+    assert all(example in EXAMPLES for example in sample)
+    assert sample == list(load_records(str(data_file), sample=10))
+    assert sample != EXAMPLES[:10]
+
+
+def test_chunks_and_unsupported_formats(tmp_path):
+    assert [len(chunk) for chunk in iter_chunks(range(10), 4)] == [4, 4, 2]
+    with pytest.raises(ValueError):
+        list(iter_records(str(tmp_path / "data.csv")))
@@ -0,0 +1,97 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+import app.engine
+from app.engine import ContinuousBatchingEngine, cache_length, select_rows
+
+
+def reference_greedy(model, tokenizer, prompt_ids, max_new_tokens):
+    """One-at-a-time greedy decode with model.generate"""
+    inputs = torch.tensor([prompt_ids])
+    with torch.no_grad():
+        outputs = model.generate(
+            inputs,
+            attention_mask=torch.ones_like(inputs),
+            max_new_tokens=max_new_tokens,
+            min_new_tokens=max_new_tokens,
+            do_sample=False,
+            pad_token_id=tokenizer.eos_token_id
+        )
+    return outputs[0, inputs.shape[1]:].tolist()
+
+
+@pytest.fixture
+def engine(tiny_model):
+    model, tokenizer = tiny_model
+    engine = ContinuousBatchingEngine(model, tokenizer, max_batch_size=4, max_queue_wait=0.05)
+    engine.start()
+    yield engine
+    engine.stop()
+
+
+def test_batched_greedy_matches_sequential(tiny_model, engine):
+    """Padding-aware batching must not change greedy outputs"""
+    model, tokenizer = tiny_model
+    prompts = [
+        "What is machine learning?",
+        "Hi",
+        "Explain gradient descent in simple terms, please, with an example",
+        "How does backpropagation work?",
+        "What is cross-validation?",
+    ]
+    prompt_ids = [tokenizer.encode(p) for p in prompts]
+
+    # Different lengths so requests leave the batch at different steps
+    futures = [
+        engine.submit(ids, max_new_tokens=4 + i, temperature=0, ignore_eos=True)
+        for i, ids in enumerate(prompt_ids)
+    ]
+    results = [f.result(timeout=60) for f in futures]
+
+    for i, (ids, result) in enumerate(zip(prompt_ids, results)):
+        assert len(result) == 4 + i
+        assert result == reference_greedy(model, tokenizer, ids, 4 + i)
+
+
+def test_late_joiner_shares_decode_loop(tiny_model, engine):
+    """A request submitted mid-generation joins the running batch"""
+    model, tokenizer = tiny_model
+    long_ids = tokenizer.encode("A long running request")
+    short_ids = tokenizer.encode("Short")
+
+    long_future = engine.submit(long_ids, max_new_tokens=40, temperature=0, ignore_eos=True)
+    short_future = engine.submit(short_ids, max_new_tokens=2, temperature=0, ignore_eos=True)
+
+    assert short_future.result(timeout=60) == reference_greedy(model, tokenizer, short_ids, 2)
+    assert long_future.result(timeout=60) == reference_greedy(model, tokenizer, long_ids, 40)
+
+
+def test_decode_steps_reuse_the_batched_cache(tiny_model, engine, monkeypatch):
+    """The running batch's cache is only re-laid out when requests join, not per token"""
+    model, tokenizer = tiny_model
+    stacks = []
+    stack_caches = app.engine.stack_caches
+    monkeypatch.setattr(app.engine, "stack_caches", lambda caches: stacks.append(len(caches)) or stack_caches(caches))
+
+    steps = engine.steps
+    ids = tokenizer.encode("What is machine learning?")
+    assert engine.generate(ids, max_new_tokens=12, temperature=0, ignore_eos=True) == \
+        reference_greedy(model, tokenizer, ids, 12)
+    assert engine.steps - steps == 11
+    assert stacks == [1]
+
+
+def test_select_rows_trims_shared_padding():
+    key = torch.arange(3 * 5, dtype=torch.float).reshape(3, 1, 5, 1)
+    batched, lengths = select_rows(((key, key + 100),), [5, 2, 3], [1, 2])
+    assert lengths == [2, 3] and cache_length(batched) == 3
+    assert batched[0][0][:, 0, :, 0].tolist() == [[7, 8, 9], [12, 13, 14]]
+    assert batched[0][1][0, 0, :, 0].tolist() == [107, 108, 109]
+
+
+def test_stopped_engine_rejects_requests(tiny_model):
+    model, tokenizer = tiny_model
+    engine = ContinuousBatchingEngine(model, tokenizer)
+    with pytest.raises(RuntimeError):
+        engine.submit([1, 2, 3])
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("httpx")
+
+from scripts.load_test import RequestResult, percentiles, run_load, spawn_server, free_port, wait_until_ready, summarize
+from scripts.make_tiny_model import save_tiny_model
+
+
+def test_summary_counts_errors_and_inter_token_gaps():
+    ok = RequestResult(0.0)
+    ok.status, ok.latency, ok.first_token = 200, 0.5, 0.1
+    ok.token_times, ok.tokens = [0.1, 0.2, 0.4], 3
+    failed = RequestResult(0.0)
+    failed.status, failed.error = 503, "Server busy"
+
+    summary = summarize([ok, failed], 1.0, [], {"mode": "closed-loop"})
+
+    assert summary["error_rate"] == 0.5
+    assert summary["status_codes"] == {"200": 1, "503": 1}
+    assert summary["tokens_per_sec"] == 3.0
+    assert summary["inter_token_latency"]["p50_ms"] == pytest.approx(150.0)
+    assert summary["time_to_first_token"]["p99_ms"] == pytest.approx(100.0)
+    assert percentiles([])["p50_ms"] is None
+
+
+@pytest.fixture(scope="module")
+def server_url(tmp_path_factory):
+    model_path = str(save_tiny_model(tmp_path_factory.mktemp("models") / "tiny-gpt2", seed=1))
+    port = free_port()
+    server = spawn_server(model_path, port)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_ready(url, server)
+        yield url
+    finally:
+        server.terminate()
+        server.wait(30)
+
+
+@pytest.mark.parametrize("mode", [{"concurrency": 4}, {"rate": 50.0}])
+def test_stream_load_against_tiny_model(server_url, mode):
+    results = asyncio.run(run_load(server_url, 8, max_length=8, rss_interval=0.05, **mode))
+
+    assert results["succeeded"] == 8 and results["error_rate"] == 0.0
+    assert results["latency"]["p99_ms"] >= results["latency"]["p50_ms"] > 0
+    assert results["time_to_first_token"]["p50_ms"] is not None
+    assert results["generated_tokens"] > 0
+    assert results["server_rss_mb"]["peak"] > 0
+
+
+def test_chat_load_against_tiny_model(server_url):
+    results = asyncio.run(run_load(server_url, 4, concurrency=2, stream=False, max_length=8,
+                                   count_tokens=lambda text: len(text.split())))
+
+    assert results["endpoint"] == "/chat"
+    assert results["succeeded"] == 4
+    assert results["inter_token_latency"]["p50_ms"] is None
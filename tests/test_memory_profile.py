@@ -0,0 +1,48 @@
+import mmap
+import tracemalloc
+
+import pytest
+
+pytest.importorskip("psutil")
+np = pytest.importorskip("numpy")
+
+from scripts.memory_profile import MemoryProfiler
+
+
+def test_phase_reports_transient_peak_and_net_growth():
+    profiler = MemoryProfiler(interval=0.001)
+    profiler.start()
+    try:
+        with profiler.phase("spike"):
+            buffer = np.ones(64 * 1024 * 1024, dtype=np.uint8)
+            del buffer
+        with profiler.phase("keep"):
+            kept = np.ones(64 * 1024 * 1024, dtype=np.uint8)
+            # Fresh anonymous pages, touched so they count: malloc'd memory may reuse
+            # pages already resident from earlier tests and leave RSS unchanged
+            mapped = mmap.mmap(-1, 64 * 1024 * 1024)
+            np.frombuffer(mapped, dtype=np.uint8).fill(1)
+    finally:
+        profiler.stop()
+    summary = profiler.summary()
+
+    spike, keep = summary["phases"]["spike"], summary["phases"]["keep"]
+    # Freed before the phase ended: only the peak remembers it
+    assert spike["python_heap_peak_mb"] >= 60
+    assert spike["python_heap_delta_mb"] < 1
+    assert keep["rss_delta_mb"] >= 60
+    assert keep["python_heap_delta_mb"] >= 60
+    assert summary["peak_rss_mb"] >= keep["peak_rss_mb"]
+    assert summary["python_heap_traced"]
+    assert not tracemalloc.is_tracing()
+    del kept
+    mapped.close()
+
+
+def test_phases_without_tracemalloc_still_track_rss():
+    profiler = MemoryProfiler(trace_python=False)
+    for _ in range(2):
+        with profiler.phase("load"):
+            pass
+    assert profiler.phases["load"]["calls"] == 2
+    assert "python_heap_delta_mb" not in profiler.phases["load"]
@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("prometheus_client")
+pytest.importorskip("torch")
+
+import app.api as api
+
+
+def test_metrics_exposes_serving_latencies(tiny_client, tiny_manager, monkeypatch):
+    monkeypatch.setattr(api, "model_manager", tiny_manager)
+    response = tiny_client.post("/chat", json={"message": "hello", "max_length": 4, "temperature": 0.0})
+    assert response.status_code == 200
+
+    scrape = tiny_client.get("/metrics")
+    assert scrape.status_code == 200
+    assert scrape.headers["content-type"].startswith("text/plain")
+    text = scrape.text
+    for stage in ("tokenize", "prefill", "decode", "detokenize"):
+        assert f'qlorax_stage_duration_seconds_count{{stage="{stage}"}}' in text
+    for name in ("qlorax_time_to_first_token_seconds_count", "qlorax_batch_size_count",
+                 "qlorax_request_tokens_per_second_count", "qlorax_queue_depth",
+                 'qlorax_cache_hit_ratio{cache="prefix"}', "qlorax_model_rss_bytes"):
+        assert name in text
+    assert 'qlorax_http_requests_total{endpoint="/chat",method="POST",status="200"}' in text
+
+
+def test_stats_keeps_json_snapshot(tiny_client):
+    stats = tiny_client.get("/stats").json()
+    assert "admission" in stats
@@ -0,0 +1,42 @@
+import random
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("datasets")
+
+from scripts.packing import PackedDataCollator, pack_batch, pack_lengths
+
+TEXTS = ["hello world this is", "a b", "the quick brown fox jumps", "x", "one two three four five six seven"]
+
+
+def test_bins_cover_every_example_within_capacity():
+    rng = random.Random(0)
+    lengths = [rng.randint(1, 64) for _ in range(500)]
+    bins = pack_lengths(lengths, 64)
+
+    assert sorted(i for members in bins for i in members) == list(range(len(lengths)))
+    assert all(sum(lengths[i] for i in members) <= 64 for members in bins)
+    # Best-fit decreasing stays close to the lower bound of total / capacity blocks
+    assert len(bins) <= 1.1 * sum(lengths) / 64 + 1
+
+
+def test_packed_examples_do_not_see_each_other(tiny_model):
+    model, tokenizer = tiny_model
+    ids = [tokenizer.encode(text) for text in TEXTS]
+    packed = pack_batch({"input_ids": ids, "labels": ids}, max_length=8)
+    features = [dict(zip(packed, row)) for row in zip(*packed.values())]
+    assert sorted(len(f["input_ids"]) for f in features) == [4, 7, 8]
+
+    batch = PackedDataCollator(tokenizer.pad_token_id or 0)(features)
+    labels = batch.pop("labels")
+    with torch.no_grad():
+        logits = model(**batch).logits
+        for row, feature in enumerate(features):
+            starts = [i for i, p in enumerate(feature["position_ids"]) if p == 0] + [len(feature["position_ids"])]
+            for start, end in zip(starts, starts[1:]):
+                alone = model(torch.tensor([feature["input_ids"][start:end]])).logits[0]
+                assert torch.allclose(logits[row, start:end], alone, atol=1e-5)
+                if start:
+                    assert labels[row, start] == -100
+    assert (labels[batch["input_ids"] == (tokenizer.pad_token_id or 0)] == -100).any()
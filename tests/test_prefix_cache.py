@@ -0,0 +1,128 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from app.engine import cache_length, to_legacy_cache
+from app.prefix_cache import PrefixCache, generate_with_prefix
+
+
+def _fake_cache(length, layers=1):
+    return tuple(
+        (torch.zeros(1, 2, length, 4), torch.zeros(1, 2, length, 4)) for _ in range(layers)
+    )
+
+
+def test_longest_prefix_match_and_edge_split():
+    cache = PrefixCache()
+    cache.insert([1, 2, 3, 4], _fake_cache(4))
+    cache.insert([1, 2, 5], _fake_cache(3))
+
+    matched, past = cache.match([1, 2, 3, 4, 9])
+    assert matched == 4 and cache_length(past) == 4
+
+    matched, past = cache.match([1, 2, 5, 6])
+    assert matched == 3 and cache_length(past) == 3
+
+    # Diverges inside an edge: the cached descendant is cropped to the shared part
+    matched, past = cache.match([1, 2, 7])
+    assert matched == 2 and cache_length(past) == 2
+
+    matched, past = cache.match([8, 9])
+    assert matched == 0 and past is None
+
+    stats = cache.stats()
+    assert stats["lookups"] == 4
+    assert stats["hits"] == 3
+    assert stats["entries"] == 2
+
+
+def test_lru_eviction_by_bytes():
+    entry_bytes = 2 * _fake_cache(4)[0][0].nelement() * 4
+    cache = PrefixCache(max_bytes=2 * entry_bytes)
+    cache.insert([1, 2, 3, 4], _fake_cache(4))
+    cache.insert([5, 6, 7, 8], _fake_cache(4))
+    cache.match([1, 2, 3, 4])
+    cache.insert([9, 10, 11, 12], _fake_cache(4))
+
+    assert cache.stats()["evictions"] == 1
+    assert cache.match([5, 6, 7, 8])[0] == 0
+    assert cache.match([1, 2, 3, 4])[0] == 4
+    assert cache.total_bytes <= cache.max_bytes
+
+
+def test_generate_with_prefix_matches_uncached(tiny_model):
+    model, tokenizer = tiny_model
+    cache = PrefixCache()
+    prefix = "### Input:\n"
+    kwargs = dict(max_new_tokens=8, do_sample=False, pad_token_id=tokenizer.eos_token_id)
+
+    for text in ("What is LoRA?\n\n### Output:\n", "Explain attention.\n\n### Output:\n"):
+        inputs, outputs = generate_with_prefix(model, tokenizer, cache, prefix, text, **kwargs)
+        with torch.no_grad():
+            expected = model.generate(inputs, attention_mask=torch.ones_like(inputs), **kwargs)
+        assert outputs[0].tolist() == expected[0].tolist()
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["entries"] == 1
+
+
+def test_generate_with_prefix_bypasses_cache_off_token_boundary(tiny_model):
+    model, tokenizer = tiny_model
+    cache = PrefixCache()
+    kwargs = dict(max_new_tokens=4, do_sample=False, pad_token_id=tokenizer.eos_token_id)
+
+    # "### Inp" + "ut:" tokenizes as "### Input:" jointly, which the prefix ids do not start
+    inputs, outputs = generate_with_prefix(model, tokenizer, cache, "### Inp", "ut:\nHi\n", **kwargs)
+    assert inputs[0].tolist() == tokenizer.encode("### Input:\nHi\n")
+    with torch.no_grad():
+        expected = model.generate(inputs, attention_mask=torch.ones_like(inputs), **kwargs)
+    assert outputs[0].tolist() == expected[0].tolist()
+
+    stats = cache.stats()
+    assert stats["bypasses"] == 1
+    assert stats["lookups"] == 0 and stats["entries"] == 0
+
+
+def test_manager_reuses_system_prompt(tiny_manager, monkeypatch):
+    import app.api as api
+
+    monkeypatch.setattr(api, "SYSTEM_PROMPT", "You are a helpful assistant for QLORAX.\n")
+    tiny_manager._prompt_parts = None
+    tiny_manager.warm_prefix_cache()
+
+    prompt_ids, past = tiny_manager.prepare_prompt("What is QLoRA?", 20)
+    head = tiny_manager.prompt_parts()["head_ids"]
+    assert prompt_ids[:len(head)] == head
+    assert cache_length(past) == len(head)
+
+    with torch.no_grad():
+        full = tiny_manager.model(torch.tensor([prompt_ids]), use_cache=True)
+    reference = to_legacy_cache(full.past_key_values)
+    assert torch.allclose(past[0][0], reference[0][0][:, :, :len(head)], atol=1e-5)
+
+    cached_ids = tiny_manager.engine.generate(prompt_ids, max_new_tokens=8, temperature=0.0, past=past)
+    plain_ids = tiny_manager.engine.generate(prompt_ids, max_new_tokens=8, temperature=0.0)
+    assert cached_ids == plain_ids
+    assert tiny_manager.prefix_cache.stats()["hits"] >= 1
+
+
+def test_manager_tokenizes_prompt_like_training(tiny_manager, monkeypatch):
+    import app.api as api
+
+    monkeypatch.setattr(api, "SYSTEM_PROMPT", "")
+    monkeypatch.setattr(api, "PROMPT_TEMPLATE", "### Inp{message}\n")
+    tiny_manager._prompt_parts = None
+    try:
+        tiny_manager.warm_prefix_cache()
+        head = tiny_manager.prompt_parts()["head_ids"]
+
+        # The head merges with this message, so its cached state must not be spliced in
+        prompt_ids, past = tiny_manager.prepare_prompt("ut: hi", 20)
+        assert prompt_ids == tiny_manager.tokenizer.encode("### Input: hi\n")
+        assert not tiny_manager.shares_head(prompt_ids)
+        assert cache_length(past) < len(head)
+        assert prompt_ids[:cache_length(past)] == head[:cache_length(past)]
+    finally:
+        tiny_manager._prompt_parts = None
+        tiny_manager.prefix_cache.clear()
@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("fastapi")
+
+import app.api as api
+from scripts.make_tiny_model import save_tiny_model
+
+
+@pytest.fixture(scope="module")
+def tiny_model_dir(tmp_path_factory):
+    return str(save_tiny_model(tmp_path_factory.mktemp("models") / "tiny-gpt2", seed=1))
+
+
+@pytest.fixture
+def serving(tiny_manager, monkeypatch):
+    """Make tiny_manager the globally served model, restoring the global afterwards"""
+    monkeypatch.setattr(api, "model_manager", tiny_manager)
+    yield tiny_manager
+    if api.model_manager is not tiny_manager:
+        api.model_manager.stop_engine()
+
+
+def test_reload_drains_old_model_before_freeing_it(serving, tiny_model_dir):
+    old = serving
+    in_flight = old.begin_request()
+
+    reloader = threading.Thread(target=api.reload_model, args=(tiny_model_dir,))
+    reloader.start()
+    deadline = time.time() + 60
+    while old.successor is None and time.time() < deadline:
+        time.sleep(0.01)
+
+    # Swapped and already serving, while the old instance waits for its request
+    new = api.model_manager
+    assert new is not old and new.is_loaded
+    assert api.reload_status["status"] == "draining"
+    assert old.is_loaded and old.engine is not None
+    assert old.begin_request() is new
+    new.end_request()
+
+    in_flight.end_request()
+    reloader.join(60)
+    assert api.reload_status["status"] == "ready"
+    assert old.model is None and old.engine is None
+    assert new.engine.generate(new.encode_message("hi"), max_new_tokens=4, temperature=0.0)
+
+
+def test_load_model_endpoint_reloads_in_background(serving, tiny_model_dir):
+    from fastapi.testclient import TestClient
+
+    client = TestClient(api.app)
+    response = client.post("/load_model", params={"model_path": tiny_model_dir, "warmup": "false"})
+    assert response.status_code == 200
+
+    # TestClient runs background tasks before returning
+    assert client.get("/load_model/status").json()["status"] == "ready"
+    assert api.model_manager.model_name == tiny_model_dir
+
+    chat = client.post("/chat", json={"message": "hello", "max_length": 4, "temperature": 0.0})
+    assert chat.status_code == 200
+    assert chat.json()["model_name"] == tiny_model_dir
+
+
+def test_startup_load_reports_readiness(tiny_model_dir, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(api, "model_manager", None)
+    monkeypatch.setattr(api, "MODEL_PATH", tiny_model_dir)
+    monkeypatch.setattr(api, "EAGER_LOAD", True)
+
+    with TestClient(api.app) as client:
+        assert client.get("/livez").status_code == 200
+
+        deadline = time.time() + 60
+        ready = client.get("/readyz")
+        while ready.status_code == 503 and time.time() < deadline:
+            assert ready.json()["load"]["status"] in ("idle", "loading", "warming", "draining", "ready")
+            time.sleep(0.05)
+            ready = client.get("/readyz")
+
+        assert ready.status_code == 200
+        assert ready.json()["model_name"] == tiny_model_dir
+        assert ready.json()["load"]["progress"] == 1.0
@@ -0,0 +1,126 @@
+import time
+
+import numpy as np
+import pytest
+
+from app.response_cache import InMemoryBackend, RedisBackend, ResponseCache, normalize_message
+
+
+def test_normalize_message():
+    assert normalize_message("  What is   Machine\nLearning? ") == "what is machine learning?"
+
+
+@pytest.mark.parametrize("backend_name", ["memory", "redis"])
+def test_exact_key_and_size_eviction(backend_name):
+    if backend_name == "memory":
+        backend = InMemoryBackend(max_entries=2, ttl=60)
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        backend = RedisBackend(client=fakeredis.FakeRedis(), max_entries=2, ttl=60)
+    cache = ResponseCache(backend)
+    params = dict(model_version="m1", max_length=50, temperature=0.0, top_p=None)
+
+    cache.put("What is ML?", "answer 1", **params)
+    assert cache.get("what is  ml?", **params) == "answer 1"
+    assert cache.get("What is ML?", **{**params, "model_version": "m2"}) is None
+    assert cache.get("What is ML?", **{**params, "max_length": 60}) is None
+
+    cache.put("Q2", "answer 2", **params)
+    cache.put("Q3", "answer 3", **params)
+    assert len(backend) == 2
+    assert cache.get("What is ML?", **params) is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_sampled_requests_are_not_cached():
+    cache = ResponseCache(max_temperature=0.3)
+    cache.put("hello", "hi", model_version="m", temperature=0.9)
+    assert cache.get("hello", model_version="m", temperature=0.9) is None
+    assert len(cache.backend) == 0
+
+
+def test_ttl_expiry():
+    backend = InMemoryBackend(ttl=0.05)
+    cache = ResponseCache(backend)
+    cache.put("hello", "hi", model_version="m", temperature=0.0)
+    time.sleep(0.1)
+    assert cache.get("hello", model_version="m", temperature=0.0) is None
+
+
+VOCABULARY = ["machine", "learning", "neural", "network", "what", "is"]
+
+
+def _bag_of_words(texts):
+    return np.array([[t.count(w) for w in VOCABULARY] for t in texts], dtype=np.float32)
+
+
+def test_semantic_near_duplicate_lookup():
+    cache = ResponseCache(embed=_bag_of_words, similarity_threshold=0.9)
+    cache.put("What is machine learning?", "ML answer", model_version="m", temperature=0.0)
+
+    assert cache.get("machine learning, what is it", model_version="m", temperature=0.0) == "ML answer"
+    assert cache.get("What is a neural network?", model_version="m", temperature=0.0) is None
+    # Near-duplicates never cross model versions or sampling params
+    assert cache.get("machine learning, what is it", model_version="m2", temperature=0.0) is None
+    assert cache.stats()["semantic_hits"] == 1
+
+
+def test_semantic_hits_are_shared_through_redis():
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+
+    def replica():
+        backend = RedisBackend(client=fakeredis.FakeRedis(server=server), max_entries=2, ttl=60)
+        return ResponseCache(backend, embed=_bag_of_words, similarity_threshold=0.9)
+
+    replica().put("What is machine learning?", "ML answer", model_version="m", temperature=0.0)
+    # Another replica, or this one after a restart, finds the near-duplicate too
+    other = replica()
+    assert other.get("machine learning, what is it", model_version="m", temperature=0.0) == "ML answer"
+    assert other.stats()["semantic_hits"] == 1
+
+    # Embeddings of evicted entries are dropped instead of growing without bound
+    other.put("What is a neural network?", "NN answer", model_version="m", temperature=0.0)
+    other.put("network network", "x", model_version="m", temperature=0.0)
+    other.put("is is", "y", model_version="m", temperature=0.0)
+    _, keys = other.backend.vectors(other._scope("m", {"temperature": 0.0}))
+    assert len(keys) <= 2
+    assert other.get("machine learning, what is it", model_version="m", temperature=0.0) is None
+
+
+def test_chat_serves_repeats_from_cache(tiny_client, tiny_manager):
+    tiny_manager.response_cache = ResponseCache()
+    payload = {"message": "What is machine learning?", "max_length": 8, "temperature": 0.0}
+
+    first = tiny_client.post("/chat", json=payload).json()
+    second = tiny_client.post("/chat", json={**payload, "message": "what is machine  learning?"}).json()
+    assert first["cached"] is False
+    assert second["cached"] is True
+    assert second["response"] == first["response"]
+
+    sampled = tiny_client.post("/chat", json={**payload, "temperature": 1.0}).json()
+    assert sampled["cached"] is False
+
+
+def test_chat_cache_calls_stay_off_event_loop(tiny_client, tiny_manager):
+    import asyncio
+
+    threads = []
+
+    def embed(texts):
+        try:
+            asyncio.get_running_loop()
+            threads.append("event loop")
+        except RuntimeError:
+            threads.append("worker")
+        return np.ones((len(texts), 2), dtype=np.float32)
+
+    previous = tiny_manager.response_cache
+    tiny_manager.response_cache = ResponseCache(embed=embed, similarity_threshold=0.9)
+    try:
+        payload = {"message": "Is the loop free?", "max_length": 4, "temperature": 0.0}
+        assert tiny_client.post("/chat", json=payload).json()["cached"] is False
+        assert tiny_client.post("/chat", json=payload).json()["cached"] is True
+    finally:
+        tiny_manager.response_cache = previous
+    assert threads and set(threads) == {"worker"}
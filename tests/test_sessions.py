@@ -0,0 +1,67 @@
+import time
+import asyncio
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("fastapi")
+
+from app.sessions import SessionStore
+
+
+def fake_cache(positions, layers=2):
+    return tuple((torch.zeros(1, 2, positions, 4), torch.zeros(1, 2, positions, 4)) for _ in range(layers))
+
+
+def test_lru_eviction_by_memory_budget_keeps_history():
+    one_session = 2 * 2 * (2 * 10 * 4) * 4  # layers x (k, v) x elements x float32
+    store = SessionStore(max_bytes=2 * one_session)
+
+    store.put("a", list(range(11)), fake_cache(10))
+    store.put("b", list(range(12)), fake_cache(10))
+    store.get("a")  # touch a so b is the least recently used
+    store.put("c", list(range(11)), fake_cache(10))
+
+    # b loses only its cache; the conversation itself survives
+    evicted = store.get("b")
+    assert evicted is not None and evicted.past is None and evicted.nbytes == 0
+    assert evicted.token_ids == list(range(12))
+    assert store.get("a").past is not None and store.get("c").past is not None
+    assert len(store) == 3
+    assert store.total_bytes == 2 * one_session
+    assert store.evictions == 1
+
+
+def test_ttl_expiry():
+    store = SessionStore(ttl=0.05)
+    store.put("a", [1, 2, 3], fake_cache(2))
+    time.sleep(0.1)
+    assert store.get("a") is None
+    assert store.total_bytes == 0
+
+
+@pytest.mark.parametrize("batching", [True, False])
+def test_follow_up_turn_reuses_cache(tiny_manager, batching):
+    """A cached follow-up turn must produce the same reply as re-encoding the whole history"""
+    manager = tiny_manager
+    if not batching:
+        manager.stop_engine()
+
+    async def conversation():
+        await manager.agenerate_response("Hello there", 8, temperature=0, session_id="s1")
+        session = manager.sessions.get("s1")
+        history = list(session.token_ids)
+        assert session.cached_tokens == len(history) - 1
+
+        follow_up = await manager.agenerate_response("And then?", 8, temperature=0, session_id="s1")
+
+        # Same conversation without any cached state
+        output_ids, _ = await manager.run_generation(
+            history + manager.encode_message("And then?"), 8, temperature=0
+        )
+        return follow_up, manager.tokenizer.decode(output_ids, skip_special_tokens=True).strip()
+
+    follow_up, stateless = asyncio.run(conversation())
+    assert follow_up == stateless
+
+    # The stored conversation now spans both turns
+    assert len(manager.sessions.get("s1").token_ids) > len(manager.encode_message("Hello there"))
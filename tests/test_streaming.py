@@ -0,0 +1,58 @@
+import json
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("fastapi")
+
+from app.streaming import IncrementalDetokenizer
+
+
+def test_incremental_detokenizer_matches_full_decode(tiny_model):
+    """Concatenated deltas must equal decoding the whole sequence at once"""
+    _, tokenizer = tiny_model
+    text = "Héllo wörld — naïve café 🚀 tokens, streamed one by one."
+    token_ids = tokenizer.encode(text)
+
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    chunks = [detokenizer.push(token_id) for token_id in token_ids]
+    chunks.append(detokenizer.flush())
+
+    assert "".join(chunks) == tokenizer.decode(token_ids)
+    # Partial multi-byte characters are held back rather than emitted as garbage
+    assert not any("�" in chunk for chunk in chunks)
+
+
+def read_sse(response):
+    events = []
+    for line in response.iter_lines():
+        if line.startswith("data: "):
+            events.append(json.loads(line[len("data: "):]))
+    return events
+
+
+def test_chat_stream_matches_chat(tiny_client):
+    """Streamed tokens reassemble into the same reply as /chat for greedy decoding"""
+    payload = {"message": "What is machine learning?", "max_length": 12, "temperature": 0}
+
+    reply = tiny_client.post("/chat", json=payload).json()["response"]
+
+    with tiny_client.stream("POST", "/chat/stream", json=payload) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = read_sse(response)
+
+    assert events[-1]["done"] is True
+    assert "".join(e["token"] for e in events if "token" in e).strip() == reply
+
+
+def test_chat_websocket(tiny_client):
+    payload = {"message": "Hello", "max_length": 8, "temperature": 0}
+
+    with tiny_client.websocket_connect("/chat/ws") as websocket:
+        for _ in range(2):
+            websocket.send_json(payload)
+            while True:
+                event = websocket.receive_json()
+                assert "error" not in event
+                if event.get("done"):
+                    break
@@ -0,0 +1,112 @@
+import random
+
+import numpy as np
+import pytest
+
+pytest.importorskip("nltk")
+pytest.importorskip("rouge_score")
+
+from scripts import text_metrics
+from scripts.text_metrics import compute_text_metrics, score_corpus
+
+WORDS = "the model learns low rank updates for attention and feed forward layers".split()
+
+
+def _pairs(n, seed=0):
+    rng = random.Random(seed)
+    predictions = [" ".join(rng.choices(WORDS, k=rng.randint(1, 12))) for _ in range(n)]
+    references = [" ".join(rng.choices(WORDS, k=rng.randint(1, 12))) for _ in range(n)]
+    references[:5] = predictions[:5]
+    return predictions, references
+
+
+def test_parallel_metrics_identical_to_serial():
+    predictions, references = _pairs(300)
+    serial = compute_text_metrics(predictions, references, workers=1, tokenize=str.split)
+
+    assert len(predictions) >= text_metrics.MIN_PARALLEL_PAIRS
+    parallel = compute_text_metrics(predictions, references, workers=2, tokenize=str.split)
+    assert parallel == serial
+    assert serial["exact_match"] >= 5 / 300
+
+
+def test_rouge_and_exact_match_match_reference_implementation():
+    from rouge_score import rouge_scorer
+
+    predictions, references = _pairs(40, seed=1)
+    metrics = compute_text_metrics(predictions, references, workers=1, tokenize=str.split)
+    scorer = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
+    scores = [scorer.score(ref, pred) for pred, ref in zip(predictions, references)]
+    for name, key in (("rouge_1", "rouge1"), ("rouge_2", "rouge2"), ("rouge_l", "rougeL")):
+        assert metrics[name] == np.mean([score[key].fmeasure for score in scores])
+    exact = sum(p.strip().lower() == r.strip().lower() for p, r in zip(predictions, references))
+    assert metrics["exact_match"] == exact / len(predictions)
+
+
+def test_numpy_scores_match_library_per_sample_and_corpus():
+    from nltk.translate.bleu_score import SmoothingFunction, corpus_bleu, sentence_bleu
+    from rouge_score import rouge_scorer
+
+    predictions, references = _pairs(60, seed=2)
+    # Empty and one-word texts exercise the zero-count branches
+    predictions += ["", "attention", "Running the models!"]
+    references += ["the model", "", "the model runs"]
+    summary, per_sample = score_corpus(predictions, references, tokenize=str.split)
+
+    smoothing = SmoothingFunction().method1
+    scorer = rouge_scorer.RougeScorer(["rouge1", "rouge2", "rougeL"], use_stemmer=True)
+    for i, (pred, ref) in enumerate(zip(predictions, references)):
+        for name, weights in text_metrics.BLEU_WEIGHTS.items():
+            expected = sentence_bleu([ref.lower().split()], pred.lower().split(),
+                                     weights=weights, smoothing_function=smoothing)
+            assert per_sample[name][i] == pytest.approx(expected, abs=1e-12)
+        rouge = scorer.score(ref, pred)
+        for name, rouge_type in text_metrics.ROUGE_TYPES.items():
+            assert per_sample[name][i] == pytest.approx(rouge[rouge_type].fmeasure, abs=1e-12)
+
+    expected_corpus = corpus_bleu([[ref.lower().split()] for ref in references],
+                                  [pred.lower().split() for pred in predictions],
+                                  weights=(0.25, 0.25, 0.25, 0.25), smoothing_function=smoothing)
+    assert summary["corpus_bleu_4"] == pytest.approx(expected_corpus * 100)
+
+    library = compute_text_metrics(predictions, references, workers=1, tokenize=str.split)
+    for name, value in library.items():
+        assert summary[name] == pytest.approx(value)
+
+
+def test_lcs_chunks_agree_with_a_single_chunk(monkeypatch):
+    predictions, references = _pairs(50, seed=3)
+    _, expected = score_corpus(predictions, references, tokenize=str.split)
+    monkeypatch.setattr(text_metrics, "LCS_CHUNK_CELLS", 64)
+    _, chunked = score_corpus(predictions, references, tokenize=str.split)
+    assert np.array_equal(chunked["rouge_l"], expected["rouge_l"])
+
+
+def test_embedding_cache_encodes_each_text_once(tmp_path):
+    calls = []
+
+    def encode(texts):
+        calls.append(list(texts))
+        return np.array([[len(text), text.count("a"), 1.0] for text in texts])
+
+    cache = text_metrics.EmbeddingCache(tmp_path, "org/encoder")
+    first = cache.embed(["alpha", "beta", "alpha"], encode)
+    assert calls == [["alpha", "beta"]]
+    assert np.array_equal(first[0], first[2])
+
+    # A fresh instance reads the shards written by the first one
+    cache = text_metrics.EmbeddingCache(tmp_path, "org/encoder")
+    second = cache.embed(["beta", "gamma"], encode)
+    assert calls[-1] == ["gamma"]
+    assert np.array_equal(second[0], first[1])
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_rowwise_cosine_matches_sklearn():
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    rng = np.random.default_rng(0)
+    a, b = rng.normal(size=(20, 8)), rng.normal(size=(20, 8))
+    a[3] = 0
+    expected = [cosine_similarity([x], [y])[0][0] for x, y in zip(a, b)]
+    assert np.allclose(text_metrics.rowwise_cosine(a, b), expected)
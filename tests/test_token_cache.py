@@ -0,0 +1,58 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("datasets")
+pytest.importorskip("transformers")
+
+from datasets import Dataset
+
+import scripts.token_cache as token_cache
+from scripts.token_cache import cache_key, file_digest, load_or_build, tokenizer_fingerprint
+
+
+def test_key_follows_contents_not_timestamps(tmp_path, tiny_model):
+    tokenizer = tiny_model[1]
+    data_path = tmp_path / "train.jsonl"
+    data_path.write_text(json.dumps({"input": "a", "output": "b"}) + "\n")
+    cache_dir = str(tmp_path / "cache")
+    key = cache_key(str(data_path), tokenizer, "{input}{output}", 16, cache_dir)
+
+    os.utime(data_path, ns=(0, 0))
+    assert cache_key(str(data_path), tokenizer, "{input}{output}", 16, cache_dir) == key
+    assert cache_key(str(data_path), tokenizer, "{input} {output}", 16, cache_dir) != key
+    assert cache_key(str(data_path), tokenizer, "{input}{output}", 32, cache_dir) != key
+    assert cache_key(str(data_path), tokenizer, "{input}{output}", 16, cache_dir, split="eval") != key
+
+    # Tokenizing leaves truncation state on the backend; it must not change the fingerprint
+    fingerprint = tokenizer_fingerprint(tokenizer)
+    tokenizer(["a b c"], truncation=True, max_length=2)
+    assert tokenizer_fingerprint(tokenizer) == fingerprint
+
+    data_path.write_text(json.dumps({"input": "a", "output": "c"}) + "\n")
+    os.utime(data_path, ns=(0, 1))
+    assert cache_key(str(data_path), tokenizer, "{input}{output}", 16, cache_dir) != key
+
+
+def test_unchanged_file_is_not_rehashed(tmp_path, monkeypatch):
+    data_path = tmp_path / "train.jsonl"
+    data_path.write_text("{}\n")
+    digest = file_digest(str(data_path), str(tmp_path))
+
+    monkeypatch.setattr(token_cache.hashlib, "sha256", lambda: pytest.fail("re-hashed"))
+    assert file_digest(str(data_path), str(tmp_path)) == digest
+
+
+def test_build_runs_once_per_key(tmp_path):
+    calls = []
+
+    def build():
+        calls.append(1)
+        return Dataset.from_dict({"input_ids": [[1, 2], [3]]})
+
+    first = load_or_build("key", build, str(tmp_path))
+    second = load_or_build("key", build, str(tmp_path))
+    assert first["input_ids"] == second["input_ids"] == [[1, 2], [3]]
+    assert len(calls) == 1
+    assert not [p for p in tmp_path.iterdir() if ".tmp-" in p.name]
@@ -0,0 +1,116 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("datasets")
+pytest.importorskip("peft")
+pytest.importorskip("wandb")
+
+import yaml
+from datasets import Dataset
+from transformers import DataCollatorForSeq2Seq
+
+from scripts.train_production import ProductionTrainer
+
+EXAMPLES = [{"input": f"question {i}", "output": f"answer {i}"} for i in range(20)]
+
+
+@pytest.fixture
+def trainer(tmp_path):
+    data_path = tmp_path / "train.jsonl"
+    data_path.write_text("\n".join(json.dumps(example) for example in EXAMPLES) + "\n")
+    config = {
+        "data_path": str(data_path), "output_dir": str(tmp_path / "out"), "validation_split": 0.0,
+        "tokenized_cache_dir": str(tmp_path / "tokenized")
+    }
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(yaml.safe_dump(config))
+    return ProductionTrainer(str(config_path))
+
+
+def test_streams_training_prompts(trainer):
+    dataset = trainer.load_and_prepare_data()
+    assert len(dataset) == len(EXAMPLES)
+    assert dataset[0]["text"] == "### Input:\nquestion 0\n\n### Output:\nanswer 0"
+
+    trainer.config["data_limit"] = 5
+    assert trainer.load_and_prepare_data()["text"] == [
+        f"### Input:\nquestion {i}\n\n### Output:\nanswer {i}" for i in range(5)
+    ]
+
+
+def test_edited_data_file_is_reread(trainer):
+    assert len(trainer.load_and_prepare_data()) == len(EXAMPLES)
+    with open(trainer.config["data_path"], "a") as f:
+        f.write(json.dumps({"input": "new", "output": "example"}) + "\n")
+    assert len(trainer.load_and_prepare_data()) == len(EXAMPLES) + 1
+
+
+def test_sample_packing_fills_blocks(trainer, tiny_model):
+    trainer.tokenizer = tiny_model[1]
+    trainer.config.update({"sample_packing": True, "max_length": 32})
+    packed = trainer.tokenize_dataset(trainer.load_and_prepare_data())
+
+    stats = trainer.packing_stats["train"]
+    assert stats["examples"] == len(EXAMPLES)
+    assert stats["blocks"] == len(packed) < len(EXAMPLES)
+    assert stats["efficiency"] > 0.8
+    assert all(len(ids) <= 32 for ids in packed["input_ids"])
+
+
+def test_tokenized_dataset_is_cached_until_inputs_change(trainer, tiny_model, monkeypatch):
+    trainer.tokenizer = tiny_model[1]
+    first = trainer.tokenize_dataset(trainer.load_and_prepare_data())
+
+    monkeypatch.setattr(Dataset, "map", lambda *args, **kwargs: pytest.fail("re-tokenized"))
+    cached = trainer.tokenize_dataset(trainer.load_and_prepare_data())
+    assert cached["input_ids"] == first["input_ids"]
+    monkeypatch.undo()
+
+    trainer.config["max_length"] = 4
+    assert max(trainer.tokenize_dataset(trainer.load_and_prepare_data())["length"]) == 4
+
+
+def test_parallel_tokenization_matches_single_process(trainer, tiny_model):
+    trainer.tokenizer = tiny_model[1]
+    trainer.config.update({"tokenized_cache_dir": None, "tokenization_batch_size": 3})
+    dataset = trainer.load_and_prepare_data()
+
+    trainer.config["tokenization_num_proc"] = 1
+    single = trainer.tokenize_dataset(dataset)
+    trainer.config["tokenization_num_proc"] = 3
+    parallel = trainer.tokenize_dataset(dataset)
+
+    assert parallel["input_ids"] == single["input_ids"]
+    assert trainer.tokenization_stats["train"]["num_proc"] == 3
+    assert trainer.tokenization_stats["train"]["tokens_per_second"] > 0
+
+    del trainer.config["tokenization_num_proc"]
+    assert trainer.tokenization_workers(10) == 1
+    assert trainer.tokenization_workers(10 ** 6) == (os.cpu_count() or 1)
+
+
+def test_prompt_is_masked_out_of_the_loss(trainer, tiny_model):
+    tokenizer = tiny_model[1]
+    trainer.tokenizer = tokenizer
+    trainer.config.update({"train_on_inputs": False, "tokenized_cache_dir": None})
+    tokenized = trainer.tokenize_dataset(trainer.load_and_prepare_data())
+
+    for example, input_ids, labels in zip(EXAMPLES, tokenized["input_ids"], tokenized["labels"]):
+        first = next(i for i, label in enumerate(labels) if label != -100)
+        assert labels[first:] == input_ids[first:]
+        assert tokenizer.decode(input_ids[:first]) == f"### Input:\n{example['input']}\n\n### Output:\n"
+        assert tokenizer.decode(input_ids[first:]) == example["output"]
+
+    # The padding collator keeps the mask rather than rebuilding labels from input_ids
+    batch = DataCollatorForSeq2Seq(tokenizer=tokenizer, label_pad_token_id=-100)(
+        [{key: tokenized[i][key] for key in ("input_ids", "attention_mask", "labels")} for i in range(2)]
+    )
+    assert (batch["labels"][0, :first] == -100).all()
+
+    # Outputs cut off entirely by max_length leave nothing to learn from
+    trainer.config["max_length"] = 4
+    with pytest.raises(ValueError):
+        trainer.tokenize_dataset(trainer.load_and_prepare_data())
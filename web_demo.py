@@ -12,11 +12,14 @@ import time
 import json
 from pathlib import Path
 
+from app.prefix_cache import PrefixCache, generate_with_prefix
+
 class QLORAXWebDemo:
     def __init__(self, model_path="models/production-model"):
         self.model_path = Path(model_path)
         self.model = None
         self.tokenizer = None
+        self.prefix_cache = PrefixCache()
         self.load_model()
     
     def load_model(self):
@@ -56,31 +59,27 @@ class QLORAXWebDemo:
             return "❌ Model not loaded. Please check the model path.", ""
         
         try:
-            # Format prompt
-            formatted_prompt = f"### Input:\n{prompt}\n\n### Output:\n"
-            
-            # Tokenize
-            inputs = self.tokenizer.encode(formatted_prompt, return_tensors="pt")
-            
-            # Generate
+            # Generate, reusing the cached KV state of the "### Input:" header
             start_time = time.time()
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    inputs,
-                    max_length=inputs.shape[1] + max_length,
-                    temperature=temperature,
-                    top_p=top_p,
-                    do_sample=True,
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    eos_token_id=self.tokenizer.eos_token_id,
-                    repetition_penalty=1.1
-                )
+            inputs, outputs = generate_with_prefix(
+                self.model,
+                self.tokenizer,
+                self.prefix_cache,
+                "### Input:\n",
+                f"{prompt}\n\n### Output:\n",
+                max_new_tokens=max_length,
+                temperature=temperature,
+                top_p=top_p,
+                do_sample=True,
+                pad_token_id=self.tokenizer.eos_token_id,
+                eos_token_id=self.tokenizer.eos_token_id,
+                repetition_penalty=1.1
+            )
             
             inference_time = time.time() - start_time
             
             # Decode response
-            full_response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            response = full_response[len(formatted_prompt):].strip()
+            response = self.tokenizer.decode(outputs[0][inputs.shape[1]:], skip_special_tokens=True).strip()
             
             # Stats
             stats = f"⚡ Generated in {inference_time*1000:.1f}ms | {outputs.shape[1] - inputs.shape[1]} tokens"